@@ -0,0 +1,139 @@
+'''
+Name:           image_processing.py
+Description:    Background processing of cookbook cover images
+                An uploaded cover is saved as it is, so the request returns
+                quickly; a pool of worker threads then turns it upright
+                (EXIF orientation), shrinks it to MAX_IMAGE_SIZE, re-encodes
+                it as JPEG and creates its renditions.
+
+While a cover is processed its cookbook is marked image_pending and pages
+show a placeholder. The number of workers is set with
+settings.COOKBOOK_IMAGE_WORKERS; 0 processes images straight away in the
+calling thread (e.g. for tests and management commands).
+'''
+
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection
+from PIL import Image, UnidentifiedImageError
+
+from . import renditions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+
+# Maximum width and height of a stored cover image
+MAX_IMAGE_SIZE = (1600, 1600)
+
+_executor = None
+_executor_lock = threading.Lock()
+# Jobs queued or running, so the same work is not queued twice
+_queued = set()
+
+
+def _worker_count() -> int:
+    return getattr(settings, 'COOKBOOK_IMAGE_WORKERS', DEFAULT_WORKERS)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_worker_count(),
+                                           thread_name_prefix='cover_image')
+        return _executor
+
+
+def _run(job):
+    '''
+    Run a job in a worker thread
+    '''
+    function, args = job
+    try:
+        function(*args)
+    except Exception:
+        logger.exception('Cover image job %s%s failed', function.__name__, args)
+    finally:
+        with _executor_lock:
+            _queued.discard(job)
+        # each worker thread has its own database connection
+        connection.close()
+
+
+def _submit(function, *args):
+    '''
+    Queue a job for the worker pool (or run it now if there are no workers)
+    '''
+    if _worker_count() == 0:
+        function(*args)
+        return
+
+    job = (function, args)
+    with _executor_lock:
+        if job in _queued:
+            return
+        _queued.add(job)
+    _get_executor().submit(_run, job)
+
+
+def process_cover(cookbook_id: int, name: str):
+    '''
+    Process a cookbook's uploaded cover image
+
+    The processed image replaces the upload, unless the cookbook's image was
+    changed in the meantime; the upload is deleted if no cookbook uses it.
+    If processing fails, the upload is shown as it is.
+
+    @param cookbook_id: id of the cookbook
+    @param name: storage name of the uploaded image
+    '''
+    from .models import IMAGE_FOLDER, Cookbook
+
+    storage = Cookbook._meta.get_field('image').storage
+    try:
+        try:
+            with storage.open(name, 'rb') as image_file:
+                image = renditions.resize(image_file, MAX_IMAGE_SIZE)
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+            logger.warning('Cover image "%s" could not be read', name, exc_info=True)
+            return
+
+        processed_name = storage.save(posixpath.join(IMAGE_FOLDER, 'cover.jpg'),
+                                      ContentFile(renditions.encode(image, 'JPEG')))
+        renditions.create_renditions(storage, processed_name)
+
+        updated = Cookbook.objects.filter(pk=cookbook_id, image=name).update(
+            image=processed_name, image_pending=False)
+        if updated:
+            if processed_name != name:
+                Cookbook.release_image(name)
+        else:
+            # cookbook deleted or given another image while processing
+            Cookbook.release_image(processed_name)
+    finally:
+        # if processing failed, nothing more can be done: show the upload as it is
+        Cookbook.objects.filter(pk=cookbook_id, image=name, image_pending=True).update(image_pending=False)
+
+
+def queue_cover(cookbook_id: int, name: str):
+    '''
+    Queue an uploaded cover image for processing (see process_cover), unless
+    it is queued already
+    '''
+    _submit(process_cover, cookbook_id, name)
+
+
+def queue_renditions(name: str):
+    '''
+    Queue the creation of the renditions of a stored cover image
+    '''
+    from .models import Cookbook
+
+    _submit(renditions.create_renditions, Cookbook._meta.get_field('image').storage, name)
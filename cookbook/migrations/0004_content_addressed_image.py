@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-19 20:08
+
+import cookbook.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cookbook', '0003_alter_cookbook_author'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cookbook',
+            name='image',
+            field=models.ImageField(blank=True, storage=cookbook.storage.ContentAddressedStorage(), upload_to='images/'),
+        ),
+    ]
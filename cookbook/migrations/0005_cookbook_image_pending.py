@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-19 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cookbook', '0004_content_addressed_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cookbook',
+            name='image_pending',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
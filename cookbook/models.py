@@ -1,5 +1,12 @@
 from django.db import models
-#from .storage import OverwriteStorage
+from django.utils.functional import cached_property
+import posixpath
+
+from . import image_processing, renditions
+from .storage import ContentAddressedStorage
+
+# Folder (in MEDIA_ROOT) of cookbook cover images
+IMAGE_FOLDER = 'images'
 
 
 class Author(models.Model):
@@ -22,9 +29,110 @@ class Cookbook(models.Model):
     publish_date = models.PositiveSmallIntegerField()
     url = models.CharField(max_length=200, blank=True)
     edition = models.CharField(max_length=20, blank=True)
-    #image = models.ImageField(upload_to='images/', storage=OverwriteStorage(), blank=True)
-    image = models.ImageField(upload_to='images/', blank=True)
-    
+    image = models.ImageField(upload_to=IMAGE_FOLDER + '/', storage=ContentAddressedStorage(), blank=True)
+    # True while an uploaded image is being processed (see image_processing.py)
+    image_pending = models.BooleanField(default=False, editable=False)
+
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        cookbook = super().from_db(db, field_names, values)
+        # Remember the stored image so it can be released when it is replaced
+        loaded = dict(zip(field_names, values))
+        if 'image' in loaded:
+            cookbook._stored_image = loaded['image']
+        return cookbook
+
+
+    def save(self, *args, **kwargs):
+        # A new upload is processed in the background once saved (see signals.py)
+        if self.image.name != getattr(self, '_stored_image', None):
+            self.image_pending = bool(self.image)
+        super().save(*args, **kwargs)
+
+
+    @classmethod
+    def release_image(cls, name: str) -> bool:
+        """
+        Delete a cover image file (and its renditions) if no cookbook uses it
+
+        @param name: storage name of the image
+        @return: True if the image was deleted
+        """
+        if not name or cls.objects.filter(image=name).exists():
+            return False
+
+        storage = cls._meta.get_field('image').storage
+        renditions.delete_renditions(storage, name)
+        storage.delete(name)
+        return True
+
+
+    @classmethod
+    def unused_images(cls) -> list:
+        """
+        Return the names of stored cover images and renditions no cookbook uses
+
+        e.g. left behind by an upload that failed, or when a file was replaced
+        while its cookbook was being saved
+        """
+        storage = cls._meta.get_field('image').storage
+        used_images = set(cls.objects.exclude(image='').values_list('image', flat=True))
+        used_originals = {
+            (posixpath.dirname(name), posixpath.splitext(posixpath.basename(name))[0])
+            for name in used_images
+        }
+
+        unused = []
+        folders = [IMAGE_FOLDER]
+        while folders:
+            folder = folders.pop()
+            try:
+                subfolders, files = storage.listdir(folder)
+            except FileNotFoundError:
+                continue
+            folders += [posixpath.join(folder, f) for f in subfolders]
+
+            for filename in files:
+                name = posixpath.join(folder, filename)
+                if posixpath.basename(folder) == renditions.RENDITION_FOLDER:
+                    if renditions.rendition_original(name) not in used_originals:
+                        unused.append(name)
+                elif name not in used_images:
+                    unused.append(name)
+
+        return sorted(unused)
+
+
+    def _cover(self, size: str):
+        """
+        Return a rendition of the cover image, or None if it is not ready
+        (in which case its creation is queued)
+        """
+        if not self.image:
+            return None
+        if self.image_pending:
+            # queued again in case the job was lost (e.g. the server restarted)
+            image_processing.queue_cover(self.pk, self.image.name)
+            return None
+
+        cover = renditions.get_rendition(self.image, size, create=False)
+        if cover is None:
+            image_processing.queue_renditions(self.image.name)
+        return cover
+
+
+    @cached_property
+    def list_cover(self):
+        """Cover image rendition shown in the cookbook list (None if not ready)"""
+        return self._cover('list')
+
+
+    @cached_property
+    def detail_cover(self):
+        """Cover image rendition shown on the cookbook page (None if not ready)"""
+        return self._cover('detail')
+
 
     def __str__(self):
         return f"'{self.title}' by {self.author}"
@@ -0,0 +1,212 @@
+'''
+Name:           renditions.py
+Description:    Resized copies (renditions) of cookbook cover images
+                The list and detail pages show small covers, so instead of
+                the uploaded photo they use a rendition of the right size,
+                in JPEG and (if Pillow supports it) WebP.
+
+Renditions are stored next to the original image, in a "renditions" folder,
+e.g. images/renditions/cover.list.3f2a9c1d0b7e.jpg. The name includes a
+fingerprint of the original file, so a rendition never changes once written
+and can be cached by browsers forever; a new upload gets new names.
+
+Renditions are created by the background image worker (see
+image_processing.py) once a cover is uploaded, or the first time they are
+needed; pages show a placeholder until then.
+'''
+
+import hashlib
+import io
+import logging
+import posixpath
+from typing import NamedTuple, Optional
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+logger = logging.getLogger(__name__)
+
+# Maximum size (width, height) of each rendition, twice the size shown on
+# the page so covers stay sharp on high resolution screens
+RENDITION_SIZES = {
+    'list': (50, 74),
+    'detail': (300, 450),
+}
+RENDITION_FOLDER = 'renditions'
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+# Time browsers may keep a rendition (renditions never change)
+RENDITION_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class Rendition(NamedTuple):
+    '''
+    Rendition of an image, in JPEG and optionally WebP
+    '''
+    url: str
+    webp_url: Optional[str]
+    width: int
+    height: int
+
+
+def webp_supported() -> bool:
+    '''
+    Return True if Pillow can write WebP images
+    '''
+    return features.check('webp')
+
+
+def _fingerprint(storage, name: str) -> str:
+    '''
+    Return a value that changes whenever the file stored under name changes
+    '''
+    stamp = f'{name}:{storage.size(name)}:{storage.get_modified_time(name).timestamp()}'
+    return hashlib.sha1(stamp.encode('utf-8')).hexdigest()[:12]
+
+
+def rendition_name(name: str, size: str, fingerprint: str, extension: str) -> str:
+    '''
+    Return the storage name of a rendition of the image stored under name
+    '''
+    folder, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(folder, RENDITION_FOLDER, f'{stem}.{size}.{fingerprint}.{extension}')
+
+
+def resize(image_file, max_size: tuple) -> Image.Image:
+    '''
+    Return the image, turned upright (following its EXIF orientation)
+    and shrunk to fit within max_size
+    '''
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(max_size, Image.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        return image
+
+
+def encode(image: Image.Image, image_format: str) -> bytes:
+    '''
+    Return the image encoded in the given format (JPEG or WEBP)
+    '''
+    output = io.BytesIO()
+    if image_format == 'JPEG':
+        if image.mode == 'RGBA':
+            # JPEG has no transparency: show transparent parts as white
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        image.convert('RGB').save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(output, 'WEBP', quality=WEBP_QUALITY, method=6)
+    return output.getvalue()
+
+
+def _store(storage, name: str, content: bytes):
+    '''
+    Save a rendition, unless another request already did
+    '''
+    if hasattr(storage, 'save_derived'):
+        # content addressed storage (see storage.py): keep the rendition's name
+        storage.save_derived(name, ContentFile(content))
+        return
+
+    if storage.exists(name):
+        return
+    saved_name = storage.save(name, ContentFile(content))
+    if saved_name != name:
+        # written at the same time by another request: storage picked
+        # another name for this copy, which is not needed
+        storage.delete(saved_name)
+
+
+def get_rendition(image_field, size: str, create: bool=True) -> Optional[Rendition]:
+    '''
+    Return the rendition of an image, creating it if it does not exist yet
+
+    @param image_field: image (ImageFieldFile) e.g. cookbook.image
+    @param size: name of the rendition size, one of RENDITION_SIZES
+    @param create: False to return None rather than create a missing rendition
+    @return: rendition (None if there is no image or it can not be read)
+    '''
+    if not image_field:
+        return None
+    return stored_rendition(image_field.storage, image_field.name, size, create)
+
+
+def stored_rendition(storage, name: str, size: str, create: bool=True) -> Optional[Rendition]:
+    '''
+    Return the rendition of the image stored under name (see get_rendition)
+    '''
+    try:
+        fingerprint = _fingerprint(storage, name)
+    except OSError:
+        logger.warning('Cover image "%s" not found', name)
+        return None
+
+    jpeg_name = rendition_name(name, size, fingerprint, 'jpg')
+    webp_name = rendition_name(name, size, fingerprint, 'webp') if webp_supported() else None
+
+    names = [n for n in (jpeg_name, webp_name) if n is not None]
+    if not all(storage.exists(n) for n in names):
+        if not create:
+            return None
+        try:
+            with storage.open(name, 'rb') as image_file:
+                image = resize(image_file, RENDITION_SIZES[size])
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+            logger.warning('Cover image "%s" could not be read', name, exc_info=True)
+            return None
+
+        _store(storage, jpeg_name, encode(image, 'JPEG'))
+        if webp_name is not None:
+            _store(storage, webp_name, encode(image, 'WEBP'))
+        width, height = image.size
+    else:
+        with storage.open(jpeg_name, 'rb') as rendition_file, Image.open(rendition_file) as image:
+            width, height = image.size
+
+    return Rendition(
+        url=storage.url(jpeg_name),
+        webp_url=None if webp_name is None else storage.url(webp_name),
+        width=width,
+        height=height)
+
+
+def rendition_original(name: str) -> tuple:
+    '''
+    Return the folder and file name (without extension) of the image a
+    rendition was made from, e.g. ('images', 'cover') for
+    images/renditions/cover.list.3f2a9c1d0b7e.jpg
+    '''
+    rendition_folder, filename = posixpath.split(name)
+    stem = filename.rsplit('.', 3)[0]
+    return posixpath.dirname(rendition_folder), stem
+
+
+def delete_renditions(storage, name: str):
+    '''
+    Delete all renditions of the image stored under name
+    '''
+    folder, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    rendition_folder = posixpath.join(folder, RENDITION_FOLDER)
+    try:
+        _, files = storage.listdir(rendition_folder)
+    except OSError:
+        return
+
+    for rendition_file in files:
+        rendition = posixpath.join(rendition_folder, rendition_file)
+        if rendition_original(rendition) == (folder, stem):
+            storage.delete(rendition)
+
+
+def create_renditions(storage, name: str):
+    '''
+    Create all renditions of the image stored under name (e.g. when it is uploaded)
+    '''
+    for size in RENDITION_SIZES:
+        stored_rendition(storage, name, size)
@@ -0,0 +1,52 @@
+'''
+Name: signals.py
+Description: Signal handlers for the Cookbook app
+'''
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import image_processing
+from .models import Cookbook
+
+
+def cookbook_saved(sender, instance, raw, **kwargs):
+    '''
+    Queue a newly uploaded cover image for processing, and release the
+    image it replaced
+    '''
+    if raw:
+        return
+
+    stored_image = getattr(instance, '_stored_image', None)
+    if stored_image != instance.image.name:
+        if stored_image:
+            _release_on_commit(stored_image)
+        if instance.image_pending:
+            cookbook_id, name = instance.pk, instance.image.name
+            transaction.on_commit(lambda: image_processing.queue_cover(cookbook_id, name))
+    instance._stored_image = instance.image.name
+
+
+def cookbook_deleted(sender, instance, **kwargs):
+    '''
+    Release a deleted cookbook's cover image
+    '''
+    _release_on_commit(getattr(instance, '_stored_image', instance.image.name))
+
+
+def _release_on_commit(name):
+    '''
+    Delete an image no longer used, once the change is committed (so the
+    file is kept if the change is rolled back)
+    '''
+    if name:
+        transaction.on_commit(lambda: Cookbook.release_image(name))
+
+
+def connect_signals():
+    '''
+    Connect signal handlers; called when the Cookbook app is ready
+    '''
+    post_save.connect(cookbook_saved, sender=Cookbook, dispatch_uid='cookbook_saved')
+    post_delete.connect(cookbook_deleted, sender=Cookbook, dispatch_uid='cookbook_deleted')
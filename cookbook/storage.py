@@ -1,29 +1,102 @@
+'''
+Name:           storage.py
+Description:    Content addressed file storage for cookbook cover images
+                Files are named by the SHA-256 hash of their content, in
+                sharded folders, e.g. an upload "images/cover.jpg" is stored
+                as "images/3f/2a/3f2a...9c.jpg".
+
+Identical uploads are stored once. A stored file never changes (new content
+gets a new name), so browsers may cache it for good. Because a file can be
+shared by several cookbooks, it is only deleted once no cookbook uses it
+(see signals.py and the media_manager command).
+'''
+
+import hashlib
+import posixpath
+import re
+
+from django.core.files import File
 from django.core.files.storage import FileSystemStorage
-from django.conf import settings
-import os
-
-class OverwriteStorage(FileSystemStorage):
-
-    def get_available_name(self, name):
-        """Returns a filename that's free on the target storage system, and
-        available for new content to be written to.
-
-        Found at http://djangosnippets.org/snippets/976/
-
-        This file storage solves overwrite on upload problem. Another
-        proposed solution was to override the save method on the model
-        like so (from https://code.djangoproject.com/ticket/11663):
-
-        def save(self, *args, **kwargs):
-            try:
-                this = MyModelName.objects.get(id=self.id)
-                if this.MyImageFieldName != self.MyImageFieldName:
-                    this.MyImageFieldName.delete()
-            except: pass
-            super(MyModelName, self).save(*args, **kwargs)
-        """
-        # If the filename already exists, remove it as if it was a true file system
+from django.utils.deconstruct import deconstructible
+
+# Number of folder levels, each named by 2 hex digits of the hash, so no
+# folder holds too many files
+SHARD_LEVELS = 2
+
+# Name of a content addressed file: shard folders followed by the hash
+CONTENT_NAME_PATTERN = re.compile(
+    r'(?:^|/)' + r'[0-9a-f]{2}/' * SHARD_LEVELS + r'[0-9a-f]{64}(\.[a-z0-9]+)?$')
+
+
+def content_hash(content) -> str:
+    '''
+    Return the SHA-256 hash (hex) of a file's content
+    '''
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def is_content_name(name: str) -> bool:
+    '''
+    Return True if name is the name of a content addressed file
+    '''
+    return CONTENT_NAME_PATTERN.search(name) is not None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    '''
+    File system storage naming files by the hash of their content
+    '''
+
+    def content_name(self, name: str, content) -> str:
+        '''
+        Return the name content is stored under: the folder of name, the shard
+        folders and the hash, with the (lower case) extension of name
+        '''
+        folder, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        file_hash = content_hash(content)
+        shards = [file_hash[i * 2:i * 2 + 2] for i in range(SHARD_LEVELS)]
+        return posixpath.join(folder, *shards, file_hash + extension)
+
+
+    def save(self, name, content, max_length=None):
+        '''
+        Save content under its content name, unless the same content is already stored
+
+        @return: name of the stored file
+        '''
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        stored_name = self.content_name(name, content)
+        if self.exists(stored_name):
+            return stored_name
+
+        return self._save_exact(stored_name, content, max_length)
+
+
+    def save_derived(self, name, content, max_length=None):
+        '''
+        Save a file derived from a stored file (e.g. a resized copy) under the
+        given name, which must already be unique to its content
+        '''
         if self.exists(name):
-            os.remove(os.path.join(settings.MEDIA_ROOT, name))
-        return name
+            return name
+        return self._save_exact(name, content, max_length)
 
+
+    def _save_exact(self, name, content, max_length):
+        saved_name = super().save(name, content, max_length)
+        if saved_name != name:
+            # the same file was written at the same time by another request:
+            # storage picked another name for this copy, which is not needed
+            self.delete(saved_name)
+        return name
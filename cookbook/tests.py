@@ -5,8 +5,29 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import datetime
+import io
+import posixpath
+import shutil
+import tempfile
+from unittest import mock
+
 import django
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from PIL import Image
+
+from home.pagination import PAGE_SIZE
+from meal.models import Meal
+from recipe.models import Recipe
+
+from . import image_processing
+from .image_processing import process_cover
+from .models import Author, Cookbook
+from .renditions import RENDITION_SIZES
+from .storage import is_content_name
+from .views import immutable_media
 
 # TODO: Configure your database in settings.py and sync before running tests.
 
@@ -23,4 +44,178 @@ class SimpleTest(TestCase):
         """
         Tests that 1 + 1 always equals 2.
         """
-        self.assertEqual(1 + 1, 2)
\ No newline at end of file
+        self.assertEqual(1 + 1, 2)
+
+
+class CoverRenditionTest(TestCase):
+    """Tests for the resized copies of cookbook cover images."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        # process uploaded images straight away rather than in worker threads
+        media_settings = override_settings(MEDIA_ROOT=media_root, COOKBOOK_IMAGE_WORKERS=0)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def _cookbook(self, size=(1200, 1800), color='orange', title='Soups', exif=None, process=True):
+        image_file = io.BytesIO()
+        Image.new('RGB', size, color).save(image_file, 'JPEG', exif=exif or Image.Exif())
+        upload = SimpleUploadedFile('cover.jpg', image_file.getvalue(), content_type='image/jpeg')
+        with self.captureOnCommitCallbacks(execute=process):
+            cookbook = Cookbook.objects.create(title=title, publish_date=2020, image=upload)
+        return Cookbook.objects.get(pk=cookbook.pk)
+
+    def test_upload_processed(self):
+        """
+        Tests that an upload is turned upright, shrunk and replaced by the processed image.
+        """
+        exif = Image.Exif()
+        exif[0x0112] = 6  # orientation: rotated 90 degrees
+        cookbook = self._cookbook(size=(3000, 1000), exif=exif, process=False)
+        upload_name = cookbook.image.name
+        self.assertTrue(cookbook.image_pending)
+        with mock.patch.object(image_processing, 'queue_cover') as queue_cover:
+            self.assertIsNone(cookbook.list_cover)
+            self.assertContains(self.client.get('/cookbook/list'), 'cover_placeholder.svg')
+        # a pending cover whose job was lost is queued again
+        queue_cover.assert_called_with(cookbook.pk, upload_name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_cover(cookbook.pk, upload_name)
+
+        cookbook = Cookbook.objects.get(pk=cookbook.pk)
+        self.assertFalse(cookbook.image_pending)
+        self.assertNotEqual(cookbook.image.name, upload_name)
+        self.assertFalse(cookbook.image.storage.exists(upload_name))
+        with cookbook.image.open('rb') as image_file, Image.open(image_file) as image:
+            self.assertEqual(image.size, (533, 1600))
+        self.assertIsNotNone(cookbook.list_cover)
+
+    def test_failed_processing_shows_upload(self):
+        """
+        Tests that an upload is shown as it is if processing it fails.
+        """
+        cookbook = self._cookbook(process=False)
+        with mock.patch.object(image_processing.renditions, 'create_renditions', side_effect=OSError('Disk full')):
+            with self.assertRaises(OSError):
+                image_processing.process_cover(cookbook.pk, cookbook.image.name)
+
+        cookbook = Cookbook.objects.get(pk=cookbook.pk)
+        self.assertFalse(cookbook.image_pending)
+
+    def test_renditions_created_on_upload(self):
+        """
+        Tests that renditions are stored next to the original and fit their size.
+        """
+        cookbook = self._cookbook()
+        storage = cookbook.image.storage
+        _, files = storage.listdir(posixpath.join(posixpath.dirname(cookbook.image.name), 'renditions'))
+        self.assertEqual(len(files), len(RENDITION_SIZES) * (2 if cookbook.list_cover.webp_url else 1))
+
+        self.assertEqual((cookbook.list_cover.width, cookbook.list_cover.height), (49, 74))
+        self.assertEqual((cookbook.detail_cover.width, cookbook.detail_cover.height), (300, 450))
+        stem = posixpath.splitext(posixpath.basename(cookbook.image.name))[0]
+        self.assertIn(f'/renditions/{stem}.list.', cookbook.list_cover.url)
+
+    def test_list_page_uses_rendition(self):
+        """
+        Tests that the list page shows the small rendition, not the original.
+        """
+        cookbook = self._cookbook()
+        response = self.client.get('/cookbook/list')
+        self.assertContains(response, cookbook.list_cover.url)
+        self.assertNotContains(response, f'src="{cookbook.image.url}"')
+
+    def test_rendition_cache_headers(self):
+        """
+        Tests that renditions are served with long lived cache headers.
+        """
+        cookbook = self._cookbook()
+        path = cookbook.list_cover.url[len('/media/'):]
+        response = immutable_media(RequestFactory().get(cookbook.list_cover.url), path)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+
+    def test_identical_uploads_stored_once(self):
+        """
+        Tests that images are named by their content and stored once.
+        """
+        cookbook = self._cookbook()
+        other_cookbook = self._cookbook(title='Stews')
+        self.assertTrue(is_content_name(cookbook.image.name))
+        self.assertEqual(cookbook.image.name, other_cookbook.image.name)
+        self.assertNotEqual(self._cookbook(color='green').image.name, cookbook.image.name)
+
+    def test_replaced_image_released(self):
+        """
+        Tests that an image and its renditions are deleted once no cookbook uses it.
+        """
+        cookbook = self._cookbook()
+        other_cookbook = self._cookbook(title='Stews')
+        image_name = cookbook.image.name
+        storage = cookbook.image.storage
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Cookbook.objects.get(pk=cookbook.pk).delete()
+        self.assertTrue(storage.exists(image_name))
+
+        other_cookbook.image = None
+        with self.captureOnCommitCallbacks(execute=True):
+            other_cookbook.save()
+        self.assertFalse(storage.exists(image_name))
+        self.assertEqual(Cookbook.unused_images(), [])
+
+    def test_unused_images(self):
+        """
+        Tests that files no cookbook uses are found.
+        """
+        cookbook = self._cookbook()
+        storage = cookbook.image.storage
+        storage.save_derived('images/old_cover.jpg', ContentFile(b'old'))
+        storage.save_derived('images/renditions/old_cover.list.0123456789ab.jpg', ContentFile(b'old'))
+
+        self.assertEqual(Cookbook.unused_images(),
+                         ['images/old_cover.jpg', 'images/renditions/old_cover.list.0123456789ab.jpg'])
+
+
+class CookbookListTest(TestCase):
+    """Tests for the cookbook list view."""
+
+    @classmethod
+    def setUpTestData(cls):
+        authors = Author.objects.bulk_create(
+            [Author(first_name='Author', last_name=f'{i:02}') for i in range(20)])
+        cookbooks = Cookbook.objects.bulk_create(
+            [Cookbook(title=f'Book {i:03}', author=authors[i % 20], publish_date=2000) for i in range(200)])
+        recipes = Recipe.objects.bulk_create(
+            [Recipe(name=f'Recipe {i}', cook_book=cookbooks[i % 3]) for i in range(9)])
+        for day, recipe in enumerate(recipes[:4], start=1):
+            Meal.objects.create(scheduled_date=datetime.date(2024, 1, day), recipe=recipe, was_made=True)
+        Meal.objects.create(scheduled_date=datetime.date(2024, 2, 1), recipe=recipes[0], was_made=False)
+
+    def test_query_budget(self):
+        """
+        Tests that a page of the list costs the same few queries however many cookbooks.
+        """
+        for sort in ('title', '-author', 'usage', '-last_used'):
+            with self.assertNumQueries(2):  # count and page
+                response = self.client.get('/cookbook/list', {'sort': sort, 'page': 2})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['cookbooks']), PAGE_SIZE)
+
+    def test_usage(self):
+        """
+        Tests the recipe count, times made and last made date of each cookbook.
+        """
+        response = self.client.get('/cookbook/list', {'sort': '-usage'})
+        usage = [(c.title, c.recipe_count, c.times_made, c.last_used)
+                 for c in response.context['cookbooks'][:4]]
+        self.assertEqual(usage, [
+            ('Book 000', 3, 2, datetime.date(2024, 1, 4)),
+            ('Book 002', 3, 1, datetime.date(2024, 1, 3)),
+            ('Book 001', 3, 1, datetime.date(2024, 1, 2)),
+            ('Book 199', 0, 0, None),
+        ])
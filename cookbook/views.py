@@ -5,12 +5,20 @@ Date:
 Author:         M. Schmidt
 '''
 
+from django.conf import settings
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.decorators import login_required, permission_required
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
 from datetime import datetime
 
+from home.pagination import sorted_page
+from meal.models import Meal
+from . import renditions
 from .models import Cookbook, Author
 from .forms import AuthorForm, CookbookForm
 
@@ -67,14 +75,44 @@ def new(request):
         })
 
 
-def cookbooks(request):
+# Sort orders of the cookbook list, chosen with ?sort= (prefix - for descending)
+COOKBOOK_LIST_SORTS = {
+    'title': ('title', 'id'),
+    'author': ('author__last_name', 'author__first_name', 'title', 'id'),
+    'recipes': ('recipe_count', 'title', 'id'),
+    'usage': ('times_made', 'title', 'id'),
+    'last_used': ('last_used', 'title', 'id'),
+}
 
-    return render(request, "cookbook/list.html",
-                  {"title": "Cookbooks",
-                   "cookbooks": Cookbook.objects.all(),
-                   "year": datetime.now().year,
-                   "company": "Schmidtheads Inc.",
-                   "table_name": "cookbooks"})
+
+def cookbooks(request):
+    '''
+    View to list cookbooks, one page at a time
+    The sort order and page are given in the query string (e.g. ?sort=-usage&page=2)
+    '''
+
+    # Get cookbooks with their author, number of recipes, number of times
+    # their recipes were made (stored on each recipe) and date one was last
+    # made in one query
+    last_made = Meal.objects.filter(
+        recipe__cook_book=OuterRef('pk'), was_made=True
+    ).order_by('-scheduled_date').values('scheduled_date')[:1]
+
+    all_cookbooks = Cookbook.objects.select_related('author').annotate(
+        recipe_count=Count('recipe'),
+        times_made=Coalesce(Sum('recipe__times_made'), 0),
+        last_used=Subquery(last_made))
+
+    context = sorted_page(request, all_cookbooks, COOKBOOK_LIST_SORTS, 'title')
+    context.update({
+        "title": "Cookbooks",
+        "cookbooks": context['page_obj'],
+        "year": datetime.now().year,
+        "company": "Schmidtheads Inc.",
+        "table_name": "cookbooks",
+    })
+
+    return render(request, "cookbook/list.html", context)
 
 
 # Editing/Creating authors from a cookbook implemented using guidance
@@ -111,3 +149,14 @@ def AuthorEditPopup(request, id=None):
                    "year": datetime.now().year,
                    "company": "Schmidtheads Inc.",
                    "table_name": "authors"})
+
+
+def immutable_media(request, path):
+    '''
+    Serve a cover image or rendition from the media folder (development server
+    only; in production the web server serves media, see deploy/apache_template.xml)
+    Content addressed images and renditions never change, so browsers may cache them for good.
+    '''
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    patch_cache_control(response, public=True, max_age=renditions.RENDITION_MAX_AGE, immutable=True)
+    return response
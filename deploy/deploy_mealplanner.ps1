@@ -547,7 +547,8 @@ function Get-StaticFiles {
     )
 
     # - run python3 manage.py collectstatic
-    #   files output to /srv/webapps/appname/home/static/... (see Trello for details)
+    #   files output to /srv/webapps/appname/static/... (STATIC_ROOT) with hashed names
+    #   and precompressed copies; Apache serves them from there (see apache_template.xml)
     Write-Host "`nCollect Static Files $($fullAppPath)/manage.py"
     $result = (Invoke-Expression "$($pythonPath) $($fullAppPath)/manage.py collectstatic --clear --noinput")
 
@@ -560,12 +561,6 @@ function Get-StaticFiles {
         $success = $false
     }
 
-    # Copy admin files to correct location
-    Write-Host "Copying admin files..."
-    Copy-Item (Join-Path $fullAppPath "static" "admin") `
-        -Destination (Join-Path $fullAppPath "home" "static" "admin") `
-        -Recurse
-
     return $success
 }
 
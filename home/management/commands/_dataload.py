@@ -1,14 +1,25 @@
 import datetime
+import hashlib
+import itertools
 import sys
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, transaction
+from django.db.models import Max
 
 parent_path = os.path.abspath("..") + "\\meal_planner"
 sys.path.append(parent_path)
 
 from cookbook.models import Author, Cookbook
+from home.models import LoadedRow
+from recipe import search_cache, typeahead
 from recipe.models import Diner, Recipe, RecipeRating, RecipeType
 from meal.models import Meal
 
+from ._sources import Source, SQLiteSource
+
 _TABLE_AUTHOR = 'Author'
 _TABLE_COOKBOOK = 'Cookbook'
 _TABLE_DINER = 'Diner'
@@ -24,9 +35,15 @@ _RT_KEY = 'related_table'
 _CL_KEY = 'column'
 _JT_KEY = 'is_junction'
 
-_DJANGO_ID_COL = 'd_id'
 _NV = 'NULL'  # NULL value
 
+# Number of rows read from the source and inserted by each bulk insert statement
+BATCH_SIZE = 1000
+
+# Formats of meal dates in the source: a date and time (SQL Lite), or only a
+# date (e.g. from the CSV or JSON lines files of other tools)
+_MEAL_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
 
 class TableFactory():
 
@@ -70,7 +87,7 @@ class Table():
         self._datamodel = data_model
         self._name = name
         self._is_junction = is_junction
-        self._rows = []
+        self._pk_mapping = None
         self._related_columns = []
         for fk in foreign_keys:
             self._add_related_column(fk[_CL_KEY], fk[_RT_KEY])
@@ -82,16 +99,6 @@ class Table():
         return self._name
 
 
-    @property
-    def rows(self):
-        return self._rows
-
-
-    @rows.setter
-    def rows(self, rows):
-        self._rows = rows
-
-     
     @property 
     def related_columns(self):
         return self._related_columns
@@ -109,10 +116,8 @@ class Table():
 
     @property
     def pk_mapping(self):
-        pk_mapping = None
-        if self.is_loaded:
-            pk_mapping = PrimaryKeyMapping(self)
-        return pk_mapping
+        # Built once, when the table is loaded
+        return self._pk_mapping
 
 
     @property
@@ -121,58 +126,307 @@ class Table():
         return None
 
 
-    def load(self):
+    def load(self, batches):
         '''
         Method that starts load of Django database table
+
+        The source rows are loaded one batch at a time, so only one batch is
+        held in memory; new rows are inserted in bulk (bulk_create). Each
+        batch is loaded in its own transaction, together with the hash of
+        each row's content (LoadedRow), which is the load's checkpoint: when
+        a failed load is run again, or the database is loaded again, rows
+        loaded before and unchanged since are skipped, and rows changed
+        since update the Django rows they created (rows matched with a
+        Django row by their key are matched again). Only the Django id of
+        each source row is kept,
+        for the table's primary key mapping.
+
+        @param batches: iterable of lists of source rows (named tuples, see
+                        MealDatabase.read_table_from_source)
         '''
-        
-        # Iterate rows
-        for r in self.rows:
+        start_time = time.perf_counter()
+        counts = {'created': 0, 'updated': 0, 'existing': 0}
+        django_ids = {}
+
+        fk_mappings = [
+            (rc[_CL_KEY], self._datamodel.get_table_by_name(rc[_RT_KEY]).pk_mapping)
+            for rc in self.related_columns
+        ]
+        # Rows already in the Django table, by key, read once for the whole table
+        existing_keys = self._existing_keys()
+
+        for batch in batches:
+            batch_django_ids = {}
+            with transaction.atomic():
+                for key, count in self._load_batch(batch, fk_mappings, existing_keys, batch_django_ids).items():
+                    counts[key] += count
+            if not self.is_junction_table:
+                django_ids.update(batch_django_ids)
+
+        self._report_load(counts, time.perf_counter() - start_time)
+        self._is_loaded = True
+        if not self.is_junction_table:
+            self._pk_mapping = PrimaryKeyMapping(self, django_ids)
 
-            # Check if record already in table
-            q = self._query_row_exists(r)
 
-            for rc in self.related_columns:
-                # Use foreign key id to find actual object in django table
-                fk_table = self._datamodel.get_table_by_name(rc[_RT_KEY])
-                fk_mapping = fk_table.pk_mapping
-                #print(f'{fk_table._name}, col: {rc[_CL_KEY]}, rel tbl: {rc[_RT_KEY]}, {r[rc[_CL_KEY]]}')
-                r[rc[_CL_KEY]] = fk_mapping.find_django_row(r[rc[_CL_KEY]])
+    def _load_batch(self, rows, fk_mappings, existing_keys, django_ids):
+        '''
+        Load a batch of source rows
+
+        @param rows: list of source rows (named tuples)
+        @param fk_mappings: list of (foreign key column, PrimaryKeyMapping) tuples
+        @param existing_keys: Django id of the rows in the Django table, by row
+                              key (see _existing_keys); rows created are added
+        @param django_ids: dictionary the Django id of each source row is added
+                           to, by source id (None for junction table rows)
+        @return: dictionary of number of rows created, updated and already loaded (existing)
+        '''
+        counts = {'created': 0, 'updated': 0, 'existing': 0}
+
+        # Rows to insert: source row and new Django object, by the row's key
+        # (a second source row with the same key gets the first one's id)
+        new_rows = {}
+        duplicate_rows = []
+        changed_rows = []
+        loaded_rows = []
+        # Rows no Django row could be made from: not checkpointed, so they are
+        # tried again by the next load
+        skipped_ids = set()
+        # Rows whose Django row they created (see LoadedRow.created)
+        created_ids = set()
+
+        loaded = self._loaded_rows(rows)
 
-            if not q:
-                new_row = self._create_row(r)
+        # Iterate rows
+        for r in rows:
+            django_ids[r.id] = None
+            loaded_row = loaded.get(r.id)
+            row_hash = _row_hash(r)
+
+            if loaded_row is not None and loaded_row.row_hash == row_hash:
+                # loaded before and unchanged since
+                django_ids[r.id] = loaded_row.django_id
+                counts['existing'] += 1
+                continue
+            loaded_rows.append(LoadedRow(source=self._datamodel.source_name, table_name=self.name,
+                                         source_id=r.id, row_hash=row_hash))
+
+            # changed since it was loaded: update the Django row, if this row
+            # created it (a row matched by its key, e.g. a second meal on the
+            # same day, is matched again rather than written over another's)
+            is_changed = loaded_row is not None and loaded_row.created and loaded_row.django_id is not None
+
+            if fk_mappings:
+                # Replace source foreign key ids with ids of the rows in django tables
+                r = r._replace(**{
+                    column: fk_mapping.find_django_id(getattr(r, column))
+                    for column, fk_mapping in fk_mappings
+                })
 
-                # Only save row and get djando id if NOT a junction table
-                if not self.is_junction_table and new_row is not None:
-                    new_row.save()
+            # Check if record already in table
+            key = self._row_key(r)
+
+            if is_changed:
+                django_ids[r.id] = loaded_row.django_id
+                changed_row = self._create_row(r)
+                if changed_row is not None:
+                    changed_row.id = loaded_row.django_id
+                    changed_rows.append(changed_row)
+                    created_ids.add(r.id)
+                else:
+                    skipped_ids.add(r.id)
+            elif key not in existing_keys:
+                if key in new_rows:
+                    duplicate_rows.append((r, new_rows[key][0]))
+                    continue
 
-                    # Get Django generated unique id
-                    django_id = new_row.id
-                    # Then add it to the data row being processed
-                    r[_DJANGO_ID_COL] = django_id
+                new_row = self._create_row(r)
+                if new_row is not None:
+                    new_rows[key] = (r, new_row)
+                else:
+                    skipped_ids.add(r.id)
             else:
-                # Get the django id of the record IF AND ONLY IF table IS NOT a jucntion able
+                counts['existing'] += 1
                 if not self.is_junction_table:
-                    # Assumption that only one record will be returned
-                    r[_DJANGO_ID_COL] = q[0].id
+                    django_ids[r.id] = existing_keys[key]
 
-        self._is_loaded = True
+        counts['created'] += self._bulk_create(list(new_rows.values()), django_ids)
+        for key, (r, _) in new_rows.items():
+            existing_keys[key] = django_ids[r.id]
+            created_ids.add(r.id)
+        for r, first_row in duplicate_rows:
+            django_ids[r.id] = django_ids[first_row.id]
+
+        if changed_rows:
+            self.django_table.objects.bulk_update(changed_rows, self.source_fields, batch_size=BATCH_SIZE)
+            counts['updated'] = len(changed_rows)
+
+        # Record the rows loaded (the checkpoint), with their Django ids
+        loaded_rows = [loaded_row for loaded_row in loaded_rows if loaded_row.source_id not in skipped_ids]
+        for loaded_row in loaded_rows:
+            loaded_row.django_id = django_ids[loaded_row.source_id]
+            loaded_row.created = loaded_row.source_id in created_ids
+        LoadedRow.objects.bulk_create(
+            loaded_rows, batch_size=BATCH_SIZE, update_conflicts=True,
+            unique_fields=['source', 'table_name', 'source_id'], update_fields=['row_hash', 'django_id', 'created'])
 
+        return counts
 
-    def get_row_by_id(self, id):
+
+    def _loaded_rows(self, rows):
         '''
-        Queries rows for a given id using id from source table
+        Return the rows of a batch loaded before, by source id
+
+        A row whose Django row was deleted since is loaded again.
         '''
+        loaded = {
+            loaded_row.source_id: loaded_row
+            for loaded_row in LoadedRow.objects.filter(
+                source=self._datamodel.source_name, table_name=self.name, source_id__in=[r.id for r in rows])
+        }
+        if not self.is_junction_table:
+            django_ids = {loaded_row.django_id for loaded_row in loaded.values()}
+            found_ids = set(self.django_table.objects.filter(id__in=django_ids).values_list('id', flat=True))
+            loaded = {
+                source_id: loaded_row for source_id, loaded_row in loaded.items()
+                if loaded_row.django_id is None or loaded_row.django_id in found_ids
+            }
+        return loaded
 
-        for r in self.rows:
-            if r['id'] == id:
-                return r
-        
-        raise Exception(f'Row with id {id} not found')
 
+    def _bulk_create(self, new_rows, django_ids) -> int:
+        '''
+        Insert new Django rows in batches and record their ids
+
+        @param new_rows: list of (source row, unsaved Django object) tuples
+        @param django_ids: dictionary the Django id of each source row is added to
+        @return: number of rows inserted
+        '''
+        if not new_rows:
+            return 0
 
-    def _query_row_exists(self, row):
-        return None
+        django_table = self.django_table
+        objects = [obj for _, obj in new_rows]
+        if self.is_junction_table:
+            # rows only link two rows, their ids are not needed; a link
+            # added by someone else since the existing links were read is skipped
+            django_table.objects.bulk_create(objects, batch_size=BATCH_SIZE, ignore_conflicts=True)
+            return len(objects)
+
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # database does not return generated ids: assign them up front
+            # (safe as each batch is loaded within one transaction)
+            next_id = (django_table.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+            for offset, obj in enumerate(objects):
+                obj.id = next_id + offset
+
+        django_table.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+
+        for r, obj in new_rows:
+            django_ids[r.id] = obj.id
+        return len(objects)
+
+
+    def _report_load(self, counts, elapsed):
+        '''
+        Print the number of rows loaded and the load rate
+        '''
+        total = sum(counts.values())
+        rate = total / elapsed if elapsed > 0 else 0
+        print(f'{self.name}: {counts["created"]} row(s) created, {counts["existing"]} already loaded, '
+              f'{counts["updated"]} updated, {elapsed:.2f}s ({rate:.0f} rows/sec)')
+
+
+    @property
+    def source_fields(self):
+        # Fields of the Django table set from the source (see _create_row),
+        # updated when a source row changes
+        return []
+
+
+    @property
+    def key_fields(self):
+        # Fields of the Django table identifying a row (see _row_key)
+        return []
+
+
+    @property
+    def source_columns(self):
+        # Columns of the source table, as (column, column type, Django field)
+        # tuples: the types of values read from text sources (see _sources.py)
+        # and the columns written by export
+        return []
+
+
+    def export(self, database_connection):
+        '''
+        Write the rows of the Django table to a new table of the same name
+        in a source (legacy) database, BATCH_SIZE rows at a time
+
+        Source ids and foreign keys are the Django ids.
+
+        @param database_connection: connection (sqlite3) to the source database
+        @return: number of rows written
+        '''
+        start_time = time.perf_counter()
+        columns = self.source_columns
+        column_defs = ', '.join(f'{column} {column_type}' for column, column_type, _ in columns)
+        database_connection.execute(f'create table {self.name} ({column_defs})')
+
+        insert = (f'insert into {self.name} ({", ".join(column for column, _, _ in columns)}) '
+                  f'values ({", ".join("?" * len(columns))})')
+        rows = self.django_table.objects.order_by('id').values_list(
+            *[field for _, _, field in columns]).iterator(chunk_size=BATCH_SIZE)
+
+        count = 0
+        while True:
+            batch = [self._export_row(values) for values in itertools.islice(rows, BATCH_SIZE)]
+            if not batch:
+                break
+            database_connection.executemany(insert, batch)
+            count += len(batch)
+
+        elapsed = time.perf_counter() - start_time
+        rate = count / elapsed if elapsed > 0 else 0
+        print(f'{self.name}: {count} row(s) exported, {elapsed:.2f}s ({rate:.0f} rows/sec)')
+        return count
+
+
+    def _export_row(self, values):
+        '''
+        Return the values of a source row from the values of source_columns' fields
+        '''
+        return values
+
+
+    def _existing_keys(self):
+        '''
+        Return the id of each row in the Django table, by row key (see
+        _row_key), read with one query
+
+        If rows have the same key, the first one's id is used.
+        '''
+        existing_keys = {}
+        if self.key_fields:
+            rows = self.django_table.objects.order_by('id').values_list('id', *self.key_fields)
+            for django_id, *values in rows.iterator():
+                existing_keys.setdefault(self._django_row_key(values), django_id)
+        return existing_keys
+
+
+    def _django_row_key(self, values):
+        '''
+        Return the key of a Django row, from the values of its key_fields
+        '''
+        return values[0] if len(values) == 1 else tuple(values)
+
+
+    def _row_key(self, row):
+        '''
+        Return the value(s) identifying a source row (foreign keys are
+        Django ids), matched with the Django rows' keys
+        '''
+        return row.id
 
 
     def _create_row(self, row):
@@ -221,21 +475,37 @@ class CookbookTable(Table):
         return Cookbook
 
 
-    def _query_row_exists(self, row):
-        query_value = row['title']
-        q = Cookbook.objects.filter(title=query_value)
-        return q
+    @property
+    def source_fields(self):
+        return ['title', 'description', 'author', 'publish_date', 'url', 'edition', 'image']
+
+
+    @property
+    def key_fields(self):
+        return ['title']
+
+
+    @property
+    def source_columns(self):
+        return [('id', 'integer primary key', 'id'), ('title', 'text', 'title'),
+                ('description', 'text', 'description'), ('author', 'integer', 'author'),
+                ('published_date', 'integer', 'publish_date'), ('url', 'text', 'url'),
+                ('edition', 'text', 'edition'), ('image', 'text', 'image')]
+
+
+    def _row_key(self, row):
+        return row.title
 
 
     def _create_row(self, row):
         r = Cookbook(
-            title=row['title'],
-            description=row['description'],
-            author=row['author'],
-            publish_date=row['published_date'],
-            url=row['url'],
-            edition=row['edition'],
-            image=row['image']
+            title=row.title,
+            description=row.description,
+            author_id=row.author,
+            publish_date=row.published_date,
+            url=row.url,
+            edition=row.edition,
+            image=row.image
         )
         return r
 
@@ -251,9 +521,24 @@ class AuthorTable(Table):
         return Author
 
         
-    def _query_row_exists(self, row):
-        q = Author.objects.filter(first_name = row['first_name'], last_name = row['last_name'])
-        return q
+    @property
+    def source_fields(self):
+        return ['first_name', 'last_name']
+
+
+    @property
+    def key_fields(self):
+        return ['first_name', 'last_name']
+
+
+    @property
+    def source_columns(self):
+        return [('id', 'integer primary key', 'id'), ('first_name', 'text', 'first_name'),
+                ('last_name', 'text', 'last_name')]
+
+
+    def _row_key(self, row):
+        return (row.first_name, row.last_name)
 
 
     def _query_row_by_django_id(self, django_id):
@@ -265,7 +550,7 @@ class AuthorTable(Table):
 
 
     def _create_row(self, row):
-        t = Author(first_name = row['first_name'], last_name = row['last_name'])
+        t = Author(first_name = row.first_name, last_name = row.last_name)
         return t
 
 
@@ -280,13 +565,28 @@ class DinerTable(Table):
         return Diner
 
 
-    def _query_row_exists(self, row):
-        q = Diner.objects.filter(first_name=row['first_name'], last_name=row['last_name'])
-        return q
+    @property
+    def source_fields(self):
+        return ['first_name', 'last_name']
+
+
+    @property
+    def key_fields(self):
+        return ['first_name', 'last_name']
+
+
+    @property
+    def source_columns(self):
+        return [('id', 'integer primary key', 'id'), ('first_name', 'text', 'first_name'),
+                ('last_name', 'text', 'last_name')]
+
+
+    def _row_key(self, row):
+        return (row.first_name, row.last_name)
 
 
     def _create_row(self, row):
-        t = Diner(first_name = row['first_name'], last_name = row['last_name'])
+        t = Diner(first_name = row.first_name, last_name = row.last_name)
         return t
 
 
@@ -302,23 +602,39 @@ class RecipeTable(Table):
         return Recipe
 
 
-    def _query_row_exists(self, row):
-        q = Recipe.objects.filter(name=row['title'])
-        return q
+    @property
+    def source_fields(self):
+        return ['name', 'cook_book', 'page_number', 'notes']
+
+
+    @property
+    def key_fields(self):
+        return ['name']
+
+
+    @property
+    def source_columns(self):
+        return [('id', 'integer primary key', 'id'), ('title', 'text', 'name'),
+                ('cook_book', 'integer', 'cook_book'), ('page_number', 'integer', 'page_number'),
+                ('notes', 'text', 'notes')]
+
+
+    def _row_key(self, row):
+        return row.title
 
 
     def _create_row(self, row):
         # Do some data validation
         # cook_book is REQUIRED
-        if row['cook_book'] is None:
+        if row.cook_book is None:
             print('Invalid cook_book reference for recipe', row)
             return None
         
         t = Recipe(
-            name=row['title'],
-            cook_book=row['cook_book'],
-            page_number=0 if row['page_number'] is None or row['page_number'] == _NV else row['page_number'],
-            notes=row['notes']
+            name=row.title,
+            cook_book_id=row.cook_book,
+            page_number=0 if row.page_number is None or row.page_number == _NV else row.page_number,
+            notes=row.notes
         )
         return t
 
@@ -334,21 +650,12 @@ class RecipeRatingTable(Table):
         return RecipeRating
 
 
-    def _query_row_exists(self, row):
-        # Check if RecipeRating already in table
-        # Get Diner and Recipe Object
-        diner_obj = 1 #TODO: get actual diner
-        recipe_obj = 1 #TODO: get actual recipe
-        q = RecipeRating.objects.filter(recipe = recipe_obj, diner = diner_obj)
-        return q
-
-
     def _create_row(self, row):
         r = Recipe(
-            name=row['name'],
-            cook_book=row['cook_book'],
-            page_number=row['page_number'],
-            notes=row['notes']
+            name=row.name,
+            cook_book=row.cook_book,
+            page_number=row.page_number,
+            notes=row.notes
         )
         return r
 
@@ -364,13 +671,27 @@ class RecipeTypeTable(Table):
         return RecipeType
 
 
-    def _query_row_exists(self, row):
-        q = RecipeType.objects.filter(name = row['name'])
-        return q
+    @property
+    def source_fields(self):
+        return ['name']
+
+
+    @property
+    def key_fields(self):
+        return ['name']
+
+
+    @property
+    def source_columns(self):
+        return [('id', 'integer primary key', 'id'), ('name', 'text', 'name')]
+
+
+    def _row_key(self, row):
+        return row.name
 
 
     def _create_row(self, row):
-        r = RecipeType(name = row['name'])
+        r = RecipeType(name = row.name)
         return r
 
 
@@ -385,35 +706,70 @@ class MealTable(Table):
         return Meal
 
     
-    def _query_row_exists(self, row):
-        # format date to ensure in YYYY-MM-DD HH:MM:SS format
-        date_obj = datetime.datetime.strptime(row['scheduled_date'], '%Y-%m-%d %H:%M:%S')
-        scheduled_date = date_obj.strftime('%Y-%m-%d')
-        q = Meal.objects.filter(scheduled_date = scheduled_date)
-        return q
+    @property
+    def source_fields(self):
+        return ['scheduled_date', 'was_made', 'recipe', 'notes']
+
+
+    @property
+    def key_fields(self):
+        return ['scheduled_date']
+
+
+    def _django_row_key(self, values):
+        # date as in the source (YYYY-MM-DD HH:MM:SS), without the time
+        return values[0].isoformat()
+
+
+    @property
+    def source_columns(self):
+        return [('id', 'integer primary key', 'id'), ('scheduled_date', 'text', 'scheduled_date'),
+                ('was_made', 'integer', 'was_made'), ('recipe', 'integer', 'recipe'),
+                ('notes', 'text', 'notes')]
+
+
+    def _export_row(self, values):
+        # dates in the source have a time (YYYY-MM-DD HH:MM:SS)
+        meal_id, scheduled_date, was_made, recipe_id, notes = values
+        return (meal_id, f'{scheduled_date.isoformat()} 00:00:00', int(was_made), recipe_id, notes)
+
+
+    def _row_key(self, row):
+        return row.scheduled_date[:10]
 
 
     def _create_row(self, row):
         # format date to ensure in YYYY-MM-DD format
-        date_obj = datetime.datetime.strptime(row['scheduled_date'], '%Y-%m-%d  %H:%M:%S')
-        scheduled_date = date_obj.strftime('%Y-%m-%d')
-        
+        scheduled_date = _meal_date(row.scheduled_date).strftime('%Y-%m-%d')
+
         # Do some data validation
         # recipe is REQUIRED
-        if row['recipe'] is None:
+        if row.recipe is None:
             print('Invalid recipe reference for meal', row)
             return None
 
         r = Meal(
             scheduled_date = scheduled_date,
-            was_made = row['was_made'],
-            recipe = row['recipe'],
-            notes = '' if row['notes'] is None or row['notes'] == _NV else row['notes'] 
+            was_made = row.was_made,
+            recipe_id = row.recipe,
+            notes = '' if row.notes is None or row.notes == _NV else row.notes 
         )
 
         return r
 
 
+def _meal_date(value):
+    '''
+    Return the date of a meal from its source value (see _MEAL_DATE_FORMATS)
+    '''
+    for fmt in _MEAL_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid meal date "{value}"')
+
+
 class RecipeToTypeTable(Table):
 
     # refer to https://docs.djangoproject.com/en/dev/ref/models/relations/
@@ -425,59 +781,39 @@ class RecipeToTypeTable(Table):
 
     @property
     def django_table(self):
-        return None
+        # rows of the table of the recipes' recipe_types many-to-many field
+        return Recipe.recipe_types.through
 
 
-    def _query_row_exists(self, row):
+    def _existing_keys(self):
+        # recipe and recipe type pairs already associated
+        return {pair: None for pair in self.django_table.objects.values_list('recipe_id', 'recipetype_id').iterator()}
 
-        recipe_django_id = self._get_fk_table_django_id('recipeid', row)
-        recipetype_django_row = self._get_fk_table_django_row('recipetypeid', row)
 
-        try:
-            q = recipetype_django_row.recipe_set.filter(pk=recipe_django_id).exists()
-            return q
-        except:
-            print('Cannot find recipes for given type!')
-            return None
-        
-    
-    def _create_row(self, row):
-
-        recipetype_django_row = row['recipetypeid']
-        recipe_django_row = row['recipeid']
+    def _row_key(self, row):
+        return (row.recipeid, row.recipetypeid)
 
-        if recipe_django_row is not None:
-            recipe_django_row.recipe_types.add(recipetype_django_row)
-        else:
-            print(f'Django row with id {row["recipeid"]} for Recipe not found!')
 
-        # We're just creating an association between two rows, don't return anything   
-        return None
+    @property
+    def source_columns(self):
+        return [('id', 'integer primary key', 'id'), ('recipeid', 'integer', 'recipe'),
+                ('recipetypeid', 'integer', 'recipetype')]
 
 
-    def _get_fk_table_django_id(self, fk_column_name, row):
-        fk_table = self._datamodel.get_table_by_name(self._get_related_table_by_fk(fk_column_name))
-        try:
-            fk_table_row = fk_table.get_row_by_id(row[fk_column_name])
-            fk_table_django_id = fk_table_row[_DJANGO_ID_COL]
-            return fk_table_django_id
-        except:
+    def _create_row(self, row):
+        # foreign key columns hold django ids
+        if row.recipeid is None or row.recipetypeid is None:
+            print('Invalid recipe or recipe type reference for recipe type', row)
             return None
-        
 
-    def _get_fk_table_django_row(self, fk_column_name, row):
+        return self.django_table(recipe_id=row.recipeid, recipetype_id=row.recipetypeid)
 
-        fk_table = self._datamodel.get_table_by_name(self._get_related_table_by_fk(fk_column_name))
-        try:
-            fk_table_row = fk_table.get_row_by_id(row[fk_column_name])
-            fk_table_django_id = fk_table_row[_DJANGO_ID_COL]
-            fk_table_django_table = fk_table.django_table
-            fk_table_django_row = fk_table_django_table.objects.get(pk=fk_table_django_id)
-            return fk_table_django_row      
-        except:
-            print('Foreign Key table not found!')
-            return None
-  
+
+def _row_hash(row):
+    '''
+    Return the hash of a source row's content
+    '''
+    return hashlib.sha1(repr(tuple(row)).encode('utf-8')).hexdigest()
 
 
 #------------------------------------------------
@@ -552,22 +888,46 @@ class MealDatabase():
         }        
     ]
 
-    def __init__(self, database_connection):
-        self._db_conn = database_connection
-        
-        # sort tables by foreign key dependencies
-        self._sort_tables()
+    def __init__(self, source, source_name=None):
+        '''
+        @param source: the source (see _sources.py), or a connection (sqlite3)
+                       to a source database
+        @param source_name: name of the source (e.g. its path), by default the
+                            source's; the rows loaded are recorded for each
+                            source (LoadedRow)
+        '''
+        if not isinstance(source, Source):
+            source = SQLiteSource(source)
+        self._source = source
+        self._source_name = source.name if source_name is None else source_name
+
+        # Initialize (empty) table objects, grouped in levels by foreign key
+        # dependencies: a table only depends on tables of earlier levels
+        self._levels = []
+        for level in table_levels(self._TABLE_DEFS):
+            self._levels.append([TableFactory().createTable(self, t) for t in level])
+        self._tables = [t for level in self._levels for t in level]
+
 
-        # Initialize (empty) table objects
-        self._tables = []
-        for t in self._TABLE_DEFS:
-            table = TableFactory().createTable(self, t)
-            self._tables.append(table)
+    @property
+    def table_levels(self):
+        return self._levels
+
+
+    @property
+    def source(self):
+        return self._source
 
 
     @property
     def database_connection(self):
-        return self._db_conn
+        # only SQL Lite sources have one
+        return self._source.connection
+
+
+    @property
+    def source_name(self):
+        return self._source_name
 
 
     def get_table_by_name(self, table_name):
@@ -577,94 +937,150 @@ class MealDatabase():
         raise Exception(f'Table "{table_name}" not found')
 
 
-    def load(self):
+    def load(self, workers=1):
         '''
         This method is used to start the Load the Django database
+
+        The tables of a level are loaded before the next level is started.
+        With more than one worker, the tables of a level are loaded at the
+        same time, each in its own thread (and database connection); the
+        source connection must then allow use from other threads (sqlite3
+        check_same_thread=False).
+
+        @param workers: maximum number of tables loaded at the same time
         '''
 
-        # Iterate sorted table list
-        for t in self._tables:
-            print(f'Processing {t.name}...')
-            #   Retrieve table data from source db
-            print('Getting data from source...')
-            rows = self.read_table_from_source(t.name)
-            #   Initialize table object with source data
-            t.rows = rows
-            #   Load the table into django database
-            print('Loading...')
-            t.load()
+        for level in self._levels:
+            if workers > 1 and len(level) > 1:
+                with ThreadPoolExecutor(max_workers=min(workers, len(level)),
+                                        thread_name_prefix='data_load') as executor:
+                    futures = [executor.submit(self._load_table_in_thread, t) for t in level]
+                    # wait for the whole level, raising the error of a failed table
+                    for future in futures:
+                        future.result()
+            else:
+                for t in level:
+                    self._load_table(t)
 
+        # Bulk inserts do not send model signals: update what the signals
+        # would have (times recipes were made, rankings, search results and
+        # suggestions). The versions are kept in the database, so the web
+        # server's processes see the changes made by this command.
+        Recipe.refresh_rankings(count_meals=True)
+        search_cache.bump_catalogue_version()
+        typeahead.bump_index_version()
 
-    def read_table_from_source(self, table_name):
 
-        cursor = self.database_connection.cursor()
-        cursor.execute(f'select * from {table_name}')
-        records = cursor.fetchall()
+    def export(self):
+        '''
+        Write the Django database to the (empty) source database, in one
+        transaction, reading a consistent snapshot of the Django database
+        '''
+        conn = self.database_connection
+        conn.execute('begin')
+        try:
+            with transaction.atomic():
+                for t in self._tables:
+                    t.export(conn)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
 
-        columns = [column[0] for column in cursor.description]
-        result_set = []
-        for record in records:
-            row = {}
 
-            # Build the row    
-            for i, value in enumerate(record):
-                row[columns[i].lower()] = value
+    def _load_table(self, table):
+        print(f'Processing {table.name}...')
+        #   Load the table into django database, reading the source
+        #   table one batch at a time
+        table.load(self.read_table_from_source(table.name))
 
-            # Add row to result set   
-            result_set.append(row)
 
-        return result_set
+    def _load_table_in_thread(self, table):
+        try:
+            self._load_table(table)
+        finally:
+            # each worker thread has its own database connection
+            connection.close()
 
 
-    def _sort_tables(self):
-        # Sort tables so those with foreign key dependencies are 
-        # loaded after their dependencies
+    def read_table_from_source(self, table_name, batch_size=BATCH_SIZE):
+        '''
+        Read a table from the source, batch_size rows at a time
 
-        def _t1_dep_t2(t1, t2):
-            # check if table 1 (t1) is dependent on table 2 (t2)
-            fky = _FK_KEY
+        Rows are named tuples with a field for each (lower case) column name.
 
-            if len(t1[fky]) == 0:
-                return False
-            
-            for fk in t1[fky]:
-                if fk[_RT_KEY] == t2[_NM_KEY]:
-                    return True
+        @return: generator of lists of rows
+        '''
+        columns = [(column, column_type) for column, column_type, _ in self.get_table_by_name(table_name).source_columns]
+        return self.source.read_table(table_name, columns, batch_size)
 
-            return False
 
-        tl = self._TABLE_DEFS
-        fky = _FK_KEY
-        n = len(tl)
+def table_levels(table_defs):
+    '''
+    Group table definitions in levels by their foreign key dependencies
+    (topological sort, Kahn's algorithm)
 
-        for i in range(n):
+    Tables of the first level have no foreign keys; tables of each next
+    level only refer to tables of earlier levels. Within a level, tables
+    keep the order of table_defs.
 
-            for j in range(0, n-i-1):
-                if len(tl[j][fky]) > len(tl[j+1][fky]):
-                    tl[j], tl[j+1] = tl[j+1], tl[j]
-                elif _t1_dep_t2(tl[j], tl[j+1]):
-                    tl[j], tl[j+1] = tl[j+1], tl[j]
+    @param table_defs: list of table definitions (see MealDatabase._TABLE_DEFS)
+    @return: list of levels, each a list of table definitions
+    @raise Exception: if a foreign key refers to an unknown table, or tables
+                      refer to each other (directly or not)
+    '''
+    table_names = [t[_NM_KEY] for t in table_defs]
+
+    dependencies = {}
+    dependents = {name: [] for name in table_names}
+    for t in table_defs:
+        related_tables = {fk[_RT_KEY] for fk in t[_FK_KEY]}
+        for related_table in related_tables:
+            if related_table not in dependents:
+                raise Exception(f'Table "{t[_NM_KEY]}" refers to unknown table "{related_table}"')
+            dependents[related_table].append(t[_NM_KEY])
+        dependencies[t[_NM_KEY]] = len(related_tables)
+
+    levels = []
+    level = [name for name in table_names if dependencies[name] == 0]
+    while level:
+        levels.append(level)
+        next_level = set()
+        for name in level:
+            for dependent in dependents[name]:
+                dependencies[dependent] -= 1
+                if dependencies[dependent] == 0:
+                    next_level.add(dependent)
+        level = [name for name in table_names if name in next_level]
+
+    remaining = [name for name in table_names if dependencies[name] > 0]
+    if remaining:
+        raise Exception(f'Foreign keys of tables {", ".join(remaining)} form a cycle')
+
+    table_defs_by_name = {t[_NM_KEY]: t for t in table_defs}
+    return [[table_defs_by_name[name] for name in level] for level in levels]
 
 
 class PrimaryKeyMapping():
     '''
     Connects a row in the source data to same record in Django database.
+    Built once a table is loaded; lookups are dictionary lookups.
     '''
     
-    def __init__(self, table: Table):
+    def __init__(self, table: Table, django_ids: dict):
+        '''
+        @param table: the loaded table
+        @param django_ids: Django id of each source row, by source id
+        '''
         self._table = table
-        self._rows = []
-        for r in self._table.rows:
-            mapping = {
-                'source_pk': r['id'],
-                'django_pk': r[_DJANGO_ID_COL]    
-            }
-            self._rows.append(mapping)
+        self._django_ids = django_ids
+        self._django_rows = None
 
 
     @property
     def rows(self):
-        return self._rows
+        return [{'source_pk': source_pk, 'django_pk': django_pk}
+                for source_pk, django_pk in self._django_ids.items()]
 
 
     @property
@@ -682,20 +1098,20 @@ class PrimaryKeyMapping():
             # there is not associated foreign object, so return None
             return None
 
-        d_id = self.find_django_id(search_id)
+        return self.find_django_row_by_django_id(self.find_django_id(search_id))
 
-        django_table = self.table.django_table
 
-        try:
-            found_obj = django_table.objects.get(id=d_id)
-        except:
-            found_obj = None
+    def find_django_row_by_django_id(self, django_id):
+        if self._django_rows is None:
+            # Get all of the table's django rows with one query, the first time one is needed
+            django_ids = [d_id for d_id in self._django_ids.values() if d_id is not None]
+            self._django_rows = self.table.django_table.objects.in_bulk(django_ids)
 
-        return found_obj
+        return self._django_rows.get(django_id)
 
 
     def find_django_id(self, search_id) -> int:
-        for r in self.rows:
-            if r['source_pk'] == search_id:
-                return r['django_pk']
-        return None
+        if search_id == 0:
+            # there is not associated foreign object
+            return None
+        return self._django_ids.get(search_id)
@@ -0,0 +1,224 @@
+'''
+Name:           _sources.py
+Description:    Sources the data loader (_dataload.py) reads tables from
+                An SQL Lite database, a folder of CSV files or a folder of
+                JSON lines files, one file per table (e.g. Meal.csv or
+                Meal.jsonl), such as the exports of other meal planning tools.
+
+Every source reads a table a batch of rows at a time, as named tuples with a
+field for each (lower case) column. Values of the CSV and JSON lines files
+are converted to the column types of the legacy schema (see
+Table.source_columns); an empty (or "NULL") value of a number column is NULL
+(None).
+'''
+
+import collections
+import csv
+import itertools
+import json
+import os
+import sqlite3
+
+SOURCE_FORMATS = ('sqlite', 'csv', 'jsonl')
+
+
+def open_source(path, source_format=None):
+    '''
+    Open a source
+
+    @param path: path of the SQL Lite database or the folder of files
+    @param source_format: one of SOURCE_FORMATS; by default an SQL Lite
+                          database if path is a file, otherwise CSV files if
+                          the folder has any, otherwise JSON lines files
+    @return: the source
+    '''
+    if source_format is None:
+        if not os.path.isdir(path):
+            source_format = 'sqlite'
+        elif any(f.lower().endswith('.csv') for f in os.listdir(path)):
+            source_format = 'csv'
+        else:
+            source_format = 'jsonl'
+
+    if source_format == 'sqlite':
+        if not os.path.isfile(path):
+            raise Exception(f'SQL Lite database "{path}" not found')
+        # tables may be read by several worker threads
+        return SQLiteSource(sqlite3.connect(path, check_same_thread=False), os.path.abspath(path))
+    if source_format == 'csv':
+        return CsvSource(path)
+    if source_format == 'jsonl':
+        return JsonLinesSource(path)
+    raise Exception(f'Unknown source format "{source_format}"')
+
+
+def _typed(value, column_type):
+    '''
+    Return a value of a text source converted to the type of its column
+    '''
+    if column_type is None or value is None:
+        return value
+    if column_type in ('integer', 'real'):
+        if value in ('', 'NULL'):
+            return None
+        return int(value) if column_type == 'integer' else float(value)
+    return str(value)
+
+
+class Source():
+    '''
+    A source of the tables of the legacy data model
+    '''
+
+    def __init__(self, name):
+        self._name = name
+
+
+    @property
+    def name(self):
+        # Identifies the source (e.g. its path) in the rows loaded (LoadedRow)
+        return self._name
+
+
+    def read_table(self, table_name, columns, batch_size):
+        '''
+        Read a table, batch_size rows at a time
+
+        @param table_name: name of the table
+        @param columns: (column name, column type) tuples of the table in the
+                        legacy schema, e.g. ('id', 'integer')
+        @return: generator of lists of rows (named tuples)
+        '''
+        # This method MUST be overridden in subclass
+        return None
+
+
+class SQLiteSource(Source):
+    '''
+    An SQL Lite database
+    '''
+
+    def __init__(self, connection, name=''):
+        super().__init__(name)
+        self._connection = connection
+
+
+    @property
+    def connection(self):
+        return self._connection
+
+
+    def read_table(self, table_name, columns, batch_size):
+        # columns have their own types in the database
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(f'select * from {table_name}')
+            column_names = [column[0].lower() for column in cursor.description]
+            row_type = collections.namedtuple(f'{table_name}Row', column_names, rename=True)
+
+            while True:
+                records = cursor.fetchmany(batch_size)
+                if not records:
+                    break
+                yield [row_type._make(record) for record in records]
+        finally:
+            cursor.close()
+
+
+class FolderSource(Source):
+    '''
+    A folder with a file for each table, named after the table
+    '''
+
+    # File extension of the table files (set in subclass)
+    extension = None
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            raise Exception(f'Folder "{path}" not found')
+        super().__init__(os.path.abspath(path))
+        self._path = path
+
+
+    def read_table(self, table_name, columns, batch_size):
+        '''
+        Read a table (see Source.read_table)
+
+        Columns of the legacy schema missing from the file are NULL; other
+        columns in the file are read as text. A table without a file has no rows.
+        '''
+        path = self._table_path(table_name)
+        if path is None:
+            print(f'No {self.extension} file for table {table_name}')
+            return
+
+        column_types = {name: column_type.split()[0].lower() for name, column_type in columns}
+        with open(path, newline='', encoding='utf-8') as table_file:
+            file_columns, records = self._read_records(table_file)
+            extra_columns = [c for c in file_columns if c not in column_types]
+            row_type = collections.namedtuple(
+                f'{table_name}Row', list(column_types) + extra_columns, rename=True)
+
+            def make_row(record):
+                values = [_typed(record.get(name), column_type) for name, column_type in column_types.items()]
+                values.extend(record.get(name) for name in extra_columns)
+                return row_type._make(values)
+
+            while True:
+                batch = [make_row(record) for record in itertools.islice(records, batch_size)]
+                if not batch:
+                    break
+                yield batch
+
+
+    def _table_path(self, table_name):
+        '''
+        Return the path of a table's file (its name in any case), None if there is none
+        '''
+        file_name = f'{table_name}.{self.extension}'.lower()
+        for f in os.listdir(self._path):
+            if f.lower() == file_name:
+                return os.path.join(self._path, f)
+        return None
+
+
+    def _read_records(self, table_file):
+        '''
+        Return the (lower case) column names of a table file, and an
+        iterator of its records as dictionaries by column name
+        '''
+        # This method MUST be overridden in subclass
+        return None
+
+
+class CsvSource(FolderSource):
+    '''
+    A folder of CSV files, whose first line has the column names
+    '''
+
+    extension = 'csv'
+
+    def _read_records(self, table_file):
+        reader = csv.reader(table_file)
+        file_columns = [column.strip().lower() for column in next(reader, [])]
+        records = (dict(zip(file_columns, values)) for values in reader if values)
+        return file_columns, records
+
+
+class JsonLinesSource(FolderSource):
+    '''
+    A folder of JSON lines files, with a JSON object for each row
+    '''
+
+    extension = 'jsonl'
+
+    def _read_records(self, table_file):
+        records = (
+            {column.lower(): value for column, value in json.loads(line).items()}
+            for line in table_file if line.strip()
+        )
+        # columns of the first row tell the columns not in the legacy schema
+        first = next(records, None)
+        if first is None:
+            return [], iter([])
+        return list(first), itertools.chain([first], records)
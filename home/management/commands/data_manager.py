@@ -1,41 +1,83 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 import copy
+import os
 import sqlite3
 import sys
 from ._dataload import MealDatabase
+from ._sources import SOURCE_FORMATS, open_source
 
 _meal_plan = []
 
 
 class Command(BaseCommand):
 
-    help = 'Loads Django database from SQL Lite database'
+    help = 'Loads Django database from SQL Lite database, or exports it to one'
 
     def add_arguments(self, parser):
+        # the action is optional: "data_manager <db_path>" loads, as before
+        # there was an export action
+        parser.add_argument('action', nargs='?', choices=['load', 'export'], default='load',
+                            help='load (the default): load the Django database from an SQL Lite '
+                                 'database, or a folder of CSV or JSON lines files (one file per '
+                                 'table); export: export the Django database to a new SQL Lite database')
         parser.add_argument('db_path', type=str,
-                            help='Path to SQL Lite database')
+                            help='Path to SQL Lite database or folder of files (load), or of the '
+                                 'SQL Lite database to create (export)')
+        parser.add_argument('--format', choices=SOURCE_FORMATS,
+                            help='Format of the source to load (by default found from db_path)')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of tables loaded at the same time (default 1). '
+                                 'SQLite allows one writer at a time, so only use more '
+                                 'workers with a database server such as PostgreSQL')
 
         return super().add_arguments(parser)
 
 
     def handle(self, *args, **kwargs):
 
+        action = kwargs['action']
         db_path = kwargs['db_path']
-        conn = self.create_connection(db_path)
+        if action == 'load':
+            self.load(db_path, kwargs['format'], kwargs['workers'])
+        elif action == 'export':
+            if kwargs['format'] is not None or kwargs['workers'] != 1:
+                raise CommandError('--format and --workers only apply to load')
+            self.export(db_path)
+        else:
+            raise CommandError(f'Unknown action "{action}"')
 
-        mdb = MealDatabase(conn)
+
+    def load(self, db_path, source_format, workers):
+
+        try:
+            source = open_source(db_path, source_format)
+        except Exception as e:
+            raise CommandError(str(e))
+
+        mdb = MealDatabase(source)
         print('Loading...')
-        mdb.load()
+        mdb.load(workers=workers)
 
         print('Done!')   
 
 
-    def create_connection(self, database_path):
+    def export(self, db_path):
+
+        if os.path.exists(db_path):
+            raise CommandError(f'"{db_path}" already exists')
 
-       conn = sqlite3.connect(database_path)
+        conn = sqlite3.connect(db_path)
+        try:
+            print('Exporting...')
+            MealDatabase(conn).export()
+        except BaseException:
+            conn.close()
+            os.remove(db_path)
+            raise
+        conn.close()
 
-       return conn
+        print('Done!')
 
 
 '''
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cookbook.models import Cookbook
+
+
+class Command(BaseCommand):
+
+    help = 'Maintains uploaded media (cookbook cover images) of the Meal Planner'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        clean_parser = subparsers.add_parser(
+            'clean', help='List cover images and renditions no cookbook uses')
+        clean_parser.add_argument('--delete', action='store_true',
+                                  help='Delete the unused files')
+
+        return super().add_arguments(parser)
+
+
+    def handle(self, *args, **kwargs):
+
+        action = kwargs['action']
+        if action == 'clean':
+            self.clean_images(kwargs['delete'])
+        else:
+            raise CommandError(f'Unknown action "{action}"')
+
+
+    def clean_images(self, delete: bool):
+        '''
+        List (and optionally delete) cover image files no cookbook uses
+        '''
+        storage = Cookbook._meta.get_field('image').storage
+        unused = Cookbook.unused_images()
+        for name in unused:
+            print(name)
+            if delete:
+                storage.delete(name)
+
+        if not unused:
+            print('No unused cover images found')
+        elif delete:
+            print(f'Deleted {len(unused)} unused file(s)')
+        else:
+            print(f'Found {len(unused)} unused file(s), use --delete to delete them')
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+import csv
+
+from recipe import bulk_ratings
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+
+    help = 'Maintains recipe ratings in the Meal Planner database'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        check_parser = subparsers.add_parser(
+            'check', help='Check rating totals and rankings stored on recipes against '
+                          'their ratings and meals')
+        check_parser.add_argument('--fix', action='store_true',
+                                  help='Correct any rating totals or rankings found to be wrong')
+
+        import_parser = subparsers.add_parser(
+            'import', help='Create or update ratings from a CSV file')
+        import_parser.add_argument('csv_path', type=str,
+                                   help='Path to CSV file with columns diner, recipe and rating '
+                                        '(ids of diner and recipe, rating from 1 to 5)')
+
+        return super().add_arguments(parser)
+
+
+    def handle(self, *args, **kwargs):
+
+        action = kwargs['action']
+        if action == 'check':
+            self.check_rating_totals(kwargs['fix'])
+        elif action == 'import':
+            self.import_ratings(kwargs['csv_path'])
+        else:
+            raise CommandError(f'Unknown action "{action}"')
+
+
+    def check_rating_totals(self, fix: bool):
+        '''
+        Compare rating totals and rankings stored on recipes with their ratings and meals
+        '''
+        with transaction.atomic():
+            wrong_count = Recipe.recalculate_rating_totals()
+            # rankings are checked against the corrected totals
+            wrong_ranking_count = Recipe.refresh_rankings(count_meals=True)
+            if not fix:
+                # only report, leave stored totals as they were
+                transaction.set_rollback(True)
+
+        if wrong_count == 0 and wrong_ranking_count == 0:
+            print('All recipe rating totals and rankings are correct')
+        elif fix:
+            print(f'Corrected rating totals of {wrong_count} recipe(s) '
+                  f'and rankings of {wrong_ranking_count} recipe(s)')
+        else:
+            print(f'Rating totals of {wrong_count} recipe(s) and rankings of '
+                  f'{wrong_ranking_count} recipe(s) are wrong, use --fix to correct them')
+            raise CommandError('Recipe rating totals or rankings are inconsistent')
+
+
+    def import_ratings(self, csv_path: str):
+        '''
+        Create or update ratings listed in a CSV file
+        '''
+        with open(csv_path, 'r', encoding='utf-8', newline='') as infile:
+            reader = csv.DictReader(infile)
+            missing_columns = {'diner', 'recipe', 'rating'} - set(reader.fieldnames or [])
+            if missing_columns:
+                raise CommandError(f'CSV file is missing column(s): {", ".join(sorted(missing_columns))}')
+            ratings = [(row['diner'], row['recipe'], row['rating']) for row in reader]
+
+        try:
+            counts = bulk_ratings.save_ratings(ratings)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        print(f"Ratings created: {counts['created']}, updated: {counts['updated']}, "
+              f"unchanged: {counts['unchanged']}")
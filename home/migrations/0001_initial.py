@@ -0,0 +1,30 @@
+# Generated by Django 4.2.11 on 2026-10-19 20:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(blank=True, max_length=255)),
+                ('table_name', models.CharField(max_length=50)),
+                ('source_id', models.BigIntegerField()),
+                ('row_hash', models.CharField(max_length=40)),
+                ('django_id', models.BigIntegerField(null=True)),
+                ('created', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='loadedrow',
+            constraint=models.UniqueConstraint(fields=('source', 'table_name', 'source_id'), name='unique_loaded_row'),
+        ),
+    ]
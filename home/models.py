@@ -4,4 +4,35 @@ Definition of models.
 
 from django.db import models
 
-# Create your models here.
+
+class LoadedRow(models.Model):
+    '''
+    A row of the legacy database loaded by the data_manager command
+
+    The hash of the row's content is the load's checkpoint: rows already
+    loaded, and unchanged since, are skipped when a failed load is run
+    again or the database is loaded again (see _dataload.py).
+    '''
+    # the source database (its path), as ids are only unique within a source
+    source = models.CharField(max_length=255, blank=True)
+    table_name = models.CharField(max_length=50)
+    source_id = models.BigIntegerField()
+    row_hash = models.CharField(max_length=40)
+    # id of the row in the Django table (none for junction table rows)
+    django_id = models.BigIntegerField(null=True)
+    # the Django row was created from this row, rather than matched by its key
+    # (e.g. a meal on the same day); only rows created are updated from the source
+    created = models.BooleanField(default=False)
+
+
+    class Meta:
+        '''
+        Metadata of the LoadedRow
+        '''
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'table_name', 'source_id'], name='unique_loaded_row'),
+        ]
+
+
+    def __str__(self):
+        return f'{self.source} {self.table_name} {self.source_id}'
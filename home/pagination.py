@@ -0,0 +1,52 @@
+"""
+Helpers for lists that are sorted and paginated by the server.
+"""
+
+from django.core.paginator import Paginator
+
+# Number of rows shown on each page of a list
+PAGE_SIZE = 50
+
+
+def sorted_page(request, queryset, sort_orders: dict, default_sort: str, page_size: int=PAGE_SIZE) -> dict:
+    """
+    Sorts a queryset and returns the page requested in the query string.
+
+    The query string's "sort" value is the name of one of sort_orders,
+    prefixed with "-" for descending order; "page" is the page number.
+
+    @param request: request object
+    @param queryset: queryset of the rows to list
+    @param sort_orders: dictionary of sort name to tuple of fields to order
+                        by (ascending); the fields should make the order unique
+    @param default_sort: sort used when query string has none (or is invalid)
+    @param page_size: number of rows on each page
+    @return: template context with the page (page_obj), the sort used (sort),
+             and the sort each column header should link to (next_sort)
+    """
+    sort = request.GET.get('sort', default_sort)
+    descending = sort.startswith('-')
+    sort_name = sort.lstrip('-')
+    if sort_name not in sort_orders:
+        sort = default_sort
+        descending = sort.startswith('-')
+        sort_name = sort.lstrip('-')
+
+    order = sort_orders[sort_name]
+    if descending:
+        order = [f'-{field}' for field in order]
+
+    paginator = Paginator(queryset.order_by(*order), page_size)
+    page = paginator.get_page(request.GET.get('page'))
+
+    # Clicking the header of the current sort column reverses the order
+    next_sort = {
+        name: f'-{name}' if name == sort_name and not descending else name
+        for name in sort_orders
+    }
+
+    return {
+        'page_obj': page,
+        'sort': sort,
+        'next_sort': next_sort,
+    }
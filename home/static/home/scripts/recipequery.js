@@ -27,6 +27,60 @@ function stoppedTyping() {
     } else {
         document.getElementById('id_recipe_search_button').disabled = true;
     }
+
+    scheduleSuggest();
+}
+
+// Delay after the last keystroke before asking for suggestions
+var SUGGEST_DELAY = 150; // ms
+// Minimum number of characters typed before suggesting recipes
+var SUGGEST_MIN_LENGTH = 2;
+// Pending suggestion timer and request (so they can be cancelled)
+var suggestTimer = null;
+var suggestRequest = null;
+
+/**
+ * Cancel any pending or running request for suggestions
+ */
+function cancelSuggest() {
+    if (suggestTimer != null) {
+        clearTimeout(suggestTimer);
+        suggestTimer = null;
+    }
+    if (suggestRequest != null) {
+        suggestRequest.abort();
+        suggestRequest = null;
+    }
+}
+
+/**
+ * Suggest recipes once the user pauses typing
+ * 
+ * Suggestions are skipped for searches using keywords (e.g. TYPE:),
+ * those need the full search.
+ */
+function scheduleSuggest() {
+    cancelSuggest();
+
+    let search_text = document.getElementById('id_recipe_search_keys').value.trim();
+    if (search_text.length < SUGGEST_MIN_LENGTH || search_text.includes(':')) {
+        return;
+    }
+
+    suggestTimer = setTimeout(function () {
+        suggestTimer = null;
+        suggestRequest = $.ajax({
+            url: 'recipe_suggest',
+            data: {
+                'keys': search_text
+            },
+            dataType: 'json',
+            success: function (data) {
+                suggestRequest = null;
+                showResults(data, false);
+            }
+        });
+    }, SUGGEST_DELAY);
 }
 
 function rowClick() {
@@ -35,39 +89,126 @@ function rowClick() {
     });
 }
 
+// Cursor for the next page of search results (null when there are no more)
+var searchNextCursor = null;
+// Search keys of the current search, reused when loading more results
+var searchKeys = "";
+
 function recipeSearch() {
-    let search_keys = document.getElementById('id_recipe_search_keys').value;
+    // Suggestions arriving now would replace the search results
+    cancelSuggest();
+
+    searchKeys = document.getElementById('id_recipe_search_keys').value;
+    searchNextCursor = null;
+
+    requestResults(false);
+}
+
+/**
+ * Load the next page of results for the current search
+ */
+function recipeSearchMore() {
+    if (searchNextCursor == null) {
+        return;
+    }
+
+    requestResults(true);
+}
+
+/**
+ * Request a page of search results from the server
+ *
+ * @param {bool} append - true to add results to the current ones (next page),
+ *                        false to replace them (new search)
+ */
+function requestResults(append) {
+    let query = {
+        'keys': searchKeys
+    };
+    if (append) {
+        query['cursor'] = searchNextCursor;
+    }
+
+    // Prevent requesting the same page twice while waiting for a response
+    document.getElementById('id_recipe_search_more').disabled = true;
 
     $.ajax({
         url: 'recipe_search',
-        data: {
-            'keys': search_keys
-        },
+        data: query,
         dataType: 'json',
         success: function (data) {
-            showResults(data)
+            searchNextCursor = data.has_more ? data.next_cursor : null;
+            showResults(data, append);
+            showMoreButton(data.has_more);
+        },
+        error: function (xhr) {
+            // e.g. invalid search (bad date) or cursor: the server says why
+            let message = (xhr.responseJSON && xhr.responseJSON.error) || "Search failed, please try again";
+            showSearchError(message, append);
         }
     });
 
 }
 
+/**
+ * Show an error from the server in the search result table
+ *
+ * @param {string} message - error message
+ * @param {bool} append - true if loading more results failed: the results
+ *                        shown are kept and more can be requested again
+ */
+function showSearchError(message, append) {
+    if (!append) {
+        clearResults();
+    }
+
+    var tbody = document.getElementById("id_recipe_search_results").getElementsByTagName('tbody')[0];
+    var row = tbody.insertRow(-1);
+    var cell = row.insertCell(0);
+    cell.colSpan = 7;
+    var text = document.createElement("b");
+    text.textContent = message;  // not HTML: the message may repeat the search text
+    cell.appendChild(text);
+
+    showMoreButton(append && searchNextCursor != null);
+}
+
+/**
+ * Show or hide the button used to load more search results
+ *
+ * @param {bool} hasMore - true if server has more results for the search
+ */
+function showMoreButton(hasMore) {
+    let moreButton = document.getElementById('id_recipe_search_more');
+    moreButton.hidden = !hasMore;
+    moreButton.disabled = !hasMore;
+}
+
 /**
  * Show the results of the Recipe Search
  * 
  * @param {*} recipeList list of recipes that will be displayed as a JSON object
+ * @param {bool} append true if recipes are a further page of the current results
  * 
  * Notes:
  *  This code will update a table element with each recipe in a new row.
  *  User needs at the very least see the recipe name and probably cookbook and author
  *  If a match score has been calculated then that would be good to show.
+ *  Results arrive from the server already sorted by recipe name.
  */
-function showResults(recipeList) {
+function showResults(recipeList, append) {
 
     let table_id = "id_recipe_search_results" // id for search result table
 
     // Find a <table> element with id="myTable":
     var table = document.getElementById(table_id);
 
+    if (append) {
+        // Further page of current search: headers are already in place
+        addResultRows(table, recipeList.recipes);
+        return;
+    }
+
     // Clear any previous results
     clearResults();
 
@@ -79,7 +220,7 @@ function showResults(recipeList) {
     }
     else {
         // Add table headers
-        // Create an empty <thead> element and add it to the table:
+        // Create an empty <tr> element and add it to the first position of <thead>:
         var header = table.getElementsByTagName('thead')[0];
         header.classList.add("table_header");  // make table header sticky
 
@@ -116,35 +257,43 @@ function showResults(recipeList) {
         }
 
         // Add the results to the table
+        addResultRows(table, recipeList.recipes);
+    }
+}
 
-        var tbody = table.getElementsByTagName('tbody')[0];
-
-        for (let i = 0; i < recipeList.recipes.length; i++) {
-            var recipe = recipeList.recipes[i];
+/**
+ * Add recipes to the end of the search result table
+ *
+ * @param {*} table - search result table element
+ * @param {*} recipes - list of recipes (JSON objects) to add
+ */
+function addResultRows(table, recipes) {
+    var tbody = table.getElementsByTagName('tbody')[0];
 
-            // Create an empty <tr> element and add it to the 1st position of the table:
-            var row = tbody.insertRow(0);
+    for (let i = 0; i < recipes.length; i++) {
+        var recipe = recipes[i];
 
-            // Insert new cells (<td> elements) at the 1st and 2nd position of the "new" <tr> element:
+        // Create an empty <tr> element and add it to the end of the table:
+        var row = tbody.insertRow(-1);
 
-            var col_idx = 0;
-            for (col in recipe) {
-                var cell = row.insertCell(col_idx);
+        // Insert new cells (<td> elements) at the 1st and 2nd position of the "new" <tr> element:
 
-                // Hide the ID cell(s)
-                if (col_idx == 0) {
-                    cell.classList.add("hidden-xs", "hidden-sm", "hidden-md", "hidden-lg");
-                }
+        var col_idx = 0;
+        for (col in recipe) {
+            var cell = row.insertCell(col_idx);
 
-                // Add column text
-                cell.innerHTML = recipe[col];
-                col_idx++;
+            // Hide the ID cell(s)
+            if (col_idx == 0) {
+                cell.classList.add("hidden-xs", "hidden-sm", "hidden-md", "hidden-lg");
             }
-        }
-
-        addRowHandlers(tbody);
 
+            // Add column text
+            cell.innerHTML = recipe[col];
+            col_idx++;
+        }
     }
+
+    addRowHandlers(tbody);
 }
 
 /**
@@ -158,7 +307,9 @@ function clearResults() {
     while (table.rows.length > 0) {
         table.deleteRow(0);
     }
-    
+
+    // No results, so nothing more to load
+    showMoreButton(false);
 }
 
 
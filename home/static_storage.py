@@ -0,0 +1,77 @@
+"""
+Storage for collected static files (collectstatic).
+
+Files are stored with a hash of their content in the name (e.g.
+site.55e7cbb9ba48.css, see ManifestStaticFilesStorage) so the web server
+can let browsers cache them for good. Text based files also get
+precompressed copies (.gz, and .br if the brotli package is installed)
+which the web server sends to browsers that accept them (see
+deploy/apache_template.xml).
+"""
+
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip copies are made
+    brotli = None
+
+# Extensions of files worth compressing (images other than SVG and woff
+# fonts are already compressed)
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.ttf', '.eot', '.json', '.map', '.txt')
+
+
+def compress_file(path: str) -> list:
+    """
+    Writes precompressed copies of a file next to it.
+
+    A copy is only kept if it is smaller than the file.
+
+    @param path: file system path of the file
+    @return: paths of the copies written
+    """
+    with open(path, 'rb') as infile:
+        content = infile.read()
+
+    # mtime 0 so the same file always gives the same .gz
+    compressed = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed['.br'] = brotli.compress(content)
+
+    written = []
+    for extension, data in compressed.items():
+        if len(data) < len(content):
+            with open(path + extension, 'wb') as outfile:
+                outfile.write(data)
+            written.append(path + extension)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest static files storage that also precompresses the hashed files.
+    """
+
+    # Until collectstatic has been run (development server, tests) there is
+    # no manifest and files are used under their own names
+    manifest_strict = False
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+
+        if dry_run:
+            return
+
+        # final names of all files (CSS files can be hashed more than once)
+        for hashed_name in sorted(set(self.hashed_files.values())):
+            if os.path.splitext(hashed_name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                compress_file(self.path(hashed_name))
@@ -3,8 +3,34 @@ This file demonstrates writing tests using the unittest module. These will pass
 when you run "manage.py test".
 """
 
+import contextlib
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from unittest import mock
+
 import django
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.templatetags.static import static
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from cookbook.models import Author, Cookbook
+from home.management.commands._dataload import MealDatabase, MealTable, Table, table_levels
+from home.models import LoadedRow
+from meal.models import Meal
+from recipe import search_cache, typeahead
+from recipe.models import CacheVersion, Diner, Recipe, RecipeType
 
 # TODO: Configure your database in settings.py and sync before running tests.
 
@@ -32,3 +58,343 @@ class ViewTest(TestCase):
         """Tests the about page."""
         response = self.client.get('/about')
         self.assertContains(response, 'About', 3, 200)
+
+
+class StaticFilesTest(TestCase):
+    """Tests for collecting static files with hashed names and precompressed copies."""
+
+    def test_collectstatic(self):
+        """Tests that hashed files get .gz copies and templates use the hashed names."""
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        with override_settings(STATIC_ROOT=static_root):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            css_url = static('home/content/site.css')
+            png_url = static('home/images/plus24.png')
+
+        self.assertRegex(css_url, r'^/static/home/content/site\.[0-9a-f]{12}\.css$')
+        css_path = os.path.join(static_root, css_url[len('/static/'):])
+        with open(css_path, 'rb') as css_file, gzip.open(css_path + '.gz', 'rb') as gz_file:
+            self.assertEqual(gz_file.read(), css_file.read())
+        # images (other than SVG) are not compressed again
+        png_path = os.path.join(static_root, png_url[len('/static/'):])
+        self.assertFalse(os.path.exists(png_path + '.gz'))
+
+
+# Schema of the legacy SQLite database loaded by the data_manager command
+LEGACY_SCHEMA = '''
+    create table Author (id integer primary key, first_name text, last_name text);
+    create table Cookbook (id integer primary key, title text, description text, author integer,
+                           published_date integer, url text, edition text, image text);
+    create table Recipe (id integer primary key, title text, cook_book integer, page_number integer, notes text);
+    create table Diner (id integer primary key, first_name text, last_name text);
+    create table RecipeType (id integer primary key, name text);
+    create table RecipeToType (id integer primary key, recipeid integer, recipetypeid integer);
+    create table Meal (id integer primary key, scheduled_date text, was_made integer, recipe integer, notes text);
+'''
+
+
+def create_legacy_database(meal_count=300):
+    """Returns a connection to an in-memory legacy database with some data."""
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(LEGACY_SCHEMA)
+    conn.executemany('insert into Author values (?, ?, ?)', [(10, 'Anna', 'Olson'), (11, 'Jamie', 'Oliver')])
+    conn.executemany('insert into Cookbook values (?, ?, ?, ?, ?, ?, ?, ?)', [
+        (20, 'Bake', 'Baking', 10, 2010, '', '1st', ''),
+        (21, '5 Ingredients', '', 11, 2017, '', '', ''),
+        (22, 'Clippings', '', 0, 2000, '', '', ''),
+    ])
+    conn.executemany('insert into Recipe values (?, ?, ?, ?, ?)', [
+        (30, 'Bread', 20, 12, ''), (31, 'Cake', 20, 'NULL', 'Rich'),
+        (32, 'Pasta', 21, 40, ''), (33, 'Salad', 22, 3, ''), (34, 'Stew', 21, 80, ''),
+    ])
+    conn.executemany('insert into Diner values (?, ?, ?)', [(40, 'Ann', 'Smith'), (41, 'Bob', 'Smith')])
+    conn.executemany('insert into RecipeType values (?, ?)', [(50, 'Dessert'), (51, 'Main')])
+    conn.executemany('insert into RecipeToType values (?, ?, ?)', [(60, 31, 50), (61, 32, 51), (62, 34, 51)])
+
+    first_day = datetime.datetime(2020, 1, 1)
+    meals = [(70 + i, (first_day + datetime.timedelta(days=i)).strftime('%Y-%m-%d %H:%M:%S'),
+              i % 2, 30 + i % 5, None) for i in range(meal_count)]
+    # second meal on the first day: only one meal per day is loaded
+    meals.append((70 + meal_count, first_day.strftime('%Y-%m-%d %H:%M:%S'), 0, 33, 'Again'))
+    conn.executemany('insert into Meal values (?, ?, ?, ?, ?)', meals)
+    conn.commit()
+    return conn
+
+
+class DataLoaderTest(TestCase):
+    """Tests for loading the Django database from a legacy SQLite database."""
+
+    def _load(self, conn, source_name=''):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            MealDatabase(conn, source_name).load()
+        return output.getvalue()
+
+    def test_load(self):
+        """Tests that all tables are loaded with their relationships."""
+        output = self._load(create_legacy_database())
+        self.assertIn('Meal: 300 row(s) created, 0 already loaded', output)
+        self.assertRegex(output, r'Recipe: 5 row\(s\) created.*rows/sec')
+
+        pasta = Recipe.objects.select_related('cook_book__author').get(name='Pasta')
+        self.assertEqual(pasta.cook_book.title, '5 Ingredients')
+        self.assertEqual(pasta.cook_book.author.last_name, 'Oliver')
+        self.assertEqual(list(pasta.recipe_types.values_list('name', flat=True)), ['Main'])
+        self.assertEqual(Recipe.objects.get(name='Cake').page_number, 0)
+        self.assertEqual(Meal.objects.filter(recipe=pasta).count(), 60)
+        # times made is counted after the load
+        self.assertEqual(pasta.times_made, 30)
+
+    def test_load_invalidates_caches(self):
+        """Tests that a load replaces cached search results and suggestions of every process."""
+        catalogue_version = search_cache.catalogue_version()
+        self.assertEqual(typeahead.suggest('bre'), [])
+
+        self._load(create_legacy_database(meal_count=5))
+        # the versions are read from the database, as by the web server
+        self.assertGreater(CacheVersion.current(search_cache.CATALOGUE_VERSION_KEY), catalogue_version)
+        self.assertEqual([r[1] for r in typeahead.suggest('bre')], ['Bread'])
+
+    def test_pk_mapping(self):
+        """Tests that source ids map to Django rows with one query for the table."""
+        mdb = MealDatabase(create_legacy_database(meal_count=5))
+        with contextlib.redirect_stdout(io.StringIO()):
+            mdb.load()
+
+        mapping = mdb.get_table_by_name('Author').pk_mapping
+        self.assertIs(mapping, mdb.get_table_by_name('Author').pk_mapping)
+        with self.assertNumQueries(1):
+            names = [mapping.find_django_row(source_id).last_name for source_id in (10, 11, 10)]
+        self.assertEqual(names, ['Olson', 'Oliver', 'Olson'])
+        self.assertIsNone(mapping.find_django_id(0))
+
+    def test_load_query_count(self):
+        """Tests that the number of queries to load a table does not grow with its rows."""
+        def meal_table_queries(meal_count):
+            # start from an empty database
+            for model in (LoadedRow, Meal, Recipe, Cookbook, Author, Diner, RecipeType):
+                model.objects.all().delete()
+            mdb = MealDatabase(create_legacy_database(meal_count=meal_count))
+            with contextlib.redirect_stdout(io.StringIO()):
+                for level in mdb.table_levels[:-1]:
+                    for table in level:
+                        table.load(mdb.read_table_from_source(table.name))
+                meal_table = mdb.get_table_by_name('Meal')
+                with CaptureQueriesContext(connection) as queries:
+                    meal_table.load(mdb.read_table_from_source('Meal'))
+            # only count lookups: inserts are made in batches of rows
+            return [q['sql'] for q in queries if not q['sql'].startswith('INSERT')]
+
+        few_meals = meal_table_queries(10)
+        self.assertEqual(len(meal_table_queries(500)), len(few_meals))
+        self.assertLess(len(few_meals), 10)
+
+    def test_recipe_types(self):
+        """Tests that recipe types are linked with one insert, skipping existing links."""
+        conn = create_legacy_database(meal_count=5)
+        self._load(conn)
+        Recipe.objects.get(name='Stew').recipe_types.clear()
+        LoadedRow.objects.filter(table_name='RecipeToType').delete()
+        conn.execute('insert into RecipeToType values (63, 30, 51)')
+
+        with CaptureQueriesContext(connection) as queries:
+            output = self._load(conn)
+
+        self.assertIn('RecipeToType: 2 row(s) created, 2 already loaded', output)
+        through_table = Recipe.recipe_types.through._meta.db_table
+        inserts = [q['sql'] for q in queries if q['sql'].startswith(f'INSERT OR IGNORE INTO "{through_table}"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            sorted(Recipe.objects.filter(recipe_types__name='Main').values_list('name', flat=True)),
+            ['Bread', 'Pasta', 'Stew'])
+
+    def test_resume_and_update(self):
+        """Tests that a failed load resumes after its last batch and changed rows are updated."""
+        conn = create_legacy_database()
+        read_table_from_source = MealDatabase.read_table_from_source
+
+        def read_in_small_batches(mdb, table_name):
+            return read_table_from_source(mdb, table_name, batch_size=100)
+
+        create_row = MealTable._create_row
+
+        def fail_on_second_batch(table, row):
+            if row.id == 200:
+                raise RuntimeError('Connection lost')
+            return create_row(table, row)
+
+        with mock.patch.object(MealDatabase, 'read_table_from_source', read_in_small_batches):
+            with mock.patch.object(MealTable, '_create_row', fail_on_second_batch):
+                with self.assertRaisesMessage(RuntimeError, 'Connection lost'):
+                    self._load(conn)
+            # the first batch was loaded
+            self.assertEqual(Meal.objects.count(), 100)
+
+            conn.execute("update Author set last_name = 'Olsen' where id = 10")
+            output = self._load(conn)
+
+        self.assertIn('Author: 0 row(s) created, 1 already loaded, 1 updated', output)
+        self.assertIn('Meal: 200 row(s) created, 101 already loaded, 0 updated', output)
+        self.assertEqual(Meal.objects.count(), 300)
+        self.assertTrue(Author.objects.filter(first_name='Anna', last_name='Olsen').exists())
+
+    def test_export(self):
+        """Tests that the Django database is exported to the legacy schema and loads back."""
+        self._load(create_legacy_database())
+        export_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_folder)
+        export_path = os.path.join(export_folder, 'export.sqlite3')
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command('data_manager', 'export', export_path)
+        self.assertIn('Meal: 300 row(s) exported', output.getvalue())
+        with self.assertRaisesMessage(CommandError, 'already exists'):
+            call_command('data_manager', 'export', export_path)
+
+        conn = sqlite3.connect(export_path)
+        self.addCleanup(conn.close)
+        self.assertEqual(
+            conn.execute('select r.title, c.title, a.last_name from Recipe r join Cookbook c on r.cook_book = c.id '
+                         "join Author a on c.author = a.id where r.title = 'Pasta'").fetchone(),
+            ('Pasta', '5 Ingredients', 'Oliver'))
+        self.assertEqual(conn.execute('select scheduled_date, was_made from Meal order by id').fetchone(),
+                         ('2020-01-01 00:00:00', 0))
+
+        # loading the export matches every row with the rows it was exported from
+        output = self._load(conn, source_name=export_path)
+        self.assertIn('Meal: 0 row(s) created, 300 already loaded', output)
+        self.assertIn('RecipeToType: 0 row(s) created, 3 already loaded', output)
+
+    def test_load_text_sources(self):
+        """Tests loading folders of CSV and JSON lines files, one per table."""
+        conn = create_legacy_database(meal_count=20)
+        csv_folder = tempfile.mkdtemp()
+        jsonl_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, csv_folder)
+        self.addCleanup(shutil.rmtree, jsonl_folder)
+        for table in ('Author', 'Cookbook', 'Recipe', 'Diner', 'RecipeType', 'RecipeToType', 'Meal'):
+            cursor = conn.execute(f'select * from {table}')
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+            with open(os.path.join(csv_folder, f'{table.lower()}.csv'), 'w', newline='') as csv_file:
+                writer = csv.writer(csv_file)
+                writer.writerow([column.upper() for column in columns] + ['source'])
+                writer.writerows(list(row) + ['other tool'] for row in rows)
+            if table != 'RecipeToType':
+                with open(os.path.join(jsonl_folder, f'{table}.jsonl'), 'w') as jsonl_file:
+                    for row in rows:
+                        record = dict(zip(columns, row))
+                        if table == 'Meal':
+                            # other tools write meal dates without a time
+                            record['scheduled_date'] = record['scheduled_date'][:10]
+                        jsonl_file.write(json.dumps(record) + '\n')
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command('data_manager', 'load', csv_folder)
+        self.assertIn('Meal: 20 row(s) created', output.getvalue())
+        pasta = Recipe.objects.get(name='Pasta')
+        self.assertEqual((pasta.cook_book.title, pasta.page_number), ('5 Ingredients', 40))
+        self.assertEqual(Recipe.objects.get(name='Cake').page_number, 0)
+        self.assertEqual(list(pasta.recipe_types.values_list('name', flat=True)), ['Main'])
+        self.assertEqual(Meal.objects.filter(was_made=True).count(), 10)
+
+        # the same rows from another source are matched with the rows loaded
+        # (load is the action when none is given)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command('data_manager', jsonl_folder)
+        self.assertIn('No jsonl file for table RecipeToType', output.getvalue())
+        self.assertIn('Meal: 0 row(s) created, 21 already loaded', output.getvalue())
+        self.assertEqual(Meal.objects.count(), 20)
+
+    def test_table_levels(self):
+        """Tests that tables are grouped in levels by their foreign keys."""
+        mdb = MealDatabase(create_legacy_database(meal_count=5))
+        self.assertEqual([[t.name for t in level] for level in mdb.table_levels], [
+            ['Author', 'Diner', 'RecipeType'], ['Cookbook'], ['Recipe'], ['RecipeToType', 'Meal']])
+
+        cyclic_defs = [
+            {'name': 'A', 'foreign_keys': []},
+            {'name': 'B', 'foreign_keys': [{'column': 'a', 'related_table': 'A'},
+                                           {'column': 'c', 'related_table': 'C'}]},
+            {'name': 'C', 'foreign_keys': [{'column': 'b', 'related_table': 'B'}]},
+        ]
+        with self.assertRaisesMessage(Exception, 'Foreign keys of tables B, C form a cycle'):
+            table_levels(cyclic_defs)
+
+    def test_load_workers(self):
+        """Tests that the tables of a level are loaded in parallel, one level at a time."""
+        events = []
+
+        def load(table, batches):
+            events.append(('start', table.name, threading.current_thread().name))
+            time.sleep(0.01)
+            events.append(('end', table.name, threading.current_thread().name))
+
+        mdb = MealDatabase(create_legacy_database(meal_count=5))
+        with mock.patch.object(Table, 'load', load), contextlib.redirect_stdout(io.StringIO()):
+            mdb.load(workers=2)
+
+        position = {(event, name): i for i, (event, name, _) in enumerate(events)}
+        for name in ('Author', 'Diner', 'RecipeType'):
+            self.assertLess(position[('end', name)], position[('start', 'Cookbook')])
+        self.assertLess(position[('end', 'Recipe')], position[('start', 'Meal')])
+        threads = {name: thread for event, name, thread in events}
+        self.assertTrue(threads['Author'].startswith('data_load'))
+        self.assertEqual(threads['Cookbook'], threading.current_thread().name)
+
+    def test_read_table_from_source(self):
+        """Tests that source tables are read in batches of named tuples."""
+        mdb = MealDatabase(create_legacy_database(meal_count=250))
+        batches = mdb.read_table_from_source('Meal', batch_size=100)
+        first_batch = next(batches)
+        self.assertEqual(len(first_batch), 100)
+        self.assertEqual((first_batch[0].id, first_batch[0].recipe), (70, 30))
+        self.assertEqual([len(batch) for batch in batches], [100, 51])
+
+        # a table loaded in several batches
+        table = mdb.get_table_by_name('Author')
+        with contextlib.redirect_stdout(io.StringIO()):
+            table.load(mdb.read_table_from_source('Author', batch_size=1))
+        self.assertEqual(table.pk_mapping.find_django_row(11).last_name, 'Oliver')
+
+    def test_changed_row_with_duplicate_key(self):
+        """Tests that a changed row matched by its key does not overwrite the row it was matched with."""
+        conn = create_legacy_database(meal_count=5)
+        self._load(conn)
+        # the second meal of the first day was matched with the first one's meal
+        conn.execute("update Meal set notes = 'Again, changed' where id = 75")
+        output = self._load(conn)
+        self.assertIn('Meal: 0 row(s) created, 6 already loaded, 0 updated', output)
+        meal = Meal.objects.get(scheduled_date=datetime.date(2020, 1, 1))
+        self.assertEqual((meal.recipe.name, meal.notes), ('Bread', ''))
+
+        # a changed row that created its meal updates it
+        conn.execute("update Meal set notes = 'Crusty' where id = 70")
+        output = self._load(conn)
+        self.assertIn('Meal: 0 row(s) created, 5 already loaded, 1 updated', output)
+        self.assertEqual(Meal.objects.get(scheduled_date=datetime.date(2020, 1, 1)).notes, 'Crusty')
+
+    def test_skipped_rows_retried(self):
+        """Tests that rows with a missing reference are loaded once the reference is."""
+        conn = create_legacy_database(meal_count=5)
+        conn.execute("insert into Recipe values (35, 'Soup', 23, 7, '')")
+        output = self._load(conn)
+        self.assertIn('Invalid cook_book reference', output)
+        self.assertFalse(LoadedRow.objects.filter(table_name='Recipe', source_id=35).exists())
+
+        conn.execute("insert into Cookbook values (23, 'Soups', '', 10, 2015, '', '', '')")
+        output = self._load(conn)
+        self.assertIn('Recipe: 1 row(s) created, 5 already loaded', output)
+        self.assertEqual(Recipe.objects.get(name='Soup').cook_book.title, 'Soups')
+
+    def test_reload(self):
+        """Tests that loading the same data again creates nothing."""
+        conn = create_legacy_database(meal_count=20)
+        self._load(conn)
+        output = self._load(conn)
+        self.assertIn('Meal: 0 row(s) created, 21 already loaded', output)
+        self.assertEqual(Meal.objects.count(), 20)
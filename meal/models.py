@@ -17,6 +17,17 @@ class Meal(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
 
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        meal = super().from_db(db, field_names, values)
+        # Remember the stored recipe so its ranking can be refreshed
+        # when the meal is moved to another recipe
+        loaded = dict(zip(field_names, values))
+        if 'recipe_id' in loaded:
+            meal._stored_recipe_id = loaded['recipe_id']
+        return meal
+
+
     def __str__(self):
         fdate = self.scheduled_date.strftime("%Y-%b-%d")  # date format e.g. 2020-Oct-13
         return f"{self.recipe} on {fdate}"
@@ -8,6 +8,11 @@ Replace this with more appropriate tests for your application.
 import django
 from django.test import TestCase
 
+from cookbook.models import Author, Cookbook
+from meal import views
+from recipe import search_cache
+from recipe.models import Recipe
+
 # TODO: Configure your database in settings.py and sync before running tests.
 
 class SimpleTest(TestCase):
@@ -23,4 +28,73 @@ class SimpleTest(TestCase):
         """
         Tests that 1 + 1 always equals 2.
         """
-        self.assertEqual(1 + 1, 2)
\ No newline at end of file
+        self.assertEqual(1 + 1, 2)
+
+class RecipeSearchTest(TestCase):
+    """Tests for the recipe search request handler."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Anna', last_name='Olson')
+        cookbook = Cookbook.objects.create(title='Bake', author=author, publish_date=2010)
+        for i in range(7):
+            Recipe.objects.create(name=f'Pie {i}', cook_book=cookbook)
+        Recipe.objects.create(name='Soup', cook_book=cookbook)
+
+    def setUp(self):
+        # test data is rolled back without signals, so start from a new
+        # catalogue version to not see results cached by other tests
+        search_cache.bump_catalogue_version()
+
+    def _search(self, **params):
+        response = self.client.get('/meal/recipe_search', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_follow_cursor(self):
+        """
+        Tests that following next_cursor returns every match once, in name order.
+        """
+        names = []
+        data = self._search(keys='RECIPE: pie', limit=3)
+        names += [r['name'] for r in data['recipes']]
+        while data['has_more']:
+            data = self._search(keys='RECIPE: pie', limit=3, cursor=data['next_cursor'])
+            names += [r['name'] for r in data['recipes']]
+
+        self.assertEqual(names, [f'Pie {i}' for i in range(7)])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_page_size_is_capped(self):
+        """
+        Tests that the requested page size can not exceed the maximum.
+        """
+        data = self._search(keys='pie', limit=views.SEARCH_MAX_PAGE_SIZE + 50)
+        self.assertEqual(len(data['recipes']), 7)
+        self.assertFalse(data['has_more'])
+
+    def test_invalid_cursor(self):
+        """
+        Tests that a malformed cursor is rejected.
+        """
+        response = self.client.get('/meal/recipe_search', {'keys': 'pie', 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cache_invalidated_by_catalogue_change(self):
+        """
+        Tests that cached results are not served after a recipe is added.
+        """
+        self.assertEqual(len(self._search(keys='soup')['recipes']), 1)
+        Recipe.objects.create(name='Soup 2')
+        self.assertEqual(len(self._search(keys='soup')['recipes']), 2)
+
+    def test_suggest(self):
+        """
+        Tests that the typeahead endpoint sees recipes as they are added.
+        """
+        response = self.client.get('/meal/recipe_suggest', {'keys': 'pie', 'limit': 2})
+        self.assertEqual([r['name'] for r in response.json()['recipes']], ['Pie 0', 'Pie 1'])
+
+        Recipe.objects.create(name='Apple Pie')
+        response = self.client.get('/meal/recipe_suggest', {'keys': 'pie', 'limit': 2})
+        self.assertEqual([r['name'] for r in response.json()['recipes']], ['Apple Pie', 'Pie 0'])
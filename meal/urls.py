@@ -9,5 +9,6 @@ urlpatterns = [
     path('new', views.new, name='new_meal'),
     path('meals_by_month', views.get_meals_for_month, name='meals_by_month'),
     path('recipe_search', views.search_for_recipes, name='recipe_search'),
+    path('recipe_suggest', views.suggest_recipes, name='recipe_suggest'),
     path('print', views.PrintCreatePopup, name='print'),
 ]
@@ -5,20 +5,29 @@ Date:
 Author:         M. Schmidt
 '''
 
+import base64
 import calendar
 import io
+import json
 
 from datetime import datetime, date
 from django.contrib.auth.decorators import login_required, permission_required
 from django.http import HttpResponse, FileResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import JsonResponse
+from django.db.models import Max, Q
 
 from .calendar_report import MonthlyMealPlan
-from recipe.search import Search
+from recipe.models import Recipe
+from recipe import search_cache, typeahead
+from recipe.search import Search, SearchSyntaxError
 from .models import Meal
 from .forms import MealForm, PrintForm
 
+# Number of recipes returned per page of search results (default and maximum)
+SEARCH_PAGE_SIZE = 25
+SEARCH_MAX_PAGE_SIZE = 100
+
 
 @permission_required('meal.change_meal')
 def detail(request, id):
@@ -199,20 +208,66 @@ def get_meals_for_month(request):
 def search_for_recipes(request):
     '''
     Handle query request from web application to get recipes base on search criteria
+    Results are returned one page at a time, ordered by recipe name; pass the
+    returned next_cursor back as "cursor" to get the following page
 
-    @param request: json representing the query; list of search tags
+    @param request: json representing the query; list of search tags,
+                    optional cursor and optional page size (limit)
     '''
 
     search_keys = str(request.GET.get('keys'))
-    results = _search_for_recipes(search_keys)
+    cursor = request.GET.get('cursor', None)
+    try:
+        page_size = int(request.GET.get('limit', SEARCH_PAGE_SIZE))
+    except ValueError:
+        page_size = SEARCH_PAGE_SIZE
+    # Cap page size so a broad search can not return the whole catalogue at once
+    page_size = max(1, min(page_size, SEARCH_MAX_PAGE_SIZE))
+
+    try:
+        results, next_cursor = _search_for_recipes(search_keys, cursor, page_size)
+    except SearchSyntaxError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid search cursor'}, status=400)
 
     data = {
-        'recipes': results
+        'recipes': results,
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor
     }
 
     return JsonResponse(data)
 
 
+def suggest_recipes(request):
+    '''
+    Handle typeahead request from web application to suggest recipes
+    whose name or recipe tags start with the typed text
+
+    @param request: json representing the query; text typed so far (keys)
+                    and optional maximum number of suggestions (limit)
+    '''
+
+    search_text = request.GET.get('keys', '')
+    try:
+        limit = int(request.GET.get('limit', typeahead.SUGGEST_LIMIT))
+    except ValueError:
+        limit = typeahead.SUGGEST_LIMIT
+    limit = max(1, min(limit, typeahead.SUGGEST_MAX_LIMIT))
+
+    suggestions = [
+        {
+            'id': recipe_id,
+            'name': name,
+            'cookbook': cookbook,
+        }
+        for recipe_id, name, cookbook in typeahead.suggest(search_text, limit)
+    ]
+
+    return JsonResponse({'recipes': suggestions})
+
+
 def _get_meals_for_month(year: int, month: int):
     '''
     Helper function that gathers meal information for a month from database
@@ -296,20 +351,59 @@ def _get_recipe_info_for_meal(meal):
     return recipe_info
 
 
-def _search_for_recipes(search_keys: str) -> list:
+def _search_for_recipes(search_keys: str, cursor=None, page_size: int=SEARCH_PAGE_SIZE):
+    '''
+    Helper function that finds one page of recipes matching the search keys
+
+    @param search_keys: search string (see recipe.search for syntax)
+    @param cursor: cursor returned with the previous page (None for first page)
+    @param page_size: maximum number of recipes to return
+    @return tuple of list of recipe dictionaries and cursor for next page
+            (None if there are no more results)
+    '''
 
-    # Call serach object
-    # TEST SEARCH
     srch = Search(search_keys)
+
+    # Equivalent searches share results until the recipe catalogue changes
+    cache_key = search_cache.cache_key(srch, cursor, page_size)
+    cached_results = search_cache.get_results(cache_key)
+    if cached_results is not None:
+        return cached_results
+
     recipe_result = srch.find()
 
     result_list = []
+    next_cursor = None
     if not recipe_result is None:
-        for recipe in recipe_result:  # type: ignore
-
-            # get last time recipe was made
-            last_made_date = _date_recipe_last_made(recipe)
-            times_made = _number_of_times_recipe_made(recipe)
+        # Re-select the matches so the date last made can be aggregated in the
+        # same query, without the search joins repeating recipes
+        # (the times made is stored on the recipe)
+        recipe_qs = Recipe.objects.filter(
+            pk__in=recipe_result.values('pk')
+        ).select_related(
+            'cook_book__author'
+        ).annotate(
+            last_made=Max('meal__scheduled_date', filter=Q(meal__was_made=True))
+        ).order_by('name', 'id')
+
+        # Keyset pagination: continue after the last (name, id) already returned
+        if cursor:
+            last_name, last_id = _decode_search_cursor(cursor)
+            recipe_qs = recipe_qs.filter(
+                Q(name__gt=last_name) | Q(name=last_name, id__gt=last_id))
+
+        # Get one extra recipe to find out if there is another page
+        page = list(recipe_qs[:page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            next_cursor = _encode_search_cursor(page[-1])
+
+        for recipe in page:
+            if recipe.last_made is not None:
+                last_made_date = recipe.last_made.strftime('%d-%b-%Y')
+            else:
+                # recipe scheduled, but never made
+                last_made_date = 'Never made'
 
             cb = recipe.cook_book
             cb_title = '' if cb is None else cb.title
@@ -323,45 +417,40 @@ def _search_for_recipes(search_keys: str) -> list:
                 'author': f'{author_fn} {author_ln}',
                 'last made': last_made_date,
                 'rating': recipe.rating_as_string,
-                'times made': times_made
+                'times made': recipe.times_made
             }
             result_list.append(candidate)
 
-        # Sort result list by recipe name
-        result_list = sorted(result_list, key=lambda d: d['name'], reverse = True)
-    return result_list
+    search_cache.set_results(cache_key, (result_list, next_cursor))
+    return result_list, next_cursor
 
 
-def _date_recipe_last_made(recipe):
+def _encode_search_cursor(recipe) -> str:
     '''
-    Returns when the recipe was last made
+    Returns an opaque cursor marking the position of the given recipe
+    in the search results (ordered by name, then id)
     '''
 
-    meals_w_recipe = Meal.objects.filter(recipe = recipe, was_made = True).order_by("-scheduled_date")
-
-    # meals sorted by scheduled date (descending), so first is most recent
-    recent_meal = meals_w_recipe.first()
-
-    if recent_meal is not None:
-        date_last_made = recent_meal.scheduled_date.strftime('%d-%b-%Y')
-    else:
-        # recipe scheduled, but never made
-        date_last_made = 'Never made'
-
-    return date_last_made
+    position = json.dumps([recipe.name, recipe.id])
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
 
 
-def _number_of_times_recipe_made(recipe):
+def _decode_search_cursor(cursor: str):
     '''
-    Returns the number of times a recipe was made
+    Returns the (name, id) position stored in a search cursor
+    Raises ValueError if the cursor is not valid
     '''
 
-    meals_w_recipe = Meal.objects.filter(recipe = recipe, was_made = True).order_by("-scheduled_date")
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        name, recipe_id = json.loads(position.decode('utf-8'))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid search cursor "{cursor}"') from e
 
-    # meals sorted by date made (descending), so first is most recent
-    count = meals_w_recipe.count()
+    if not isinstance(name, str) or not isinstance(recipe_id, int):
+        raise ValueError(f'Invalid search cursor "{cursor}"')
 
-    return count
+    return name, recipe_id
 
 
 def _get_previous_month_and_year(year, month):
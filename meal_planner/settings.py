@@ -87,6 +87,19 @@ DATABASES = {
     }
 }
 
+# Recipe search result cache
+# Each process keeps an LRU of recent search results (invalidated for all
+# processes through the catalogue version kept in the database). To also
+# share results between processes, set RECIPE_SEARCH_CACHE to the name of a
+# shared cache (e.g. Memcached or Redis) defined in CACHES.
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+RECIPE_SEARCH_CACHE = None
+RECIPE_SEARCH_LRU_SIZE = 256
+
+# Number of threads (in each process) processing uploaded cookbook cover
+# images in the background; 0 processes them during the upload request
+COOKBOOK_IMAGE_WORKERS = 2
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -121,6 +134,17 @@ MEDIA_ROOT = posixpath.join(*(BASE_DIR.split(os.path.sep) + ['media']))
 STATIC_URL = '/static/'
 STATIC_ROOT = posixpath.join(*(BASE_DIR.split(os.path.sep) + ['static']))
 
+# collectstatic stores static files with a content hash in their names and
+# precompressed copies, see home/static_storage.py
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'home.static_storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
 # For Linux, add leading /
 if 'linux' in sys.platform:
     MEDIA_ROOT = os.path.sep + MEDIA_ROOT
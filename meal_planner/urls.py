@@ -3,11 +3,12 @@ Definition of urls for meal_planner.
 """
 
 from datetime import datetime
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.contrib import admin
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib.auth.views import LoginView, LogoutView
+from cookbook import views as cookbook_views
 from home import forms, views
 
 
@@ -38,6 +39,14 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
+    # Cover images named by their content, and their renditions, are
+    # served with long lived cache headers
+    urlpatterns += [
+        re_path(r'^%s(?P<path>(?:.+/)?(?:renditions/[^/]+|[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(?:\.\w+)?))$'
+                % settings.MEDIA_URL.lstrip('/'),
+                cookbook_views.immutable_media),
+    ]
+
     urlpatterns += static(settings.MEDIA_URL,
                           document_root=settings.MEDIA_ROOT)
 
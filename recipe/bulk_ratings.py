@@ -0,0 +1,128 @@
+'''
+  Name       :  bulk_ratings.py
+  Description:  Saves many recipe ratings at once
+                e.g. after a family dinner, the ratings of several diners
+                for several recipes.
+
+  Existing ratings are found with one query; new ratings are inserted and
+  changed ratings updated in batches, all in one transaction. Bulk inserts
+  and updates do not send model signals, so the recipes' rating totals,
+  rankings, cached rating statistics and the search catalogue version are
+  updated here.
+'''
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import rating_stats, search_cache
+from .models import Diner, Recipe, RecipeRating
+
+BATCH_SIZE = 500
+
+
+def _integer(value) -> int:
+    '''
+    Return a whole number (e.g. 4, 4.0 or "4") as an integer
+
+    @raise TypeError, ValueError: if value is not a whole number (e.g. None,
+                                  True, 4.7 or "4.7")
+    '''
+    if isinstance(value, bool):
+        raise TypeError(f'{value!r} is not a number')
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f'{value!r} is not a whole number')
+    return int(value)
+
+
+def _id_value(value, name: str) -> int:
+    '''
+    Return the id of a diner or recipe as an integer
+    '''
+    try:
+        return _integer(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'Invalid {name} id "{value}"')
+
+
+def _rating_value(value) -> int:
+    '''
+    Return a rating value as an integer, checking it is a whole number within 1 to 5
+    '''
+    field = RecipeRating._meta.get_field('rating')
+    try:
+        rating = _integer(value)
+        field.run_validators(rating)
+    except (TypeError, ValueError, OverflowError, ValidationError):
+        raise ValueError(f'Invalid rating "{value}", must be a whole number between 1 and 5')
+    return rating
+
+
+def save_ratings(ratings) -> dict:
+    '''
+    Create or update ratings
+
+    @param ratings: iterable of (diner id, recipe id, rating) tuples; if a
+                    diner rates a recipe more than once, the last rating is used
+    @return: dictionary of number of ratings created, updated and unchanged
+    @raise ValueError: if a rating is not valid or a diner or recipe does not exist
+    '''
+    new_ratings = {}
+    for diner_id, recipe_id, rating in ratings:
+        key = (_id_value(recipe_id, 'recipe'), _id_value(diner_id, 'diner'))
+        new_ratings[key] = _rating_value(rating)
+
+    recipe_ids = {recipe_id for recipe_id, _ in new_ratings}
+    diner_ids = {diner_id for _, diner_id in new_ratings}
+
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+    if not new_ratings:
+        return counts
+
+    with transaction.atomic():
+        unknown_recipes = recipe_ids - set(
+            Recipe.objects.filter(id__in=recipe_ids).values_list('id', flat=True))
+        if unknown_recipes:
+            raise ValueError(f'Recipe(s) not found: {sorted(unknown_recipes)}')
+        unknown_diners = diner_ids - set(
+            Diner.objects.filter(id__in=diner_ids).values_list('id', flat=True))
+        if unknown_diners:
+            raise ValueError(f'Diner(s) not found: {sorted(unknown_diners)}')
+
+        # Find existing ratings of all recipe and diner pairs at once
+        existing = {
+            (r.recipe_id, r.diner_id): r
+            for r in RecipeRating.objects.filter(
+                recipe_id__in=recipe_ids, diner_id__in=diner_ids
+            ).only('id', 'recipe_id', 'diner_id', 'rating')
+        }
+
+        to_create = []
+        to_update = []
+        for (recipe_id, diner_id), rating in new_ratings.items():
+            current = existing.get((recipe_id, diner_id))
+            if current is None:
+                to_create.append(RecipeRating(recipe_id=recipe_id, diner_id=diner_id, rating=rating))
+            elif current.rating != rating:
+                current.rating = rating
+                to_update.append(current)
+            else:
+                counts['unchanged'] += 1
+
+        # Rating added by someone else since existing ratings were read
+        # is updated rather than failing the unique constraint
+        RecipeRating.objects.bulk_create(
+            to_create, batch_size=BATCH_SIZE, update_conflicts=True,
+            unique_fields=['recipe', 'diner'], update_fields=['rating'])
+        RecipeRating.objects.bulk_update(to_update, ['rating'], batch_size=BATCH_SIZE)
+        counts['created'] = len(to_create)
+        counts['updated'] = len(to_update)
+
+        changed_recipe_ids = {r.recipe_id for r in to_create + to_update}
+        if changed_recipe_ids:
+            Recipe.recalculate_rating_totals(changed_recipe_ids)
+            Recipe.refresh_rankings(changed_recipe_ids)
+            rating_stats.invalidate(changed_recipe_ids)
+            search_cache.bump_catalogue_version()
+            transaction.on_commit(lambda: rating_stats.invalidate(changed_recipe_ids))
+
+    return counts
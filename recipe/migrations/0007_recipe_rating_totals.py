@@ -0,0 +1,40 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:56
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_totals(apps, schema_editor):
+    # Calculate rating totals of existing recipes from their ratings
+    Recipe = apps.get_model('recipe', 'Recipe')
+    RecipeRating = apps.get_model('recipe', 'RecipeRating')
+
+    totals = RecipeRating.objects.values('recipe').annotate(
+        total=Sum('rating'), count=Count('id'))
+
+    recipes = []
+    for t in totals:
+        recipes.append(Recipe(id=t['recipe'], rating_sum=t['total'], rating_count=t['count']))
+
+    Recipe.objects.bulk_update(recipes, ['rating_sum', 'rating_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0006_alter_recipe_page_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rating_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.11 on 2026-10-19 20:00
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def remove_duplicate_ratings(apps, schema_editor):
+    # Keep only the most recent rating of a recipe by a diner
+    Recipe = apps.get_model('recipe', 'Recipe')
+    RecipeRating = apps.get_model('recipe', 'RecipeRating')
+
+    duplicates = RecipeRating.objects.values('recipe', 'diner').annotate(
+        latest_id=Max('id'), count=Count('id')).filter(count__gt=1)
+
+    recipe_ids = set()
+    for d in duplicates:
+        RecipeRating.objects.filter(
+            recipe=d['recipe'], diner=d['diner']).exclude(id=d['latest_id']).delete()
+        recipe_ids.add(d['recipe'])
+
+    # Correct rating totals of recipes that had duplicates removed
+    recipes = Recipe.objects.filter(id__in=recipe_ids).annotate(
+        actual_sum=Sum('reciperating__rating'), actual_count=Count('reciperating'))
+    for recipe in recipes:
+        recipe.rating_sum = recipe.actual_sum or 0
+        recipe.rating_count = recipe.actual_count
+    Recipe.objects.bulk_update(recipes, ['rating_sum', 'rating_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0007_recipe_rating_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_ratings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reciperating',
+            constraint=models.UniqueConstraint(fields=('recipe', 'diner'), name='unique_recipe_rating_per_diner'),
+        ),
+    ]
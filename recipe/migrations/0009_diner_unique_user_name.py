@@ -0,0 +1,69 @@
+# Generated by Django 4.2.11 on 2026-10-19 20:02
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_diners(apps, schema_editor):
+    # Diners without a user account (previous default user name) get no user name
+    Diner = apps.get_model('recipe', 'Diner')
+    Recipe = apps.get_model('recipe', 'Recipe')
+    RecipeRating = apps.get_model('recipe', 'RecipeRating')
+
+    Diner.objects.filter(user_name__in=['-nouser-', '']).update(user_name=None)
+
+    # Merge diners sharing a user name into the first one created
+    duplicates = Diner.objects.exclude(user_name=None).values('user_name').annotate(
+        first_id=Min('id'), count=Count('id')).filter(count__gt=1)
+
+    recipe_ids = set()
+    for d in duplicates:
+        other_diners = Diner.objects.filter(user_name=d['user_name']).exclude(id=d['first_id'])
+        rated_recipes = set(RecipeRating.objects.filter(
+            diner=d['first_id']).values_list('recipe', flat=True))
+
+        for rating in RecipeRating.objects.filter(diner__in=other_diners).order_by('-id'):
+            recipe_ids.add(rating.recipe_id)
+            if rating.recipe_id in rated_recipes:
+                # kept diner already rated the recipe (or a later duplicate did)
+                rating.delete()
+            else:
+                rating.diner_id = d['first_id']
+                rating.save()
+                rated_recipes.add(rating.recipe_id)
+
+        other_diners.delete()
+
+    # Correct rating totals of recipes that had ratings removed
+    recipes = Recipe.objects.filter(id__in=recipe_ids).annotate(
+        actual_sum=Sum('reciperating__rating'), actual_count=Count('reciperating'))
+    for recipe in recipes:
+        recipe.rating_sum = recipe.actual_sum or 0
+        recipe.rating_count = recipe.actual_count
+    Recipe.objects.bulk_update(recipes, ['rating_sum', 'rating_count'])
+
+
+def restore_default_user_name(apps, schema_editor):
+    Diner = apps.get_model('recipe', 'Diner')
+    Diner.objects.filter(user_name=None).update(user_name='-nouser-')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0008_reciperating_unique_diner'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='diner',
+            name='user_name',
+            field=models.CharField(blank=True, default=None, max_length=150, null=True),
+        ),
+        migrations.RunPython(merge_duplicate_diners, restore_default_user_name),
+        migrations.AlterField(
+            model_name='diner',
+            name='user_name',
+            field=models.CharField(blank=True, default=None, max_length=150, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.11 on 2026-10-19 20:03
+
+import math
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+# Ranking formula as of this migration (see recipe.models.ranking_score)
+RANKING_PRIOR_MEAN = 3.0
+RANKING_PRIOR_WEIGHT = 3
+RANKING_MADE_WEIGHT = 0.25
+
+
+def ranking_score(rating_sum, rating_count, times_made):
+    weighted_rating = (RANKING_PRIOR_MEAN * RANKING_PRIOR_WEIGHT + rating_sum) / \
+        (RANKING_PRIOR_WEIGHT + rating_count)
+    return round(weighted_rating + RANKING_MADE_WEIGHT * math.log1p(times_made), 6)
+
+
+def backfill_rankings(apps, schema_editor):
+    # Count the meals each recipe was made for and calculate its ranking score
+    Recipe = apps.get_model('recipe', 'Recipe')
+
+    recipes = list(Recipe.objects.annotate(
+        made_count=Count('meal', filter=Q(meal__was_made=True))
+    ).only('id', 'rating_sum', 'rating_count'))
+
+    for recipe in recipes:
+        recipe.times_made = recipe.made_count
+        recipe.ranking_score = ranking_score(recipe.rating_sum, recipe.rating_count, recipe.made_count)
+
+    Recipe.objects.bulk_update(recipes, ['times_made', 'ranking_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0009_diner_unique_user_name'),
+        ('meal', '0002_rename_note_meal_notes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ranking_score',
+            field=models.FloatField(db_index=True, default=3.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='times_made',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rankings, migrations.RunPython.noop),
+    ]
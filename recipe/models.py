@@ -8,8 +8,12 @@ Name: models.py
 Description: Defines the schema and behaviour for Recipe model
 '''
 
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Greatest
+import math
+import time
 
 from cookbook.models import Cookbook
 
@@ -17,6 +21,28 @@ from cookbook.models import Cookbook
 
 # Create your models here.
 
+# Ranking of recipes: average rating weighted towards RANKING_PRIOR_MEAN as if each
+# recipe had RANKING_PRIOR_WEIGHT extra ratings of that value (so a single 5 star
+# rating does not top the list), plus a bonus for the number of times it was made
+RANKING_PRIOR_MEAN = 3.0
+RANKING_PRIOR_WEIGHT = 3
+RANKING_MADE_WEIGHT = 0.25
+
+
+def ranking_score(rating_sum: int, rating_count: int, times_made: int) -> float:
+    '''
+    Calculate the ranking score of a recipe
+
+    @param rating_sum: total of the recipe's ratings
+    @param rating_count: number of ratings
+    @param times_made: number of meals where the recipe was made
+    @return: score, higher is better
+    '''
+    weighted_rating = (RANKING_PRIOR_MEAN * RANKING_PRIOR_WEIGHT + rating_sum) / \
+        (RANKING_PRIOR_WEIGHT + rating_count)
+    return round(weighted_rating + RANKING_MADE_WEIGHT * math.log1p(times_made), 6)
+
+
 class RecipeType(models.Model):
     '''
     Defines the RecipeType schema
@@ -56,23 +82,95 @@ class Recipe(models.Model):
     page_number = models.PositiveSmallIntegerField(blank=True, null=True)
     notes = models.CharField(max_length=750, blank=True)
     recipe_types = models.ManyToManyField(RecipeType)
+    # Totals of the recipe's ratings, kept up to date as RecipeRatings are
+    # written (see signals.py) so a rating can be shown without a query
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    # Number of meals the recipe was made for and ranking score (see
+    # ranking_score), refreshed as ratings and meals are written
+    times_made = models.PositiveIntegerField(default=0, editable=False)
+    ranking_score = models.FloatField(default=ranking_score(0, 0, 0), db_index=True, editable=False)
 
     @property
     def rating(self) -> float:
         '''
         Calculate a recipe rating
         '''
-        recipe = Recipe.objects.get(id=self.id)  # type: ignore
-        all_ratings = recipe.reciperating_set.all()  # type: ignore
+        if self.rating_count == 0:
+            return 0
 
-        # Calculate average rating
-        sum_rating = 0
-        for rating in all_ratings:
-            sum_rating += rating.rating
+        return round(self.rating_sum / self.rating_count, 2)
 
-        average_rating = 0 if all_ratings.count() == 0 else round(sum_rating / all_ratings.count(), 2)
 
-        return average_rating
+    @classmethod
+    def adjust_rating_totals(cls, recipe_id: int, rating_delta: int, count_delta: int):
+        '''
+        Add to the rating totals of a recipe (in the database, not this instance)
+
+        @param recipe_id: id of recipe to update
+        @param rating_delta: change to the sum of ratings
+        @param count_delta: change to the number of ratings
+        '''
+        cls.objects.filter(pk=recipe_id).update(
+            rating_sum=F('rating_sum') + rating_delta,
+            rating_count=F('rating_count') + count_delta)
+
+
+    @classmethod
+    def recalculate_rating_totals(cls, recipe_ids=None) -> int:
+        '''
+        Recalculate rating totals from the recipes' RecipeRatings
+
+        @param recipe_ids: ids of recipes to update (None for all recipes)
+        @return: number of recipes whose totals were wrong
+        '''
+        recipes = cls.objects.all()
+        if recipe_ids is not None:
+            recipes = recipes.filter(pk__in=recipe_ids)
+
+        recipes = recipes.annotate(
+            actual_sum=Sum('reciperating__rating'),
+            actual_count=Count('reciperating'))
+
+        fixed = []
+        for recipe in recipes.only('id', 'rating_sum', 'rating_count'):
+            actual_sum = recipe.actual_sum or 0
+            if recipe.rating_sum != actual_sum or recipe.rating_count != recipe.actual_count:
+                recipe.rating_sum = actual_sum
+                recipe.rating_count = recipe.actual_count
+                fixed.append(recipe)
+
+        cls.objects.bulk_update(fixed, ['rating_sum', 'rating_count'], batch_size=500)
+        return len(fixed)
+
+
+    @classmethod
+    def refresh_rankings(cls, recipe_ids=None, count_meals: bool=False) -> int:
+        '''
+        Recalculate ranking scores of recipes from their rating totals
+
+        @param recipe_ids: ids of recipes to update (None for all recipes)
+        @param count_meals: True to also recount the times each recipe was made
+        @return: number of recipes whose ranking changed
+        '''
+        recipes = cls.objects.all()
+        if recipe_ids is not None:
+            recipes = recipes.filter(pk__in=recipe_ids)
+        recipes = recipes.only('id', 'rating_sum', 'rating_count', 'times_made', 'ranking_score')
+        if count_meals:
+            recipes = recipes.annotate(made_count=Count('meal', filter=Q(meal__was_made=True)))
+
+        changed = []
+        for recipe in recipes:
+            times_made = recipe.made_count if count_meals else recipe.times_made
+            score = ranking_score(recipe.rating_sum, recipe.rating_count, times_made)
+            if recipe.times_made != times_made or recipe.ranking_score != score:
+                recipe.times_made = times_made
+                recipe.ranking_score = score
+                changed.append(recipe)
+
+        cls.objects.bulk_update(changed, ['times_made', 'ranking_score'], batch_size=500)
+        return len(changed)
 
 
     @property
@@ -97,7 +195,9 @@ class Diner(models.Model):
     '''
     first_name = models.CharField(max_length=25)
     last_name = models.CharField(max_length=25)
-    user_name = models.CharField(max_length=25, default='-nouser-')  # store username used for authentication
+    # username used for authentication (as long as Django's username); null for
+    # diners without a user account, so it can be unique for those with one
+    user_name = models.CharField(max_length=150, unique=True, null=True, blank=True, default=None)
 
 
     def last_name_first(self):
@@ -127,3 +227,86 @@ class RecipeRating(models.Model):
     )
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
     diner = models.ForeignKey(Diner, on_delete=models.CASCADE)
+
+
+    class Meta:
+        '''
+        Metadata of the RecipeRating
+        '''
+        # A diner rates a recipe only once
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'diner'], name='unique_recipe_rating_per_diner'),
+        ]
+
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so the recipe's rating totals can be
+        # adjusted when this rating is changed
+        loaded = dict(zip(field_names, values))
+        if 'recipe_id' in loaded and 'rating' in loaded:
+            instance._stored_rating = (loaded['recipe_id'], loaded['rating'])
+        return instance
+
+
+    def save(self, *args, **kwargs):
+        # Save the rating and update recipe's rating totals together
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+    def delete(self, *args, **kwargs):
+        # Delete the rating and update recipe's rating totals together
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
+
+
+class CacheVersion(models.Model):
+    '''
+    Version of cached data, shared by all processes
+
+    Cached entries are stored under the version of the data they were made
+    from (e.g. search results under the recipe catalogue version, see
+    search_cache.py); a change moves the data to a new version. As the
+    version is written in the same transaction as the change, other
+    processes see the new version once the change is committed.
+    '''
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField()
+
+
+    @classmethod
+    def current(cls, name: str) -> int:
+        '''
+        Return the current version of the named data (0 if never changed)
+        '''
+        version = cls.objects.filter(name=name).values_list('version', flat=True).first()
+        return 0 if version is None else version
+
+
+    @classmethod
+    def current_many(cls, names) -> dict:
+        '''
+        Return the current versions of named data, by name, with one query
+        (see current)
+        '''
+        versions = dict(cls.objects.filter(name__in=names).values_list('name', 'version'))
+        return {name: versions.get(name, 0) for name in names}
+
+
+    @classmethod
+    def bump(cls, *names: str):
+        '''
+        Move the named data to a new version
+        '''
+        # Move to at least the current time, so a version rolled back with
+        # its transaction is never used again
+        now = time.time_ns()
+        updated = cls.objects.filter(name__in=names).update(version=Greatest(F('version') + 1, Value(now)))
+        if updated < len(set(names)):
+            cls.objects.bulk_create([cls(name=name, version=now) for name in set(names)], ignore_conflicts=True)
+
+
+    def __str__(self):
+        return f'{self.name} {self.version}'
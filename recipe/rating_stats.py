@@ -0,0 +1,135 @@
+'''
+  Name       :  rating_stats.py
+  Description:  Rating statistics of recipes
+                For each recipe: the number of ratings of each value
+                (histogram), the number of ratings, their mean and the
+                rating given by each diner.
+
+  Statistics for any number of recipes are calculated with one grouped query
+  and cached per recipe. Each recipe's cache key includes its version kept
+  in the database (CacheVersion, read for all recipes with one query),
+  bumped when the recipe's ratings (or the diners who rated it) change, see
+  signals.py; so a change made by any process replaces the statistics of
+  that recipe cached by every process, and only of that recipe.
+'''
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import CacheVersion, RecipeRating
+
+RATING_VALUES = range(1, 6)
+
+STATS_KEY_PREFIX = 'recipe_rating_stats'
+
+
+def _version_name(recipe_id: int) -> str:
+    # name of the recipe's statistics version (CacheVersion)
+    return f'{STATS_KEY_PREFIX}:{recipe_id}'
+
+
+def _stats_key(version: int, recipe_id: int) -> str:
+    return f'{STATS_KEY_PREFIX}:{recipe_id}:{version}'
+
+
+def _empty_statistics(recipe_id: int) -> dict:
+    return {
+        'recipe_id': recipe_id,
+        'histogram': {value: 0 for value in RATING_VALUES},
+        'count': 0,
+        'mean': 0,
+        'diners': [],
+    }
+
+
+def calculate_statistics(recipe_ids) -> dict:
+    '''
+    Calculate rating statistics from the database (not cached)
+
+    @param recipe_ids: ids of recipes
+    @return: dictionary of recipe id to statistics (see rating_statistics)
+    '''
+    statistics = {recipe_id: _empty_statistics(recipe_id) for recipe_id in recipe_ids}
+
+    rating_groups = RecipeRating.objects.filter(
+        recipe_id__in=statistics.keys()
+    ).values(
+        'recipe_id', 'rating', 'diner_id', 'diner__first_name',
+        'diner__last_name', 'diner__user_name'
+    ).annotate(
+        count=Count('id')
+    ).order_by('recipe_id', 'diner__last_name', 'diner__first_name', 'diner_id')
+
+    totals = {recipe_id: 0 for recipe_id in statistics}
+    for group in rating_groups:
+        recipe_stats = statistics[group['recipe_id']]
+        recipe_stats['histogram'][group['rating']] = \
+            recipe_stats['histogram'].get(group['rating'], 0) + group['count']
+        recipe_stats['count'] += group['count']
+        totals[group['recipe_id']] += group['rating'] * group['count']
+
+        for _ in range(group['count']):
+            recipe_stats['diners'].append({
+                'diner_id': group['diner_id'],
+                'diner': f"{group['diner__first_name']} {group['diner__last_name']}",
+                'user_name': group['diner__user_name'],
+                'rating': group['rating'],
+            })
+
+    for recipe_id, recipe_stats in statistics.items():
+        if recipe_stats['count'] > 0:
+            recipe_stats['mean'] = round(totals[recipe_id] / recipe_stats['count'], 2)
+
+    return statistics
+
+
+def rating_statistics(recipe_ids) -> dict:
+    '''
+    Return rating statistics of recipes
+
+    Statistics of each recipe is a dictionary with:
+        recipe_id: id of the recipe
+        histogram: dictionary of rating value (1-5) to number of ratings
+        count: number of ratings
+        mean: average rating (0 if not rated)
+        diners: list of ratings by diner (diner_id, diner, user_name, rating),
+                ordered by diner's last name
+
+    @param recipe_ids: ids of recipes
+    @return: dictionary of recipe id to statistics
+    '''
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    versions = CacheVersion.current_many([_version_name(r) for r in recipe_ids])
+    keys = {recipe_id: _stats_key(versions[_version_name(recipe_id)], recipe_id) for recipe_id in recipe_ids}
+    cached = cache.get_many(list(keys.values()))
+
+    statistics = {}
+    missing = []
+    for recipe_id in recipe_ids:
+        recipe_stats = cached.get(keys[recipe_id])
+        if recipe_stats is None:
+            missing.append(recipe_id)
+        else:
+            statistics[recipe_id] = recipe_stats
+
+    if missing:
+        calculated = calculate_statistics(missing)
+        cache.set_many({keys[r]: s for r, s in calculated.items()})
+        statistics.update(calculated)
+
+    return statistics
+
+
+def recipe_statistics(recipe_id: int) -> dict:
+    '''
+    Return rating statistics of one recipe (see rating_statistics)
+    '''
+    return rating_statistics([recipe_id])[recipe_id]
+
+
+def invalidate(recipe_ids):
+    '''
+    Replace cached rating statistics of recipes (in every process)
+    '''
+    if recipe_ids:
+        CacheVersion.bump(*[_version_name(r) for r in recipe_ids])
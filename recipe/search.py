@@ -28,14 +28,21 @@
     Recipe:
         -Name
         -Recipe Tags
-        
+
   Note: only one of BEFORE, AFTER or OLDER can be specified
   (first come, first served), subsequent time slicing will
   be ignored.
+
+  A search string is parsed once into an immutable SearchQuery (see
+  parse_search). Parsed queries are cached by search string and shared
+  by the database filter (search_filter) and the search result cache.
 '''
 
-import copy
+import calendar
 import datetime
+import functools
+import re
+from typing import NamedTuple, Optional
 
 from django.db.models import Q
 
@@ -55,11 +62,213 @@ TIME_KEYWORD_TOKENS = [
     'OLDER:',
 ]
 
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%d-%b-%Y')
 
-class Search:
+# Time period for OLDER: keyword e.g. 3M (months), 2W (weeks), 10D (days)
+TIME_PERIOD_PATTERN = re.compile(r'^(\d+)([MWD])$')
+
+# Number of parsed search strings kept in memory
+PARSE_CACHE_SIZE = 512
+
+
+class SearchSyntaxError(ValueError):
     '''
-    Class that manages searching for recipes
+    Raised when a search string can not be parsed
+    '''
+
+
+class TimeFilter(NamedTuple):
+    '''
+    Time keyword of a search and its value: either a date or a time period
+    (amount, unit) counted back from the day the search is run
+    '''
+    keyword: str
+    date: Optional[datetime.date] = None
+    period: Optional[tuple] = None
+
+    def resolve(self, today: Optional[datetime.date]=None) -> datetime.date:
+        '''
+        Return the date to filter on, resolving a time period relative to today
+        '''
+        if self.period is None:
+            return self.date  # type: ignore
+
+        today = datetime.date.today() if today is None else today
+        amount, unit = self.period
+        if unit == 'D':
+            return today - datetime.timedelta(days=amount)
+        if unit == 'W':
+            return today - datetime.timedelta(weeks=amount)
+
+        # Months: same day of month, limited to the length of the target month
+        months = today.year * 12 + today.month - 1 - amount
+        year, month = divmod(months, 12)
+        day = min(today.day, calendar.monthrange(year, month + 1)[1])
+        return datetime.date(year, month + 1, day)
+
+
+class SearchQuery(NamedTuple):
+    '''
+    Parsed search string
+    '''
+    tokens: tuple           # all tokens (upper case) in order
+    keywords: tuple         # (keyword, (values, ...)) in order of first use
+    time_filter: Optional[TimeFilter]
+    free_tokens: tuple      # tokens not associated with a keyword, in order
+
+    def keyword_values(self, keyword: str) -> tuple:
+        '''
+        Return search values for a keyword (empty if keyword not used)
+        '''
+        for k, values in self.keywords:
+            if k == keyword:
+                return values
+        return ()
+
+    def canonical_form(self, today: Optional[datetime.date]=None) -> tuple:
+        '''
+        Return the query in a canonical form: equivalent searches (same
+        keywords, values and free tokens in any order or case) return the
+        same value. Time periods are resolved to dates.
+        '''
+        keywords = tuple(sorted(
+            (k, tuple(sorted(values))) for k, values in self.keywords))
+        time_filter = None
+        if self.time_filter is not None:
+            time_filter = (self.time_filter.keyword,
+                           self.time_filter.resolve(today).isoformat())
+        free_tokens = tuple(sorted(set(self.free_tokens)))
+
+        return (keywords, time_filter, free_tokens)
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_search(search_string: str) -> SearchQuery:
+    '''
+    Parse a search string
+
+    A keyword takes the following token as its value(s); values are comma
+    separated (no spaces!). A keyword not followed by a value (end of search
+    or another keyword) is ignored. Repeated keywords combine their values.
+
+    @param search_string: search string entered by the user
+    @return: parsed query; the same object is returned for the same string
+    @raise SearchSyntaxError: if a time keyword has an invalid date
+    '''
+    tokens = tuple(t.upper() for t in search_string.split())
+
+    keywords = {}
+    time_filter = None
+    free_tokens = []
+
+    idx = 0
+    while idx < len(tokens):
+        token = tokens[idx]
+        if token not in KEYWORD_TOKENS and token not in TIME_KEYWORD_TOKENS:
+            free_tokens.append(token)
+            idx += 1
+            continue
+
+        # keyword: next token holds the search value(s)
+        next_token = tokens[idx + 1] if idx + 1 < len(tokens) else None
+        if next_token is None or next_token in KEYWORD_TOKENS or next_token in TIME_KEYWORD_TOKENS:
+            idx += 1
+            continue
+
+        if token in KEYWORD_TOKENS:
+            values = keywords.setdefault(token, [])
+            for value in next_token.split(','):
+                if value and value not in values:
+                    values.append(value)
+        elif time_filter is None:
+            # only the first time keyword is used (later ones are not parsed)
+            time_filter = _parse_time_filter(token, next_token)
+        idx += 2
+
+    return SearchQuery(
+        tokens=tokens,
+        keywords=tuple((k, tuple(v)) for k, v in keywords.items() if v),
+        time_filter=time_filter,
+        free_tokens=tuple(free_tokens))
+
+
+def search_filter(query: SearchQuery) -> Optional[Q]:
+    '''
+    Build the database filter for a parsed query
+
+    Search values for a keyword only search that keyword's property; free
+    tokens search all of them. All conditions are OR'ed. A time keyword then
+    limits the recipes found to those with meals in its time slice:
+        BEFORE: a meal scheduled before the date
+        AFTER:  a meal scheduled after the date
+        OLDER:  meals, all scheduled before the date (not had since)
+
+    @param query: parsed search
+    @return: filter for Recipe objects (None if nothing to search for)
+    '''
+    keyword_searches = {key: list(query.keyword_values(key)) for key in KEYWORD_TOKENS}
+    for key in keyword_searches:
+        keyword_searches[key] += [t for t in query.free_tokens if t not in keyword_searches[key]]
+
+    recipe_filter = None
+    for keyword, values in keyword_searches.items():
+        for value in values:
+            if keyword == "TYPE:":
+                value_filter = Q(recipe_types__name__iexact=value)
+            elif keyword == "COOKBOOK:":
+                value_filter = Q(cook_book__title__icontains=value)
+            elif keyword == "AUTHOR:":
+                value_filter = Q(cook_book__author__first_name__icontains=value) | \
+                    Q(cook_book__author__last_name__icontains=value)
+            else:  # "RECIPE:"
+                value_filter = Q(name__icontains=value)
+
+            if recipe_filter is None:
+                recipe_filter = value_filter
+            else:
+                recipe_filter |= value_filter
+
+    if query.time_filter is not None:
+        time_filter = _meal_date_filter(query.time_filter)
+        recipe_filter = time_filter if recipe_filter is None else recipe_filter & time_filter
+
+    return recipe_filter
+
+
+def _meal_date_filter(time_filter: TimeFilter) -> Q:
     '''
+    Build the filter for recipes with meals in a time keyword's time slice
+    '''
+    date = time_filter.resolve()
+    if time_filter.keyword == 'BEFORE:':
+        return Q(meal__scheduled_date__lt=date)
+    if time_filter.keyword == 'AFTER:':
+        return Q(meal__scheduled_date__gt=date)
+    # "OLDER:"
+    had_since = Recipe.objects.filter(meal__scheduled_date__gte=date).values('id')
+    return Q(meal__scheduled_date__lt=date) & ~Q(id__in=had_since)
+
+
+def _parse_time_filter(keyword: str, value: str) -> TimeFilter:
+    '''
+    Parse the value of a time keyword
+    '''
+    if keyword == 'OLDER:':
+        period = TIME_PERIOD_PATTERN.match(value)
+        if period is not None:
+            return TimeFilter(keyword, period=(int(period.group(1)), period.group(2)))
+
+    for fmt in DATE_FORMATS:
+        try:
+            date = datetime.datetime.strptime(value, fmt).date()
+            return TimeFilter(keyword, date=date)
+        except ValueError:
+            pass
+
+    raise SearchSyntaxError(f'Invalid date format "{value}" for {keyword}')
+
+
+class Search:
     '''
     Class that manages searching for recipes
     '''
@@ -69,32 +278,28 @@ class Search:
         # Tokens: elements used for searching, separated by spaces in search_string
         # Keyword tokens: special tokens used to focus search on specific properties
 
-        self._tokens = search_string.split(' ')
-        self._keywords = dict.fromkeys(
-            [k.upper() for k in self._tokens if k.upper() in KEYWORD_TOKENS])
-        self._time_keywords = dict.fromkeys(
-            [k.upper() for k in self._tokens if k.upper() in TIME_KEYWORD_TOKENS])
-        self._freetokens = self._parse_keywords(self.tokens)
+        self._query = parse_search(search_string)
 
     @property
-    def tokens(self):
+    def query(self) -> SearchQuery:
         '''
-        Return list of search tokens
+        Return the parsed search
         '''
+        return self._query
+
+    @property
+    def tokens(self):
         '''
         Return list of search tokens
         '''
-        return [t.upper() for t in self._tokens]
+        return list(self._query.tokens)
 
     @property
     def free_tokens(self):
         '''
         Return list of free search tokens
         '''
-        '''
-        Return list of free search tokens
-        '''
-        return [t.upper() for t in self._freetokens]
+        return list(self._query.free_tokens)
 
     @property
     def keywords(self):
@@ -102,7 +307,7 @@ class Search:
         Return list of keyword tokens used in this search
         '''
 
-        return list(self._keywords.keys())
+        return [k for k, _ in self._query.keywords]
 
     @property
     def time_keywords(self):
@@ -110,7 +315,8 @@ class Search:
         Return list of keyword tokens used for time searching
         '''
 
-        return list(self._time_keywords.keys())
+        time_filter = self._query.time_filter
+        return [] if time_filter is None else [time_filter.keyword]
 
     @property
     def all_keywords(self):
@@ -118,7 +324,16 @@ class Search:
         Return list of keyword tokens and time keycodes used in this search
         '''
 
-        return list(self._keywords.keys()) + list(self._time_keywords.keys())
+        return self.keywords + self.time_keywords
+
+    @property
+    def canonical_form(self):
+        '''
+        Return the search in a canonical form: equivalent searches (same
+        keywords, values and free tokens in any order or case) return the same value
+        '''
+
+        return self._query.canonical_form()
 
 
     def keyword_search_values(self, keyword):
@@ -129,21 +344,22 @@ class Search:
         @return: search value as either a list or datetime
         '''
 
-        all_keywords = {**self._keywords, **self._time_keywords}
+        if keyword in TIME_KEYWORD_TOKENS:
+            return self.time_filter_date(keyword)
 
-        return all_keywords[keyword]
+        return list(self._query.keyword_values(keyword))
 
 
     def time_filter_date(self, keyword):
         '''
-        Return list of time filtering keywords
-        '''
-        '''
-        Return list of time filtering keywords
+        Return the date used by a time filtering keyword
         '''
 
-        return self._time_keywords[keyword]
+        time_filter = self._query.time_filter
+        if time_filter is None or time_filter.keyword != keyword:
+            raise KeyError(keyword)
 
+        return time_filter.resolve()
 
 
     def find(self):
@@ -151,127 +367,9 @@ class Search:
         Execute the query based on the tokens provided
         '''
 
-        # Build query
-        # For Recipe Types
-
-        # Build query strings of search values
-        # - a search value is a token that is NOT a keyword
-        # - search values (tokens) that are associated with a keyword are only used to search
-        #   for that keyword's associated table
-        # - free tokens are assigned to all keywords
-
-        # Create dictionaries for search values for all keywords with
-        # initial value of an empty list
-        keyword_searches = {key: [] for key in KEYWORD_TOKENS} 
-
-        # Go through all tokens
-        for token in self.tokens:
-            # if token is a keyword, then extract the search values
-            if token in self.keywords:
-                search_values = self.keyword_search_values(token)
-                keyword_searches[token] = search_values  # type: ignore
-
-            # Else if token is a free token, add it to all keyword searches
-            else:
-                if token in self.free_tokens:
-                    for key in keyword_searches:
-                        keyword_searches[key].append(token)
-        # [end] for token
-
-        # Build queries and search for matches, based on
-        # contents of keyword_searches dictionary
-
-        #TODO: Would it be better to initialize as an empty Django result set?
-        #TODO: Would it be better to initialize as an empty Django result set?
-        recipe_result = None
-
-        for keyword in keyword_searches:
-            for value in keyword_searches[keyword]:
-                if keyword == "TYPE:":
-                    recipe_qs = Recipe.objects.filter(
-                        recipe_types__name__iexact=value)
-                elif keyword == "COOKBOOK:":
-                    recipe_qs = Recipe.objects.filter(
-                        cook_book__title__icontains=value)
-                elif keyword == "AUTHOR:":
-                    recipe_qs = Recipe.objects.filter(
-                        Q(cook_book__author__first_name__icontains=value) | Q(cook_book__author__last_name__icontains=value))
-                elif keyword == "RECIPE:":
-                    recipe_qs = Recipe.objects.filter(
-                        name__icontains=value)
-                else:
-                    # create empty query set by default
-                    recipe_qs = Recipe.objects.none
-                # [end] if keyword
-
-                # Combine individual recipe type querysets into one big queryset
-                if recipe_result is None:
-                    recipe_result = recipe_qs
-                else:
-                    recipe_result = recipe_result.union(recipe_qs)
-                # [end] if recipe_result
-            # [end] for value
-        # [end] for keyword            
-
-        # Last search is to filter all results by the time filters
-        for keyword in self.time_keywords:
-            time_search_values = self.keyword_search_values(keyword)
-
-            # TODO: implement time filters
-
-        # Get recipe related information
-        return recipe_result
-
-
-
-    def _parse_keywords(self, tokens):
-        '''
-        Locate keywords in token list and get search values for token (if any!)
-
-        @param tokens: list of tokens to parse for searching
-        '''
+        recipe_filter = search_filter(self._query)
+        if recipe_filter is None:
+            return None
 
-        # Keep list of tokens that have NOT been processed.
-        # Those that are left over are "free" tokens and will
-        # be used to search against ALL criteria.
-        tokens_not_processed = copy.deepcopy(tokens)
-
-        for k in self.all_keywords:
-            token_idx = tokens.index(k)
-            tokens_not_processed.remove(k)
-
-            # if search token not at end of list, grab next token of search values
-            # keyword can have muliple search values, if comma separated (no spaces!)
-            if token_idx < len(tokens):
-                next_token = tokens[token_idx + 1]
-
-                # Make sure the next token is not a keyword
-                # if it is, then current keyword is invalid and will be ignored
-
-                if not next_token.upper() in self.keywords:
-
-                    # only split by , if current keyword is not a time keyword
-                    if k not in self._time_keywords:
-                        # Split search values by comma and add values for
-                        # keyword to class property
-                        self._keywords[k] = next_token.split(',')
-                    else:
-                        date = self._parse_date(next_token)
-                        # if date is invalid, raise error
-                        if date is None:
-                            raise Exception("Invalid date format")
-                        self._time_keywords[k] = date
-
-                    tokens_not_processed.remove(next_token)
-
-        return tokens_not_processed
-
-
-    def _parse_date(self, date_string):
-        for fmt in ('%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%d-%b-%Y'):
-            try:
-                date = datetime.datetime.strptime(date_string, fmt).date()
-                return date
-            except ValueError:
-                pass
-        return None
+        # joins through recipe tags can repeat a recipe, so remove duplicates
+        return Recipe.objects.filter(recipe_filter).distinct()
@@ -0,0 +1,142 @@
+'''
+  Name       :  search_cache.py
+  Description:  Caches recipe search results
+                Results are stored under a canonical form of the parsed search
+                so that equivalent searches (e.g. "chicken pasta" and
+                "PASTA chicken") share one entry.
+
+  Entries are tagged with a catalogue version. The version is bumped whenever
+  a model that contributes to search results is written (see signals.py), so
+  stale entries are never returned and simply age out of the cache. The
+  version is kept in the database (CacheVersion), so a change made by any
+  process (other web server workers, management commands) is seen by all.
+
+  Two tiers are used:
+    - a small per-process LRU, checked first
+    - an optional shared Django cache (settings.RECIPE_SEARCH_CACHE names an
+      entry in CACHES), so all workers share results
+'''
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import CacheVersion
+
+CATALOGUE_VERSION_KEY = 'recipe_catalogue_version'
+SEARCH_KEY_PREFIX = 'recipe_search'
+
+# Default number of search results kept by each process
+DEFAULT_LRU_SIZE = 256
+
+
+class _LRUCache:
+    '''
+    Small thread safe least-recently-used cache
+    '''
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Return value for key (None if not cached) and mark it as recently used
+        '''
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        '''
+        Add value for key, discarding the least recently used entry if full
+        '''
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        Remove all entries
+        '''
+        with self._lock:
+            self._entries.clear()
+
+
+_local_results = _LRUCache(getattr(settings, 'RECIPE_SEARCH_LRU_SIZE', DEFAULT_LRU_SIZE))
+
+
+def _shared_cache():
+    '''
+    Return the shared Django cache for search results (None if not configured)
+    '''
+    cache_name = getattr(settings, 'RECIPE_SEARCH_CACHE', None)
+    return None if cache_name is None else caches[cache_name]
+
+
+def catalogue_version() -> int:
+    '''
+    Return the current catalogue version
+    '''
+    return CacheVersion.current(CATALOGUE_VERSION_KEY)
+
+
+def bump_catalogue_version():
+    '''
+    Invalidate all cached search results by moving to a new catalogue version
+
+    Called within the transaction making the change, so other processes
+    move to the new version once the change is committed.
+    '''
+    CacheVersion.bump(CATALOGUE_VERSION_KEY)
+
+
+def cache_key(search, *extra) -> str:
+    '''
+    Return the cache key for a search at the current catalogue version
+
+    @param search: Search object
+    @param extra: other values that change the results (e.g. page cursor and size)
+    '''
+    canonical = repr((search.canonical_form, extra))
+    digest = hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+    return f'{SEARCH_KEY_PREFIX}:{catalogue_version()}:{digest}'
+
+
+def get_results(key):
+    '''
+    Return cached results for a cache key (None if not cached)
+    '''
+    results = _local_results.get(key)
+    if results is None:
+        shared = _shared_cache()
+        if shared is not None:
+            results = shared.get(key)
+            if results is not None:
+                _local_results.set(key, results)
+    return results
+
+
+def set_results(key, results):
+    '''
+    Cache results under a cache key
+    '''
+    _local_results.set(key, results)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.set(key, results)
+
+
+def clear():
+    '''
+    Discard all search results cached by this process
+    '''
+    _local_results.clear()
@@ -0,0 +1,155 @@
+'''
+Name: signals.py
+Description: Signal handlers for the Recipe app
+'''
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from . import rating_stats, search_cache, typeahead
+from .models import Diner, Recipe, RecipeRating
+
+# Models whose changes can alter recipe search results
+CATALOGUE_MODELS = [
+    'recipe.Recipe',
+    'recipe.RecipeType',
+    'recipe.RecipeRating',
+    'cookbook.Cookbook',
+    'cookbook.Author',
+    'meal.Meal',
+]
+
+# Models whose changes can alter recipe suggestions (typeahead index)
+TYPEAHEAD_MODELS = [
+    'recipe.Recipe',
+    'recipe.RecipeType',
+    'cookbook.Cookbook',
+]
+
+
+def catalogue_changed(sender, **kwargs):
+    '''
+    Invalidate cached search results when the recipe catalogue changes
+    '''
+    # The new version is committed with the change
+    search_cache.bump_catalogue_version()
+
+
+def typeahead_changed(sender, **kwargs):
+    '''
+    Rebuild the typeahead index when recipe names, tags or cookbooks change
+    '''
+    typeahead.bump_index_version()
+
+
+def rating_saved(sender, instance, created, raw, **kwargs):
+    '''
+    Update the recipe's rating totals for a new or changed rating
+    '''
+    if raw:
+        # loading fixtures: recipe totals are loaded with the recipe
+        return
+
+    stored = getattr(instance, '_stored_rating', None)
+    current = (instance.recipe_id, instance.rating)
+
+    if created:
+        Recipe.adjust_rating_totals(instance.recipe_id, instance.rating, 1)
+    elif stored is None:
+        # previous values are not known, so recalculate from the ratings
+        Recipe.recalculate_rating_totals([instance.recipe_id])
+    elif stored != current:
+        stored_recipe_id, stored_rating = stored
+        Recipe.adjust_rating_totals(stored_recipe_id, -stored_rating, -1)
+        Recipe.adjust_rating_totals(instance.recipe_id, instance.rating, 1)
+
+    changed_recipe_ids = {instance.recipe_id}
+    if stored is not None:
+        changed_recipe_ids.add(stored[0])
+    Recipe.refresh_rankings(changed_recipe_ids)
+    _invalidate_rating_stats(changed_recipe_ids)
+
+    instance._stored_rating = current
+
+
+def rating_deleted(sender, instance, **kwargs):
+    '''
+    Remove a deleted rating from its recipe's rating totals
+    '''
+    recipe_id, rating = getattr(instance, '_stored_rating', (instance.recipe_id, instance.rating))
+    Recipe.adjust_rating_totals(recipe_id, -rating, -1)
+    Recipe.refresh_rankings([recipe_id])
+    _invalidate_rating_stats([recipe_id])
+
+
+def meal_saved(sender, instance, raw, **kwargs):
+    '''
+    Recount the times the meal's recipe was made and refresh its ranking
+    '''
+    if raw:
+        return
+
+    recipe_ids = {instance.recipe_id}
+    stored_recipe_id = getattr(instance, '_stored_recipe_id', None)
+    if stored_recipe_id is not None:
+        recipe_ids.add(stored_recipe_id)
+    Recipe.refresh_rankings(recipe_ids, count_meals=True)
+
+    instance._stored_recipe_id = instance.recipe_id
+
+
+def meal_deleted(sender, instance, **kwargs):
+    '''
+    Recount the times the deleted meal's recipe was made and refresh its ranking
+    '''
+    recipe_id = getattr(instance, '_stored_recipe_id', instance.recipe_id)
+    Recipe.refresh_rankings([recipe_id], count_meals=True)
+
+
+def diner_saved(sender, instance, raw, **kwargs):
+    '''
+    Remove cached rating statistics showing the diner's name
+    '''
+    if raw:
+        return
+
+    rated_recipe_ids = RecipeRating.objects.filter(diner=instance).values_list('recipe_id', flat=True)
+    _invalidate_rating_stats(list(rated_recipe_ids))
+
+
+def _invalidate_rating_stats(recipe_ids):
+    '''
+    Replace cached rating statistics of recipes, now and once committed
+    (in case they were cached from the old ratings in the meantime)
+    '''
+    recipe_ids = list(recipe_ids)
+    rating_stats.invalidate(recipe_ids)
+    transaction.on_commit(lambda: rating_stats.invalidate(recipe_ids))
+
+
+def connect_signals():
+    '''
+    Connect signal handlers; called when the Recipe app is ready
+    '''
+    for model in CATALOGUE_MODELS:
+        post_save.connect(catalogue_changed, sender=model,
+                          dispatch_uid=f'catalogue_changed_save_{model}')
+        post_delete.connect(catalogue_changed, sender=model,
+                            dispatch_uid=f'catalogue_changed_delete_{model}')
+
+    for model in TYPEAHEAD_MODELS:
+        post_save.connect(typeahead_changed, sender=model,
+                          dispatch_uid=f'typeahead_changed_save_{model}')
+        post_delete.connect(typeahead_changed, sender=model,
+                            dispatch_uid=f'typeahead_changed_delete_{model}')
+
+    post_save.connect(rating_saved, sender=RecipeRating, dispatch_uid='rating_saved')
+    post_delete.connect(rating_deleted, sender=RecipeRating, dispatch_uid='rating_deleted')
+    post_save.connect(diner_saved, sender=Diner, dispatch_uid='diner_saved')
+    post_save.connect(meal_saved, sender='meal.Meal', dispatch_uid='meal_saved')
+    post_delete.connect(meal_deleted, sender='meal.Meal', dispatch_uid='meal_deleted')
+
+    m2m_changed.connect(catalogue_changed, sender=Recipe.recipe_types.through,
+                        dispatch_uid='catalogue_changed_recipe_types')
+    m2m_changed.connect(typeahead_changed, sender=Recipe.recipe_types.through,
+                        dispatch_uid='typeahead_changed_recipe_types')
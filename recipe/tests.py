@@ -1,3 +1,649 @@
-from django.test import TestCase
+import datetime
+import json
+import random
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache, caches
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from cookbook.models import Author, Cookbook
+from home.pagination import PAGE_SIZE
+from meal.models import Meal
+
+from . import rating_stats, search_cache, typeahead, views
+from .bulk_ratings import save_ratings
+from .models import CacheVersion, Diner, Recipe, RecipeRating, RecipeType, ranking_score
+from .search import (KEYWORD_TOKENS, TIME_KEYWORD_TOKENS, Search, SearchSyntaxError, TimeFilter,
+                     parse_search)
+from .typeahead import PrefixIndex
+from .views import SESSION_DINER_KEY, forget_request_diner, get_request_diner, get_user_diner
+
+
+class SearchParserTest(SimpleTestCase):
+    """Tests for parsing of search strings."""
+
+    def test_keywords_and_free_tokens(self):
+        """
+        Tests that keyword values are split on commas and other tokens are free.
+        """
+        query = parse_search('chicken type: pasta,Soup  author: olson')
+        self.assertEqual(query.keywords, (('TYPE:', ('PASTA', 'SOUP')), ('AUTHOR:', ('OLSON',))))
+        self.assertEqual(query.free_tokens, ('CHICKEN',))
+
+    def test_keyword_without_value_is_ignored(self):
+        """
+        Tests that a trailing keyword or a keyword followed by a keyword is ignored.
+        """
+        self.assertEqual(parse_search('soup TYPE:').keywords, ())
+        query = parse_search('COOKBOOK: TYPE: pasta')
+        self.assertEqual(query.keywords, (('TYPE:', ('PASTA',)),))
+
+    def test_time_keywords(self):
+        """
+        Tests dates, time periods and that only the first time keyword is used.
+        """
+        query = parse_search('BEFORE: 2023-05-01 AFTER: 01/02/2020')
+        self.assertEqual(query.time_filter, TimeFilter('BEFORE:', date=datetime.date(2023, 5, 1)))
+
+        time_filter = parse_search('OLDER: 3M').time_filter
+        self.assertEqual(time_filter.resolve(datetime.date(2024, 5, 31)), datetime.date(2024, 2, 29))
+
+        with self.assertRaises(SearchSyntaxError):
+            parse_search('AFTER: yesterday')
+        # an ignored time keyword is not parsed
+        self.assertEqual(parse_search('OLDER: 2W AFTER: yesterday').time_filter.keyword, 'OLDER:')
+
+    def test_parse_is_cached(self):
+        """
+        Tests that parsing the same string returns the same query.
+        """
+        self.assertIs(parse_search('pasta TYPE: soup'), parse_search('pasta TYPE: soup'))
+
+    def test_random_search_strings(self):
+        """
+        Tests properties of parsing over random search strings:
+        - only SearchSyntaxError is raised
+        - free tokens are never keywords and all keyword values are non-empty
+        - reordering keyword/value pairs and free tokens and changing case
+          does not change the canonical form
+        """
+        rng = random.Random(29)
+        words = ['pasta', 'Soup', 'a,b', ',', 'x,,y', '2021-03-04', '4W', 'Ü', ':']
+        vocabulary = words + KEYWORD_TOKENS + TIME_KEYWORD_TOKENS
+
+        for _ in range(500):
+            tokens = [rng.choice(vocabulary) for _ in range(rng.randint(0, 8))]
+            try:
+                query = parse_search(' '.join(tokens))
+            except SearchSyntaxError:
+                continue
+
+            for token in query.free_tokens:
+                self.assertNotIn(token, KEYWORD_TOKENS + TIME_KEYWORD_TOKENS)
+            for keyword, values in query.keywords:
+                self.assertIn(keyword, KEYWORD_TOKENS)
+                self.assertTrue(values and all(values))
+
+            # Rebuild the search from its parts in a different order and case
+            parts = [f'{k} {",".join(v)}' for k, v in query.keywords] + list(query.free_tokens)
+            rng.shuffle(parts)
+            shuffled = parse_search(' '.join(p.lower() for p in parts))
+            self.assertEqual(shuffled.canonical_form()[0], query.canonical_form()[0])
+            self.assertEqual(shuffled.canonical_form()[2], query.canonical_form()[2])
+
+
+class SearchCacheTest(TestCase):
+    """Tests for caching of recipe search results."""
+
+    def test_equivalent_searches_share_key(self):
+        """
+        Tests that token order and case do not change the cache key.
+        """
+        key1 = search_cache.cache_key(Search('chicken TYPE: pasta,soup'))
+        key2 = search_cache.cache_key(Search('type: SOUP,Pasta CHICKEN'))
+        self.assertEqual(key1, key2)
+
+    def test_different_searches_have_different_keys(self):
+        """
+        Tests that a keyword value is not confused with a free token.
+        """
+        key1 = search_cache.cache_key(Search('TYPE: pasta'))
+        key2 = search_cache.cache_key(Search('pasta'))
+        self.assertNotEqual(key1, key2)
+
+    def test_bump_changes_key(self):
+        """
+        Tests that bumping the catalogue version invalidates existing keys.
+        """
+        key1 = search_cache.cache_key(Search('pasta'))
+        search_cache.bump_catalogue_version()
+        self.assertNotEqual(key1, search_cache.cache_key(Search('pasta')))
+
+    def test_version_shared_and_never_reused(self):
+        """
+        Tests that the catalogue version is kept in the database (not a
+        per-process cache) and a version rolled back is not used again.
+        """
+        search_cache.bump_catalogue_version()
+        version = search_cache.catalogue_version()
+        caches['default'].clear()
+        self.assertEqual(search_cache.catalogue_version(), version)
+        self.assertEqual(CacheVersion.objects.get(name=search_cache.CATALOGUE_VERSION_KEY).version, version)
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            search_cache.bump_catalogue_version()
+            rolled_back = search_cache.catalogue_version()
+            raise RuntimeError()
+        self.assertEqual(search_cache.catalogue_version(), version)
+        search_cache.bump_catalogue_version()
+        self.assertNotIn(search_cache.catalogue_version(), (version, rolled_back))
+
+
+class SearchTimeFilterTest(TestCase):
+    """Tests for searching recipes by meal dates."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stew, cls.chili, cls.toast = [Recipe.objects.create(name=n) for n in ('Stew', 'Chili', 'Toast')]
+        for recipe, date in ((cls.stew, '2020-01-10'), (cls.stew, '2023-06-01'), (cls.chili, '2021-03-05')):
+            Meal.objects.create(recipe=recipe, scheduled_date=datetime.date.fromisoformat(date))
+
+    def found(self, search_string):
+        return sorted(r.name for r in Search(search_string).find())
+
+    def test_time_keywords(self):
+        """
+        Tests that time keywords limit recipes to those with meals in the time slice.
+        """
+        self.assertEqual(self.found('BEFORE: 2021-01-01'), ['Stew'])
+        self.assertEqual(self.found('AFTER: 2021-01-01'), ['Chili', 'Stew'])
+        self.assertEqual(self.found('OLDER: 2022-01-01'), ['Chili'])
+        self.assertEqual(self.found('s AFTER: 2022-01-01'), ['Stew'])
+
+
+class PrefixIndexTest(TestCase):
+    """Tests for the recipe typeahead index."""
+
+    def setUp(self):
+        recipes = [
+            (1, 'Chicken Curry', 'Curry Book'),
+            (2, 'Chickpea Salad', None),
+            (3, 'Beef Stew', 'Slow Cooker'),
+        ]
+        tags = [(3, 'Comfort Food'), (2, 'Vegetarian')]
+        self.index = PrefixIndex(recipes, tags)
+
+    def test_prefix_of_any_word(self):
+        """
+        Tests that a prefix matches any word of the recipe name, ordered by name.
+        """
+        self.assertEqual([r[0] for r in self.index.suggest('chick')], [1, 2])
+        self.assertEqual([r[0] for r in self.index.suggest('CUR')], [1])
+
+    def test_prefix_of_tag(self):
+        """
+        Tests that recipe tags are matched.
+        """
+        self.assertEqual(self.index.suggest('veg'), [(2, 'Chickpea Salad', '')])
+
+    def test_all_words_must_match(self):
+        """
+        Tests that every typed word must match the same recipe.
+        """
+        self.assertEqual([r[0] for r in self.index.suggest('chi sal')], [2])
+        self.assertEqual(self.index.suggest('chi stew'), [])
+
+    def test_limit(self):
+        """
+        Tests that the number of suggestions is limited.
+        """
+        self.assertEqual(len(self.index.suggest('c', limit=1)), 1)
+
+    def test_index_kept_while_planning(self):
+        """
+        Tests that the index is only rebuilt when recipe names change, not
+        when meals or ratings are written.
+        """
+        recipe = Recipe.objects.create(name='Pot Roast')
+        diner = Diner.objects.create(first_name='Ann', last_name='Smith')
+        index = typeahead.get_index()
+
+        Meal.objects.create(recipe=recipe, scheduled_date=datetime.date(2024, 1, 1), was_made=True)
+        RecipeRating.objects.create(recipe=recipe, diner=diner, rating=4)
+        with self.assertNumQueries(1):
+            self.assertIs(typeahead.get_index(), index)
+
+        recipe.name = 'Sunday Roast'
+        recipe.save()
+        self.assertEqual([r[1] for r in typeahead.suggest('sun')], ['Sunday Roast'])
+
+
+class RatingTotalsTest(TestCase):
+    """Tests for the rating totals kept on recipes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipe = Recipe.objects.create(name='Stew')
+        cls.other_recipe = Recipe.objects.create(name='Chili')
+        cls.diners = [Diner.objects.create(first_name=n, last_name='Smith') for n in ('Ann', 'Bob')]
+
+    def _recipe(self, recipe):
+        return Recipe.objects.get(pk=recipe.pk)
+
+    def test_totals_follow_rating_writes(self):
+        """
+        Tests that creating, changing, moving and deleting ratings updates the totals.
+        """
+        rating = RecipeRating.objects.create(recipe=self.recipe, diner=self.diners[0], rating=5)
+        RecipeRating.objects.create(recipe=self.recipe, diner=self.diners[1], rating=2)
+        self.assertEqual(self._recipe(self.recipe).rating, 3.5)
+
+        rating = RecipeRating.objects.get(pk=rating.pk)
+        rating.rating = 4
+        rating.save()
+        self.assertEqual(self._recipe(self.recipe).rating_as_string, '3.0')
+
+        rating.recipe = self.other_recipe
+        rating.save()
+        self.assertEqual(self._recipe(self.recipe).rating, 2)
+        self.assertEqual(self._recipe(self.other_recipe).rating, 4)
+
+        self.diners[1].delete()
+        self.assertEqual(self._recipe(self.recipe).rating_as_string, '-')
+
+    def test_reading_rating_needs_no_query(self):
+        """
+        Tests that a rating is read from the recipe without a query.
+        """
+        recipe = self._recipe(self.recipe)
+        with self.assertNumQueries(0):
+            self.assertEqual(recipe.rating, 0)
+
+    def test_recalculate(self):
+        """
+        Tests that wrong totals are found and corrected.
+        """
+        RecipeRating.objects.create(recipe=self.recipe, diner=self.diners[0], rating=3)
+        Recipe.objects.filter(pk=self.recipe.pk).update(rating_sum=10)
+
+        self.assertEqual(Recipe.recalculate_rating_totals(), 1)
+        self.assertEqual(self._recipe(self.recipe).rating, 3)
+        self.assertEqual(Recipe.recalculate_rating_totals(), 0)
+
+
+class RecipeRankingTest(TestCase):
+    """Tests for the ranking score kept on recipes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipes = [Recipe.objects.create(name=n) for n in ('Stew', 'Chili', 'Soup')]
+        cls.diners = [Diner.objects.create(first_name=n, last_name='Smith') for n in ('Ann', 'Bob', 'Cy')]
+
+    def _ranking(self):
+        return list(Recipe.objects.order_by('-ranking_score', 'name').values_list('name', flat=True))
+
+    def test_weighted_rating(self):
+        """
+        Tests that many good ratings rank above a single perfect rating.
+        """
+        RecipeRating.objects.create(recipe=self.recipes[1], diner=self.diners[0], rating=5)
+        for diner, rating in zip(self.diners, (5, 5, 4)):
+            RecipeRating.objects.create(recipe=self.recipes[0], diner=diner, rating=rating)
+        self.assertEqual(self._ranking(), ['Stew', 'Chili', 'Soup'])
+        self.assertLess(ranking_score(1, 1, 0), ranking_score(0, 0, 0))
+
+        RecipeRating.objects.filter(recipe=self.recipes[0]).first().delete()
+        RecipeRating.objects.create(recipe=self.recipes[1], diner=self.diners[1], rating=5)
+        self.assertEqual(self._ranking(), ['Chili', 'Stew', 'Soup'])
+
+    def test_meals_made(self):
+        """
+        Tests that meals made raise the ranking and are recounted when moved or deleted.
+        """
+        meal = Meal.objects.create(scheduled_date=datetime.date(2024, 1, 1), recipe=self.recipes[2])
+        self.assertEqual(Recipe.objects.get(pk=self.recipes[2].pk).times_made, 0)
+
+        meal.was_made = True
+        meal.save()
+        self.assertEqual(self._ranking(), ['Soup', 'Chili', 'Stew'])
+
+        meal = Meal.objects.get(pk=meal.pk)
+        meal.recipe = self.recipes[0]
+        meal.save()
+        self.assertEqual(self._ranking(), ['Stew', 'Chili', 'Soup'])
+
+        meal.delete()
+        self.assertEqual(Recipe.objects.get(pk=self.recipes[0].pk).times_made, 0)
+
+    def test_refresh_rankings(self):
+        """
+        Tests that wrong rankings are found and corrected.
+        """
+        Recipe.objects.filter(pk=self.recipes[0].pk).update(ranking_score=0, times_made=2)
+        self.assertEqual(Recipe.refresh_rankings(count_meals=True), 1)
+        self.assertEqual(Recipe.refresh_rankings(count_meals=True), 0)
+        self.assertEqual(Recipe.objects.get(pk=self.recipes[0].pk).times_made, 0)
+
+
+class RecipeListTest(TestCase):
+    """Tests for the recipe list view."""
+
+    @classmethod
+    def setUpTestData(cls):
+        authors = Author.objects.bulk_create(
+            [Author(first_name='Author', last_name=str(i)) for i in range(20)])
+        cookbooks = Cookbook.objects.bulk_create(
+            [Cookbook(title=f'Book {i:02}', author=authors[i % 20], publish_date=2000) for i in range(40)])
+        Recipe.objects.bulk_create(
+            [Recipe(name=f'Recipe {i:05}', cook_book=cookbooks[i % 40] if i % 7 else None,
+                    rating_sum=i % 5 + 1, rating_count=1 if i % 3 else 0)
+             for i in range(10000)])
+
+    def _recipe_names(self, response):
+        return [r.name for r in response.context['recipes']]
+
+    def test_query_budget(self):
+        """
+        Tests that a page of the list costs the same few queries at 10k recipes.
+        """
+        for sort in ('name', '-cookbook', 'rating'):
+            with self.assertNumQueries(2):  # count and page
+                response = self.client.get('/recipe/list', {'sort': sort, 'page': 3})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['recipes']), PAGE_SIZE)
+
+    def test_sort_and_page(self):
+        """
+        Tests sorting in both directions and paging.
+        """
+        response = self.client.get('/recipe/list', {'sort': '-name', 'page': 2})
+        self.assertEqual(self._recipe_names(response)[0], 'Recipe 09949')
+        self.assertEqual(response.context['next_sort']['name'], 'name')
+
+        response = self.client.get('/recipe/list', {'sort': '-rating'})
+        self.assertTrue(all(r.rating == 5 for r in response.context['recipes']))
+
+    def test_invalid_sort_and_page(self):
+        """
+        Tests that invalid sort and page values fall back to the defaults.
+        """
+        response = self.client.get('/recipe/list', {'sort': 'notes', 'page': 'x'})
+        self.assertEqual(response.context['sort'], 'name')
+        self.assertEqual(self._recipe_names(response)[0], 'Recipe 00000')
+
+
+class RecipeCatalogueTest(TestCase):
+    """Tests for the recipe catalogue API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Anna', last_name='Olson')
+        cookbook = Cookbook.objects.create(title='Bake', author=author, publish_date=2010)
+        cls.pie = Recipe.objects.create(name='Pie', cook_book=cookbook, rating_sum=9, rating_count=2)
+        cls.pie.recipe_types.add(RecipeType.objects.create(name='Dessert'))
+        Recipe.objects.create(name='Toast')
+        Meal.objects.create(scheduled_date=datetime.date(2024, 3, 1), was_made=True, recipe=cls.pie)
+
+    def _catalogue(self, **params):
+        response = self.client.get('/recipe/api/recipes', params)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_default_fields(self):
+        """
+        Tests that only the recipe's own fields are returned by default.
+        """
+        recipes = self._catalogue()
+        self.assertEqual([r['name'] for r in recipes], ['Pie', 'Toast'])
+        self.assertEqual(set(recipes[0]), {'id', 'name', 'page_number', 'url_ref', 'notes'})
+
+    def test_all_fields(self):
+        """
+        Tests the optional fields.
+        """
+        pie, toast = self._catalogue(fields='cookbook,author,tags,rating,history')
+        self.assertEqual(pie['cookbook']['title'], 'Bake')
+        self.assertEqual(pie['author']['last_name'], 'Olson')
+        self.assertEqual(pie['tags'], ['Dessert'])
+        self.assertEqual(pie['rating'], {'average': 4.5, 'count': 2})
+        self.assertEqual(pie['history'], {'times_made': 1, 'last_made': '2024-03-01'})
+        self.assertIsNone(toast['cookbook'])
+        self.assertEqual(toast['tags'], [])
+
+    def test_chunks(self):
+        """
+        Tests that recipes are read in chunks, with one tag query per chunk.
+        """
+        with mock.patch.object(views, 'CATALOGUE_CHUNK_SIZE', 1):
+            with self.assertNumQueries(5):  # 3 chunks (last is empty), 2 tag queries
+                recipes = self._catalogue(fields='tags')
+        self.assertEqual(len(recipes), 2)
+
+    def test_unknown_field(self):
+        """
+        Tests that unknown fields are rejected.
+        """
+        response = self.client.get('/recipe/api/recipes', {'fields': 'tags,calories'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RatingStatisticsTest(TestCase):
+    """Tests for recipe rating statistics."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipes = [Recipe.objects.create(name=n) for n in ('Stew', 'Chili', 'Toast')]
+        cls.diners = [Diner.objects.create(first_name=n, last_name=n) for n in ('Ann', 'Bob', 'Cy')]
+        for diner, rating in zip(cls.diners, (5, 5, 2)):
+            RecipeRating.objects.create(recipe=cls.recipes[0], diner=diner, rating=rating)
+        RecipeRating.objects.create(recipe=cls.recipes[1], diner=cls.diners[0], rating=4)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_statistics_in_one_query(self):
+        """
+        Tests histogram, count, mean and diners of several recipes from one query,
+        then from the cache.
+        """
+        ids = [r.id for r in self.recipes]
+        # the statistics, and the version of the cached statistics
+        with self.assertNumQueries(2):
+            statistics = rating_stats.rating_statistics(ids)
+        with self.assertNumQueries(1):
+            self.assertEqual(rating_stats.rating_statistics(ids), statistics)
+
+        stew = statistics[self.recipes[0].id]
+        self.assertEqual(stew['histogram'], {1: 0, 2: 1, 3: 0, 4: 0, 5: 2})
+        self.assertEqual((stew['count'], stew['mean']), (3, 4))
+        self.assertEqual([d['diner'] for d in stew['diners']], ['Ann Ann', 'Bob Bob', 'Cy Cy'])
+        self.assertEqual(statistics[self.recipes[2].id]['count'], 0)
+
+    def test_invalidated_on_rating_write(self):
+        """
+        Tests that cached statistics are replaced when a rating changes.
+        """
+        rating_stats.recipe_statistics(self.recipes[1].id)
+        rating = RecipeRating.objects.get(recipe=self.recipes[1])
+        rating.rating = 1
+        rating.save()
+        self.assertEqual(rating_stats.recipe_statistics(self.recipes[1].id)['mean'], 1)
+
+        rating.delete()
+        self.assertEqual(rating_stats.recipe_statistics(self.recipes[1].id)['count'], 0)
+
+    def test_invalidated_by_other_process(self):
+        """
+        Tests that statistics cached by a process are replaced when another
+        process (sharing only the database) changes the ratings.
+        """
+        rating_stats.recipe_statistics(self.recipes[1].id)
+        RecipeRating.objects.filter(recipe=self.recipes[1]).update(rating=2)
+        CacheVersion.bump(f'{rating_stats.STATS_KEY_PREFIX}:{self.recipes[1].id}')
+        self.assertEqual(rating_stats.recipe_statistics(self.recipes[1].id)['mean'], 2)
+
+    def test_invalidated_per_recipe(self):
+        """
+        Tests that a rating change only replaces the statistics of its recipe.
+        """
+        ids = [r.id for r in self.recipes]
+        rating_stats.rating_statistics(ids)
+        rating_stats.invalidate([self.recipes[1].id])
+        # the versions, and the statistics of the changed recipe only
+        with CaptureQueriesContext(connection) as queries:
+            rating_stats.rating_statistics(ids)
+        self.assertEqual(len(queries), 2)
+        self.assertIn(f'IN ({self.recipes[1].id})', queries[1]['sql'])
+
+    def test_pages(self):
+        """
+        Tests the rating list, top rated and statistics API pages.
+        """
+        response = self.client.get(f'/recipe/{self.recipes[0].id}/recipe_ratings')
+        self.assertEqual(response.context['recipe_rating'], '4.0')
+
+        # equal average, so recipe with more ratings ranked first
+        response = self.client.get('/recipe/top_rated')
+        self.assertEqual([r['recipe'].name for r in response.context['rated_recipes']], ['Stew', 'Chili'])
+
+        response = self.client.get('/recipe/api/ratings', {'ids': f'{self.recipes[1].id},99999'})
+        self.assertEqual([r['mean'] for r in response.json()['ratings']], [4])
+        # user names are logins, not shown to anyone
+        self.assertEqual(response.json()['ratings'][0]['diners'],
+                         [{'diner_id': self.diners[0].id, 'diner': 'Ann Ann', 'rating': 4}])
+
+
+class BulkRatingsTest(TestCase):
+    """Tests for saving many ratings at once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipes = [Recipe.objects.create(name=n) for n in ('Stew', 'Chili')]
+        cls.diners = [Diner.objects.create(first_name=n, last_name='Smith') for n in ('Ann', 'Bob')]
+        RecipeRating.objects.create(recipe=cls.recipes[0], diner=cls.diners[0], rating=2)
+        RecipeRating.objects.create(recipe=cls.recipes[0], diner=cls.diners[1], rating=4)
+
+    def test_save_ratings(self):
+        """
+        Tests that ratings are created, updated and recipe totals follow.
+        """
+        stew, chili = self.recipes
+        ann, bob = self.diners
+        counts = save_ratings([(ann.id, stew.id, 5), (bob.id, stew.id, 4),
+                               (ann.id, chili.id, 1), (ann.id, chili.id, 3)])
+        self.assertEqual(counts, {'created': 1, 'updated': 1, 'unchanged': 1})
+
+        self.assertEqual(Recipe.objects.get(pk=stew.pk).rating, 4.5)
+        self.assertEqual(Recipe.objects.get(pk=chili.pk).rating, 3)
+        self.assertFalse(RecipeRating.objects.values('recipe', 'diner').annotate(
+            n=Count('id')).filter(n__gt=1).exists())
+
+    def test_invalid_ratings(self):
+        """
+        Tests that nothing is saved if any rating is invalid.
+        """
+        diner, recipe = self.diners[0].id, self.recipes[1].id
+        for ratings in ([(diner, recipe, 6)], [(diner, recipe, 4.7)], [(diner, recipe, None)],
+                        [(None, recipe, 3)], [(diner, 'stew', 3)],
+                        [(diner, recipe, 3), (99999, recipe, 3)]):
+            with self.assertRaises(ValueError):
+                save_ratings(ratings)
+        self.assertEqual(RecipeRating.objects.count(), 2)
+
+    def test_bulk_endpoint_invalid_ids(self):
+        """
+        Tests that the bulk rating API rejects missing ids and partial ratings.
+        """
+        self.client.force_login(User.objects.create_superuser('admin', password='x'))
+        for rating in ({'diner': None, 'recipe': self.recipes[1].id, 'rating': 3},
+                       {'diner': self.diners[0].id, 'recipe': self.recipes[1].id, 'rating': 4.7}):
+            response = self.client.post('/recipe/api/ratings/bulk', json.dumps({'ratings': [rating]}),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_unique_rating_per_diner(self):
+        """
+        Tests that a diner can not rate the same recipe twice.
+        """
+        with self.assertRaises(IntegrityError):
+            RecipeRating.objects.create(recipe=self.recipes[0], diner=self.diners[0], rating=1)
+
+    def test_bulk_endpoint(self):
+        """
+        Tests the bulk rating API for a superuser.
+        """
+        self.client.force_login(User.objects.create_superuser('admin', password='x'))
+        response = self.client.post(
+            '/recipe/api/ratings/bulk',
+            json.dumps({'ratings': [{'diner': self.diners[1].id, 'recipe': self.recipes[1].id, 'rating': 5}]}),
+            content_type='application/json')
+        self.assertEqual(response.json(), {'created': 1, 'updated': 0, 'unchanged': 0})
+
+
+class DinerLookupTest(TestCase):
+    """Tests for finding the diner of the current user."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('ann', password='x', first_name='Ann', last_name='Smith')
+
+    def test_diner_created_once(self):
+        """
+        Tests that a diner is created for a user only once.
+        """
+        diner_id = get_user_diner(self.user)
+        self.assertEqual(get_user_diner(self.user), diner_id)
+        self.assertEqual(Diner.objects.get(user_name='ann').id, diner_id)
+
+    def test_user_name_unique(self):
+        """
+        Tests that two diners can not share a user name, but many can have none.
+        """
+        Diner.objects.create(first_name='A', last_name='B')
+        Diner.objects.create(first_name='C', last_name='D')
+        Diner.objects.create(first_name='Ann', last_name='Smith', user_name='ann')
+        with self.assertRaises(IntegrityError):
+            Diner.objects.create(first_name='Ann', last_name='Smith', user_name='ann')
+
+    def test_diner_kept_in_session(self):
+        """
+        Tests that the diner is looked up once per session, and again once
+        forgotten.
+        """
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = {}
+
+        diner_id = get_request_diner(request)
+        self.assertEqual(request.session[SESSION_DINER_KEY]['id'], diner_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_request_diner(request), diner_id)
+
+        Diner.objects.filter(id=diner_id).delete()
+        forget_request_diner(request)
+        new_diner_id = get_request_diner(request)
+        self.assertNotEqual(new_diner_id, diner_id)
+        self.assertEqual(Diner.objects.get(user_name='ann').id, new_diner_id)
+        self.assertEqual(request.session[SESSION_DINER_KEY]['id'], new_diner_id)
+
+    def test_deleted_diner_looked_up_again(self):
+        """
+        Tests that rating with a deleted diner kept in the session rates as a new diner.
+        """
+        recipe = Recipe.objects.create(name='Stew')
+        self.user.user_permissions.add(*Permission.objects.filter(
+            codename__in=['add_reciperating', 'change_reciperating']))
+        self.client.force_login(self.user)
+        self.client.get(f'/recipe/{recipe.id}/recipe_ratings/l-rating')
+        old_diner_id = self.client.session[SESSION_DINER_KEY]['id']
+
+        Diner.objects.filter(id=old_diner_id).delete()
+        response = self.client.post(f'/recipe/{recipe.id}/recipe_ratings/l-rating',
+                                    {'diner': old_diner_id, 'recipe': recipe.id, 'rating': 4})
+        self.assertEqual(response.status_code, 302)
+        rating = RecipeRating.objects.get(recipe=recipe)
+        self.assertEqual((rating.diner.user_name, rating.rating), ('ann', 4))
+        self.assertEqual(self.client.session[SESSION_DINER_KEY]['id'], rating.diner_id)
@@ -0,0 +1,131 @@
+'''
+  Name       :  typeahead.py
+  Description:  Prefix index used to suggest recipes while the user types
+                Each word of a recipe's name and each of its recipe tags
+                is kept in a sorted list, so the recipes matching a prefix
+                are found with a binary search instead of a database query.
+
+  The index is held in memory by each process and rebuilt the first time
+  it is used after a recipe's name, tags or cookbook change. It has its own
+  version (CacheVersion), bumped only by those changes (see signals.py), so
+  planning meals or rating recipes does not rebuild it.
+'''
+
+import bisect
+import threading
+
+from .models import CacheVersion, Recipe
+
+INDEX_VERSION_KEY = 'recipe_typeahead_version'
+
+# Default and maximum number of suggestions returned
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+
+class PrefixIndex:
+    '''
+    Sorted index of search terms to recipes
+    '''
+
+    def __init__(self, recipes, recipe_tags):
+        '''
+        Constructor
+        @param recipes: iterable of (id, name, cookbook title) tuples
+        @param recipe_tags: iterable of (recipe id, tag name) tuples
+        '''
+        self._recipes = {}
+        terms = set()
+        for recipe_id, name, cookbook in recipes:
+            self._recipes[recipe_id] = (name, cookbook or '')
+            for word in name.lower().split():
+                terms.add((word, recipe_id))
+
+        for recipe_id, tag in recipe_tags:
+            if recipe_id in self._recipes:
+                for word in tag.lower().split():
+                    terms.add((word, recipe_id))
+
+        self._terms = sorted(terms)
+        self._words = [t[0] for t in self._terms]
+
+    def __len__(self):
+        return len(self._recipes)
+
+    def _prefix_matches(self, prefix: str) -> set:
+        '''
+        Return ids of recipes with a term starting with prefix
+        '''
+        matches = set()
+        idx = bisect.bisect_left(self._words, prefix)
+        while idx < len(self._words) and self._words[idx].startswith(prefix):
+            matches.add(self._terms[idx][1])
+            idx += 1
+        return matches
+
+    def suggest(self, query: str, limit: int=SUGGEST_LIMIT) -> list:
+        '''
+        Return recipes where every word of the query is the start of a
+        word in the recipe's name or tags
+
+        @param query: text typed by the user
+        @param limit: maximum number of recipes to return
+        @return list of (id, name, cookbook title) tuples, ordered by name
+        '''
+        words = query.lower().split()
+        if not words:
+            return []
+
+        # Start from the most selective (longest) word, then narrow down
+        words.sort(key=len, reverse=True)
+        matches = self._prefix_matches(words[0])
+        for word in words[1:]:
+            if not matches:
+                break
+            matches &= self._prefix_matches(word)
+
+        ranked = sorted(matches, key=lambda r: (self._recipes[r][0].lower(), r))
+        return [(r, *self._recipes[r]) for r in ranked[:limit]]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def index_version() -> int:
+    '''
+    Return the current version of the recipe names, tags and cookbooks indexed
+    '''
+    return CacheVersion.current(INDEX_VERSION_KEY)
+
+
+def bump_index_version():
+    '''
+    Rebuild the prefix index (in every process) when next used
+    '''
+    CacheVersion.bump(INDEX_VERSION_KEY)
+
+
+def get_index() -> PrefixIndex:
+    '''
+    Return the prefix index for the current recipe catalogue, building it if needed
+    '''
+    global _index, _index_version
+
+    version = index_version()
+    with _index_lock:
+        if _index is None or _index_version != version:
+            recipes = Recipe.objects.values_list('id', 'name', 'cook_book__title')
+            recipe_tags = Recipe.recipe_types.through.objects.values_list(
+                'recipe_id', 'recipetype__name')
+            _index = PrefixIndex(recipes, recipe_tags)
+            _index_version = version
+        return _index
+
+
+def suggest(query: str, limit: int=SUGGEST_LIMIT) -> list:
+    '''
+    Return recipes matching the text typed by the user (see PrefixIndex.suggest)
+    '''
+    return get_index().suggest(query, limit)
@@ -6,6 +6,10 @@ from . import views
 urlpatterns = [
     path('<int:id>', views.detail, name='recipe_detail'),
     path('list', views.recipes, name='recipes'),
+    path('api/recipes', views.recipe_catalogue, name='recipe_catalogue'),
+    path('api/ratings', views.rating_statistics, name='rating_statistics'),
+    path('api/ratings/bulk', views.bulk_update_ratings, name='bulk_update_ratings'),
+    path('top_rated', views.top_rated, name='top_rated'),
     path('new', views.new, name='recipe_new'),
     path('recipe_type/create', views.RecipeTypeCreatePopup, name='recipe_type_create'),
     path('<int:recipe_id>/recipe_ratings', views.ratings_list, name='recipe_rating_list'),
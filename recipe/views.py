@@ -5,11 +5,19 @@ Date:
 Author:         M. Schmidt
 '''
 
+import json
+
 from datetime import datetime
 from django.contrib.auth.decorators import login_required, permission_required
-from django.http import HttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import FloatField, Max, Q
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.shortcuts import render, get_object_or_404, redirect
+from django.views.decorators.http import require_POST
 
+from home.pagination import sorted_page
+from . import bulk_ratings, rating_stats
 from .models import Recipe, Diner, RecipeRating
 from .forms import RatingForm, RecipeForm, RecipeTypeForm, DinerForm
 
@@ -23,6 +31,14 @@ def detail(request, id):
     current_user = request.user
     if request.method == "POST": #MIGHT NOT BE NEEDED: and current_user.has_perm('recipe.change_recipe'):
         form = RecipeForm(data=request.POST, instance=recipe)
+        if not form.is_valid() and 'diner' in form.errors and not current_user.is_superuser:
+            # diner kept in the session was deleted since: rate as the
+            # user's diner, looked up (or added) again
+            forget_request_diner(request)
+            data = request.POST.copy()
+            data['diner'] = get_request_diner(request)
+            form = RatingForm(data=data, files=request.FILES)
+
         if form.is_valid():
             form.save()
             return redirect("recipes")
@@ -51,6 +67,14 @@ def new(request):
     '''
     if request.method == "POST":
         form = RecipeForm(data=request.POST, files=request.FILES, readonly_form=False)
+        if not form.is_valid() and 'diner' in form.errors and not current_user.is_superuser:
+            # diner kept in the session was deleted since: rate as the
+            # user's diner, looked up (or added) again
+            forget_request_diner(request)
+            data = request.POST.copy()
+            data['diner'] = get_request_diner(request)
+            form = RatingForm(data=data, files=request.FILES)
+
         if form.is_valid():
             form.save()
             return redirect("recipes")
@@ -78,6 +102,14 @@ def diner_detail(request):
 
     if request.method == "POST":
         form = DinerForm(request.POST, instance=diner)
+        if not form.is_valid() and 'diner' in form.errors and not current_user.is_superuser:
+            # diner kept in the session was deleted since: rate as the
+            # user's diner, looked up (or added) again
+            forget_request_diner(request)
+            data = request.POST.copy()
+            data['diner'] = get_request_diner(request)
+            form = RatingForm(data=data, files=request.FILES)
+
         if form.is_valid():
             form.save()
             return redirect("home")
@@ -98,19 +130,19 @@ def ratings_list(request, recipe_id):
     '''
     View to see all the ratings for a recipe
     '''
-    recipe = Recipe.objects.get(id=recipe_id)
-    recipe_ratings = recipe.reciperating_set.all()  #type: ignore
+    recipe = get_object_or_404(Recipe, id=recipe_id)
+    statistics = rating_stats.recipe_statistics(recipe.id)
 
     # check if current user has a rating to update
     # if not, flag, so "New" button can be enabled.
-    current_user = request.user
-    diner_id = get_user_diner(current_user)
-    diner_has_rating = recipe_ratings.filter(diner=diner_id).count() != 0
+    diner_id = get_request_diner(request)
+    diner_has_rating = any(r['diner_id'] == diner_id for r in statistics['diners'])
 
     return render(request, "recipe/rating_list.html",
         {
-            "recipe_ratings": recipe_ratings,
-            "recipe_rating": recipe.rating_as_string,
+            "recipe_ratings": statistics['diners'],
+            "rating_histogram": _histogram_rows(statistics),
+            "recipe_rating": '-' if statistics['count'] == 0 else str(statistics['mean']),
             "recipe_name": recipe.name,
             "recipe_id": recipe_id,
             "diner_has_rating": diner_has_rating,
@@ -121,24 +153,291 @@ def ratings_list(request, recipe_id):
     )
 
 
-def recipes(request):
+# Number of recipes shown on the top rated page
+TOP_RATED_COUNT = 25
+
+
+def top_rated(request):
     '''
-    View to list all recipes
+    View to list the best recipes with their rating statistics
+    Recipes are ordered by their stored ranking score (see recipe.models.ranking_score)
     '''
 
-    # Get all recipes, then sort alphabetically
-    all_recipes = Recipe.objects.all().order_by('name')
+    top_recipes = list(Recipe.objects.filter(
+        rating_count__gt=0
+    ).select_related(
+        'cook_book__author'
+    ).order_by('-ranking_score', 'name', 'id')[:TOP_RATED_COUNT])
+
+    statistics = rating_stats.rating_statistics([r.id for r in top_recipes])
+    rated_recipes = [
+        {
+            "recipe": recipe,
+            "statistics": statistics[recipe.id],
+            "histogram": _histogram_rows(statistics[recipe.id]),
+        }
+        for recipe in top_recipes
+    ]
 
-    return render(request, "recipe/list.html",
+    return render(request, "recipe/top_rated.html",
         {
-            "recipes": all_recipes,
-            "table_name": "recipes",
+            "rated_recipes": rated_recipes,
+            "table_name": "top_rated",
             "year": datetime.now().year,
             "company": "Schmidtheads Inc.",
         }
     )
 
 
+# Maximum number of recipes the rating statistics API returns at once
+RATING_STATS_MAX_RECIPES = 500
+
+
+def rating_statistics(request):
+    '''
+    API view returning rating statistics (histogram, count, mean and ratings by
+    diner) of recipes given in the query string, e.g. ?ids=1,2,3
+    The API is public, so diners' user names (their logins) are left out
+    '''
+
+    try:
+        recipe_ids = [int(i) for i in request.GET.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return JsonResponse({'error': 'Recipe ids must be integers'}, status=400)
+
+    if len(recipe_ids) > RATING_STATS_MAX_RECIPES:
+        return JsonResponse(
+            {'error': f'At most {RATING_STATS_MAX_RECIPES} recipes can be requested'},
+            status=400)
+
+    # Only report recipes that exist
+    existing_ids = set(Recipe.objects.filter(id__in=recipe_ids).values_list('id', flat=True))
+    statistics = rating_stats.rating_statistics([i for i in recipe_ids if i in existing_ids])
+
+    return JsonResponse({'ratings': [_public_statistics(s) for s in statistics.values()]})
+
+
+def _public_statistics(statistics: dict) -> dict:
+    '''
+    Return rating statistics without the diners' user names
+    '''
+    diners = [{k: v for k, v in diner.items() if k != 'user_name'} for diner in statistics['diners']]
+    return {**statistics, 'diners': diners}
+
+
+@require_POST
+@permission_required(['recipe.add_reciperating', 'recipe.change_reciperating'], raise_exception=True)
+def bulk_update_ratings(request):
+    '''
+    API view to create or update many ratings at once
+    Request body is JSON: {"ratings": [{"diner": id, "recipe": id, "rating": 1-5}, ...]}
+    Only a superuser can rate recipes for diners other than themselves
+    '''
+
+    try:
+        body = json.loads(request.body)
+        ratings = [(r['diner'], r['recipe'], r['rating']) for r in body['ratings']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse(
+            {'error': 'Expected {"ratings": [{"diner": id, "recipe": id, "rating": 1-5}, ...]}'},
+            status=400)
+
+    current_user = request.user
+    if not current_user.is_superuser:
+        diner_id = get_request_diner(request)
+        if any(str(diner) != str(diner_id) for diner, _, _ in ratings):
+            return JsonResponse({'error': 'Can only rate recipes for yourself'}, status=403)
+
+    try:
+        counts = bulk_ratings.save_ratings(ratings)
+    except ValueError as e:
+        if not current_user.is_superuser and not Diner.objects.filter(id=diner_id).exists():
+            # diner kept in the session was deleted since
+            forget_request_diner(request)
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse(counts)
+
+
+def _histogram_rows(statistics: dict) -> list:
+    '''
+    Return histogram of rating statistics as (rating, number of ratings)
+    tuples, highest rating first, for display in templates
+    '''
+    return sorted(statistics['histogram'].items(), reverse=True)
+
+
+def _rating_average():
+    '''
+    Return expression calculating a recipe's average rating (0 if not rated)
+    from its rating totals, so recipes can be sorted by it in the database
+    '''
+    return Coalesce(
+        Cast('rating_sum', FloatField()) / NullIf('rating_count', 0),
+        0.0,
+        output_field=FloatField())
+
+
+# Orders the recipe list can be sorted by (see home.pagination.sorted_page)
+RECIPE_LIST_SORTS = {
+    'name': ('name', 'id'),
+    'cookbook': ('cook_book__title', 'name', 'id'),
+    'rating': ('rating_avg', 'name', 'id'),
+    'ranking': ('ranking_score', 'name', 'id'),
+}
+
+
+def recipes(request):
+    '''
+    View to list recipes, one page at a time
+    The sort order and page are given in the query string (e.g. ?sort=-rating&page=2)
+    '''
+
+    # Get recipes with their cookbook and author in one query
+    # Rating average calculated in the database so the list can be sorted by it
+    all_recipes = Recipe.objects.select_related('cook_book__author').annotate(
+        rating_avg=_rating_average())
+
+    context = sorted_page(request, all_recipes, RECIPE_LIST_SORTS, 'name')
+    context.update({
+        "recipes": context['page_obj'],
+        "table_name": "recipes",
+        "year": datetime.now().year,
+        "company": "Schmidtheads Inc.",
+    })
+
+    return render(request, "recipe/list.html", context)
+
+
+# Optional fields of the recipe catalogue API, chosen with ?fields=
+CATALOGUE_FIELDS = ['cookbook', 'author', 'tags', 'rating', 'history']
+# Number of recipes read from the database at a time by the catalogue API
+CATALOGUE_CHUNK_SIZE = 500
+
+
+def recipe_catalogue(request):
+    '''
+    API view streaming all recipes as a JSON list, ordered by id
+
+    Each recipe has its id, name, page_number, url_ref and notes. Other fields
+    are only included (and read from the database) when listed in the query
+    string, e.g. ?fields=cookbook,tags: cookbook, author, tags, rating, history
+    '''
+
+    fields_value = request.GET.get('fields', '')
+    fields = [f.strip().lower() for f in fields_value.split(',') if f.strip()]
+    unknown_fields = [f for f in fields if f not in CATALOGUE_FIELDS]
+    if unknown_fields:
+        return JsonResponse(
+            {'error': f'Unknown field(s): {", ".join(unknown_fields)}',
+             'fields': CATALOGUE_FIELDS},
+            status=400)
+
+    response = StreamingHttpResponse(
+        _stream_catalogue(set(fields)), content_type='application/json')
+    return response
+
+
+def _stream_catalogue(fields: set):
+    '''
+    Generator returning the recipe catalogue as chunks of JSON text
+    '''
+    encoder = DjangoJSONEncoder()
+
+    yield '['
+    first = True
+    for recipe in _catalogue_recipes(fields):
+        yield ('' if first else ',') + encoder.encode(recipe)
+        first = False
+    yield ']'
+
+
+def _catalogue_recipes(fields: set):
+    '''
+    Generator returning a dictionary for each recipe in the catalogue
+
+    Recipes are read in chunks (by id) so memory use does not depend on the
+    size of the catalogue; only the joins and aggregates needed for the
+    requested fields are part of the query.
+    '''
+    columns = ['id', 'name', 'page_number', 'url_ref', 'notes']
+    if 'cookbook' in fields:
+        columns += ['cook_book_id', 'cook_book__title']
+    if 'author' in fields:
+        columns += ['cook_book__author_id', 'cook_book__author__first_name',
+                    'cook_book__author__last_name']
+    if 'rating' in fields:
+        columns += ['rating_sum', 'rating_count']
+
+    recipe_qs = Recipe.objects.order_by('id')
+    if 'history' in fields:
+        recipe_qs = recipe_qs.annotate(
+            last_made=Max('meal__scheduled_date', filter=Q(meal__was_made=True)))
+        columns += ['times_made', 'last_made']
+    recipe_qs = recipe_qs.values(*columns)
+
+    last_id = 0
+    while True:
+        rows = list(recipe_qs.filter(id__gt=last_id)[:CATALOGUE_CHUNK_SIZE])
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+
+        tags = {}
+        if 'tags' in fields:
+            recipe_tags = Recipe.recipe_types.through.objects.filter(
+                recipe_id__in=[r['id'] for r in rows]
+            ).order_by('recipetype__name').values_list('recipe_id', 'recipetype__name')
+            for recipe_id, tag in recipe_tags:
+                tags.setdefault(recipe_id, []).append(tag)
+
+        for row in rows:
+            yield _catalogue_entry(row, fields, tags)
+
+        if len(rows) < CATALOGUE_CHUNK_SIZE:
+            break
+
+
+def _catalogue_entry(row: dict, fields: set, tags: dict) -> dict:
+    '''
+    Build the catalogue API dictionary for a recipe row
+    '''
+    entry = {
+        'id': row['id'],
+        'name': row['name'],
+        'page_number': row['page_number'],
+        'url_ref': row['url_ref'],
+        'notes': row['notes'],
+    }
+
+    if 'cookbook' in fields:
+        entry['cookbook'] = None if row['cook_book_id'] is None else {
+            'id': row['cook_book_id'],
+            'title': row['cook_book__title'],
+        }
+    if 'author' in fields:
+        entry['author'] = None if row['cook_book__author_id'] is None else {
+            'id': row['cook_book__author_id'],
+            'first_name': row['cook_book__author__first_name'],
+            'last_name': row['cook_book__author__last_name'],
+        }
+    if 'tags' in fields:
+        entry['tags'] = tags.get(row['id'], [])
+    if 'rating' in fields:
+        count = row['rating_count']
+        entry['rating'] = {
+            'average': 0 if count == 0 else round(row['rating_sum'] / count, 2),
+            'count': count,
+        }
+    if 'history' in fields:
+        entry['history'] = {
+            'times_made': row['times_made'],
+            'last_made': row['last_made'],
+        }
+
+    return entry
+
+
 @permission_required('recipe.add_reciperating')
 def update_rating_from_list(request, recipe_id: int):
     '''
@@ -192,19 +491,16 @@ def update_rating(request, recipe_id: int,
             user_id = int(request.POST.get('diner', '-1'))
         else:
         # Use currently logged in user for rating check
+            user_id = get_request_diner(request)
 
-            # Check if rating already exists for user and recipe
-            d_matches = Diner.objects.filter(user_name=current_user.username)
-            user_id = -1 if d_matches.count() == 0 else d_matches[0].id  #type: ignore
-        
+        # Check if rating already exists for user and recipe
         if user_id != -1:
-            r_matches = RecipeRating.objects.filter(
+            rating = RecipeRating.objects.filter(
                 diner=user_id,
                 recipe=recipe_id
-            )
-            if r_matches.count() != 0:
-                rating_id = r_matches[0].id  #type: ignore
-                rating = RecipeRating.objects.get(id=rating_id)
+            ).first()
+            if rating is not None:
+                rating_id = rating.id  #type: ignore
 
         # set up form, depending if creating new rating or updating existing one        
         if user_id == -1 or rating_id == -1:
@@ -212,6 +508,14 @@ def update_rating(request, recipe_id: int,
         else:
             form = RatingForm(data=request.POST, instance=rating)
 
+        if not form.is_valid() and 'diner' in form.errors and not current_user.is_superuser:
+            # diner kept in the session was deleted since: rate as the
+            # user's diner, looked up (or added) again
+            forget_request_diner(request)
+            data = request.POST.copy()
+            data['diner'] = get_request_diner(request)
+            form = RatingForm(data=data, files=request.FILES)
+
         if form.is_valid():
             form.save()
             # Go back to the originating page
@@ -226,17 +530,17 @@ def update_rating(request, recipe_id: int,
     else:
         # Steps
         # 1. Check if current user is in Diner table
-        user_id = get_user_diner(current_user)
+        user_id = get_request_diner(request)
 
         # 2. Check if rating for current user and recipe already exists
         if user_id != -1:  # only find ratings for non-anymous users
-            r_matches = RecipeRating.objects.filter(recipe=recipe_id, diner=user_id)
+            rating = RecipeRating.objects.filter(recipe=recipe_id, diner=user_id).first()
  
             # If it does get the recipe rating row and get recipe rating
             # Also set button label to "Update" or "Create" appropriately
-            if r_matches.count() == 1:
-                rating_id = r_matches[0].id  #type: ignore
-                rating_value = r_matches[0].rating
+            if rating is not None:
+                rating_id = rating.id  #type: ignore
+                rating_value = rating.rating
                 button_label = "Update"
             else:
                 rating_value = 1
@@ -316,18 +620,17 @@ def calculate_recipe_rating(recipe_id):
     '''
 
     recipe = Recipe.objects.get(id=recipe_id)
-    all_ratings = recipe.reciperating_set.all()  #type: ignore
-
-    # Calculate average rating
-    sum_rating = 0
-    for rating in all_ratings:
-        sum_rating += rating.rating
 
-    average_rating = 0 if all_ratings.count() == 0 else sum_rating / all_ratings.count()
+    # Average of the rating totals kept on the recipe
+    average_rating = 0 if recipe.rating_count == 0 else recipe.rating_sum / recipe.rating_count
 
     return average_rating
 
 
+# Session key under which the current user's diner id is kept
+SESSION_DINER_KEY = 'recipe_diner'
+
+
 def get_user_diner(user) -> int:
     '''
     Checks if passed in user is in Diner table
@@ -342,21 +645,50 @@ def get_user_diner(user) -> int:
     if user.is_anonymous:
         return -1
 
-    # Check if current user is in Diner table
-    d_matches = Diner.objects.filter(user_name=user.username)
-
-    # If user does not exist, insert username, first and last name in table; get row ID
-    if d_matches.count() == 0:
-        new_user = Diner.objects.create(
-            user_name = user.username,
-            first_name = user.first_name,
-            last_name = user.last_name
-        )
-        user_id = new_user.id  #type: ignore
-    else:
-        # If user does exist, get row ID
-        # If multiple instances of the same user exist (it shouldn't!),
-        # use the first instance
-        user_id = d_matches[0].id  #type: ignore
+    # Find current user in Diner table (user names are unique);
+    # if user does not exist, insert username, first and last name in table
+    diner, _ = Diner.objects.get_or_create(
+        user_name=user.username,
+        defaults={
+            'first_name': user.first_name,
+            'last_name': user.last_name
+        }
+    )
+
+    return diner.id  #type: ignore
+
+
+def get_request_diner(request) -> int:
+    '''
+    Returns id of Diner for the user making the request (see get_user_diner)
+    The id is kept in the user's session so it is only looked up once; a
+    view that finds the diner no longer exists forgets it (see
+    forget_request_diner), so it is looked up (or added) again
+
+    @params request: request object
+    @return: id of Diner for current user (-1 if anonymous)
+    '''
+
+    user = request.user
+    if user.is_anonymous:
+        return -1
+
+    session_diner = request.session.get(SESSION_DINER_KEY)
+    if session_diner is not None and session_diner.get('user_name') == user.username:
+        return session_diner['id']
+
+    diner_id = get_user_diner(user)
+    request.session[SESSION_DINER_KEY] = {'user_name': user.username, 'id': diner_id}
+
+    return diner_id
+
+
+def forget_request_diner(request):
+    '''
+    Removes the diner kept in the user's session (see get_request_diner),
+    e.g. when it was not found as it was deleted since
+
+    @params request: request object
+    '''
 
-    return user_id
+    request.session.pop(SESSION_DINER_KEY, None)